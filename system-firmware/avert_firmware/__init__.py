@@ -8,6 +8,7 @@ interface (`avertctl`):
     - Data telemetry (`avertctl telemeter`)
     - Power relay switch control (`avertctl toggle-relay`)
     - System configuration (`avertctl configure`)
+    - Archive compaction (`avertctl compact`)
 
 :copyright:
     2023, The AVERT System Team.
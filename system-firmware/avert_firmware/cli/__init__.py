@@ -13,6 +13,7 @@ command-line utility.
 from .query_handler import query_handler
 from .config_handler import config_handler
 from .telemeter import telemeter_data
+from .compact import compact_data
 
 
-__all__ = [query_handler, config_handler, telemeter_data]
+__all__ = [query_handler, config_handler, telemeter_data, compact_data]
@@ -0,0 +1,74 @@
+"""
+This module provides the command-line interface entry point for compacting closed days
+of the data archive into seekable, compressed containers.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import argparse
+import pathlib
+import sys
+
+from avert_firmware.data_archival.containers import DEFAULT_PATTERNS, compact_archive
+from avert_firmware.utilities import read_config
+
+
+def compact_data(args=None):
+    """
+    A command-line entry point that packs closed days of small files in the archive(s)
+    into compressed containers.
+
+    By default, the ARCHIVE directory of each instrument stream attached to the node is
+    compacted. The job is incremental and can safely be interrupted and re-run.
+
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-a",
+        "--archive",
+        help="Specify an archive to compact (may be given more than once).",
+        action="append",
+        required=False,
+    )
+    parser.add_argument(
+        "-d",
+        "--days",
+        help="Only compact days that ended at least this many days ago.",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        help="Specify a glob pattern of files to compact (may be repeated).",
+        action="append",
+        required=False,
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        help="Specify the zstd compression level.",
+        type=int,
+        default=10,
+    )
+
+    args = parser.parse_args(sys.argv[2:])
+
+    if args.archive is None:
+        data_dir = pathlib.Path(read_config()["data_archive"])
+        archives = sorted(data_dir.glob("*/ARCHIVE"))
+    else:
+        archives = [pathlib.Path(archive) for archive in args.archive]
+    patterns = DEFAULT_PATTERNS if args.pattern is None else args.pattern
+
+    for archive in archives:
+        print(f"Compacting {archive}...")
+        n_packed = compact_archive(archive, args.days, patterns, args.level)
+        print(f"...{n_packed} file(s) packed.")
@@ -13,7 +13,12 @@ import argparse
 import pathlib
 import sys
 
-from avert_firmware.drivers.imagery import handle_query as imagery_query
+from avert_firmware.drivers.imagery import (
+    handle_query as imagery_query,
+    handle_scheduled as imagery_scheduled,
+    handle_triggered as imagery_triggered,
+    spectrum_dirs,
+)
 from avert_firmware.drivers.geodetic import handle_query as geodetic_query
 from avert_firmware.drivers.gas import handle_query as gas_query
 from avert_firmware.drivers.magnetic import handle_query as magnetic_query
@@ -28,6 +33,12 @@ FN_MAP = {
     "magnetic": magnetic_query,
     "seismic": seismic_query,
 }
+SCHEDULED_FN_MAP = {
+    "imagery": imagery_scheduled,
+}
+TRIGGERED_FN_MAP = {
+    "imagery": imagery_triggered,
+}
 
 
 def query_handler(args=None):
@@ -44,6 +55,16 @@ def query_handler(args=None):
         help="Specify the type of instrument to be queried.",
         choices=FN_MAP.keys(),
     )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        help=(
+            "Query once (the default, e.g. from a timer), or run continuously - on a "
+            "sun-aligned schedule, or on triggers."
+        ),
+        choices=["once", "scheduled", "triggered"],
+        default="once",
+    )
 
     # --- Parse arguments ---
     args = parser.parse_args(sys.argv[2:])
@@ -59,20 +80,16 @@ def query_handler(args=None):
 
     data_dir = pathlib.Path(config["data_archive"]) / args.instrument
     if args.instrument == "imagery":
-        match kwargs["instrument_config"]["model"]:
-            case "gigev":
-                data_dir = data_dir / "infrared"
-            case "picam":
-                data_dir = data_dir / "visible"
-            case "stardot":
-                data_dir = data_dir / "visible"
-
-
-    kwargs["dirs"] = {
-        "receive": data_dir / "receive",
-        "transmit": data_dir / "transmit",
-        "archive": data_dir / "ARCHIVE",
-    }
+        # Where several cameras are configured, each is filed by its own model
+        imagery_config = kwargs["instrument_config"]
+        model = imagery_config.get("model") or imagery_config["cameras"][0]["model"]
+        kwargs["dirs"] = spectrum_dirs(data_dir, model)
+    else:
+        kwargs["dirs"] = {
+            "receive": data_dir / "receive",
+            "transmit": data_dir / "transmit",
+            "archive": data_dir / "ARCHIVE",
+        }
     kwargs["dirs"]["receive"].mkdir(exist_ok=True, parents=True)
 
     match args.instrument:
@@ -88,4 +105,16 @@ def query_handler(args=None):
             kwargs["metadata"] = config["metadata"]
 
     # --- Map arguments to appropriate instrument driver ---
-    FN_MAP[args.instrument](**kwargs)
+    match args.mode:
+        case "once":
+            FN_MAP[args.instrument](**kwargs)
+        case "scheduled":
+            if args.instrument not in SCHEDULED_FN_MAP:
+                print(f"'{args.instrument}' does not support scheduled mode. Exiting.")
+                sys.exit(1)
+            SCHEDULED_FN_MAP[args.instrument](relay=config.get("relay"), **kwargs)
+        case "triggered":
+            if args.instrument not in TRIGGERED_FN_MAP:
+                print(f"'{args.instrument}' does not support triggered mode. Exiting.")
+                sys.exit(1)
+            TRIGGERED_FN_MAP[args.instrument](**kwargs)
@@ -12,11 +12,15 @@ nodes to hubs) or to a remote server via an internet connection.
 
 import argparse
 import pathlib
-import subprocess
 import sys
 
+import requests
+
 from avert_firmware.drivers.network_relay import set_relay_state
-from avert_firmware.utilities import ping, read_config, rsync
+from avert_firmware.utilities import ping, read_config, rsync, sha256sum
+
+
+UPLOAD_ATTEMPTS = 3
 
 
 def _send_file_lan(file: pathlib.Path, ip: str, telemetry_config: dict) -> int:
@@ -48,7 +52,14 @@ def _send_file_upload_server(
     telemetry_config: dict,
 ) -> int:
     """
-    Uses the curl utility to send a file to a remote machine reachable via the internet.
+    Uploads a file to the upload receiver on a remote machine reachable via the
+    internet.
+
+    The receiver is first asked how much of the file it already holds, so an upload
+    interrupted by a dropped link is resumed rather than restarted. A checksum is sent
+    alongside so the receiver can verify the completed file. Should the receiver refuse
+    a chunk as out of step with what it holds, the upload resumes from the offset it
+    reports instead.
 
     Parameters
     ----------
@@ -65,12 +76,84 @@ def _send_file_upload_server(
     port = telemetry_config["target_port"]
     token = telemetry_config["token"]
 
-    destination = f"http://{ip}:{port}/upload?token={token}"
-
-    command = ["curl", f"-Ffile=@{file}", destination]
+    destination = f"http://{ip}:{port}/upload/{file.name}"
 
     print(f"Sending:\n\t{file}\nto\n\t{destination}...")
-    return subprocess.run(command, stdout=subprocess.DEVNULL).returncode
+    try:
+        r = requests.head(destination, params={"token": token}, timeout=30)
+        offset = int(r.headers.get("Upload-Offset", 0)) if r.ok else 0
+
+        file_size, checksum = file.stat().st_size, sha256sum(file)
+        for _ in range(UPLOAD_ATTEMPTS):
+            if offset > file_size:
+                offset = 0
+            with file.open("rb") as f:
+                f.seek(offset)
+                r = requests.put(
+                    destination,
+                    params={"token": token, "offset": offset},
+                    data=f,
+                    headers={
+                        "Content-Length": str(file_size - offset),
+                        "X-Upload-Length": str(file_size),
+                        "X-Checksum-Sha256": checksum,
+                    },
+                    timeout=telemetry_config.get("timeout", 600),
+                )
+            if r.status_code != 409:
+                break
+
+            # The receiver holds a different part of the file than expected (e.g. it
+            # moved on since it was asked) - resume from wherever it says
+            offset = int(r.headers.get("Upload-Offset", 0))
+    except (requests.RequestException, ValueError) as e:
+        print(f"   ...upload failed: {e}")
+        return 1
+
+    if r.status_code not in (200, 201):
+        print(f"   ...upload failed with status {r.status_code}.")
+        return 1
+
+    return 0
+
+
+def bring_up_transceiver(config: dict, mode: str) -> int:
+    """
+    Check the local telemetry equipment (satellite/radio transceiver) is reachable,
+    powering it on via the network-attached relay if not.
+
+    Parameters
+    ----------
+    config: The node configuration.
+    mode: The mode of telemetry, used to select the relay switch.
+
+    Returns
+    -------
+    return_code: 0 = transceiver available, anything else = failure.
+
+    """
+
+    transceiver_ip = config["telemetry"]["transceiver_ip"]
+    print(f"Searching for local telemetry equipment at {transceiver_ip}...")
+    return_code = ping(transceiver_ip)
+    if return_code != 0:
+        print("   ...local telemetry equipment not found, attempting to power on...")
+        return_code = set_relay_state(
+            config["relay"]["ip"],
+            config["relay"][mode],
+            1,
+        )
+        if return_code != 0:
+            print("   ...power on failed.")
+            return return_code
+
+        return_code = ping(transceiver_ip)
+        if return_code != 0:
+            print("   ...could not power local telemetry equipment.")
+            return return_code
+    print("...found.")
+
+    return 0
 
 
 TELEMETRY_FN_LOOKUP = {
@@ -147,25 +230,10 @@ def telemeter_data(args=None):
         mode = config["telemetry"]["telemeter_by"]
 
     # Check relevant telemetry equipment is present (satellite/radio transceiver)
-    transceiver_ip = config["telemetry"]["transceiver_ip"]
-    print(f"Searching for local telemetry equipment at {transceiver_ip}...")
-    return_code = ping(transceiver_ip)
+    return_code = bring_up_transceiver(config, mode)
     if return_code != 0:
-        print("   ...local telemetry equipment not found, attempting to power on...")
-        return_code = set_relay_state(
-            config["relay"]["ip"],
-            config["relay"][mode],
-            1,
-        )
-        if return_code != 0:
-            print("   ...power on failed, exiting.")
-            sys.exit(return_code)
-
-        return_code = ping(transceiver_ip)
-        if return_code != 0:
-            print("   ...could not power local telemetry equipment, exiting.")
-            sys.exit(return_code)
-    print("...found.")
+        print("   ...exiting.")
+        sys.exit(return_code)
 
     # Check remote destination is visible
     if target_ip := args.destination is None:
@@ -13,11 +13,17 @@ command-line utility.
 import argparse
 import sys
 
-from avert_firmware.cli import config_handler, query_handler, telemeter_data
+from avert_firmware.cli import (
+    compact_data,
+    config_handler,
+    query_handler,
+    telemeter_data,
+)
 from avert_firmware.drivers.network_relay import relay_cli
 
 
 FN_MAP = {
+    "compact": compact_data,
     "configure": config_handler,
     "data-query": query_handler,
     "telemeter": telemeter_data,
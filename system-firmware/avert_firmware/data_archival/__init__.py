@@ -14,6 +14,7 @@ from .gas import _migrate_vaisala_co2_file
 from .gnss import _migrate_sbf_file
 from .images import _migrate_image_file
 from .miniseed import _migrate_miniseed_file
+from .products import _migrate_product_file, is_product_file
 
 
 def id_file_format(file_: pathlib.Path):
@@ -31,7 +32,7 @@ def id_file_format(file_: pathlib.Path):
 
     """
 
-    if file_.suffix in [".jpg", ".png", ".jpeg"]:
+    if file_.suffix in [".jpg", ".png", ".jpeg", ".webp"]:
         print("   ...image file identified...")
         return _migrate_image_file
     elif file_.suffix == ".sbf":
@@ -40,6 +41,9 @@ def id_file_format(file_: pathlib.Path):
     elif file_.suffix in [".m", ".mseed", ".msd"]:
         print("   ...miniSEED file identified...")
         return _migrate_miniseed_file
+    elif is_product_file(file_):
+        print("   ...node product file identified...")
+        return _migrate_product_file
     elif "CO2.csv" in file_.name:
         print("   ...Vaisala CO2 soil probe file identified...")
         return _migrate_vaisala_co2_file
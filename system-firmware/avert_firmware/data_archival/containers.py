@@ -0,0 +1,408 @@
+"""
+Seekable, compressed containers into which closed days of the archive are packed, to cut
+down on the number of small files (SOH miniSEED, CO2 CSVs, SBF hourlies, etc) that
+accumulate in archive directories.
+
+Each member of a container is compressed as an independent zstd frame, so any one member
+can be read by seeking straight to it, without decompressing the rest. The layout is:
+
+    [member frame] ... [member frame] [index frame] [footer]
+
+where the index is a zstd-compressed JSON mapping of member name to its offset, length,
+and checksum, and the footer gives the offset and length of the index.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timedelta as td, timezone
+import hashlib
+import io
+import json
+import os
+import pathlib
+import re
+import struct
+
+try:
+    import zstandard as zstd
+except ModuleNotFoundError:
+    print("Could not import zstandard module, archive compaction will not work.")
+
+
+CONTAINER_SUFFIX = ".avpack"
+FOOTER = struct.Struct(">QQ4s")
+MAGIC = b"AVP1"
+DEFAULT_PATTERNS = ["*.m", "*.mseed", "*.msd", "*.csv", "*.sbf"]
+
+# Daily files to which migration appends rows, rather than writing once
+APPEND_SUFFIXES = [".csv"]
+
+# Year and day-of-year, e.g. "2024-123" (miniSEED), "2024.123" (CO2), "2024123" (SBF)
+DAY_PATTERN = re.compile(r"(?<!\d)(\d{4})[.\-]?(\d{3})")
+
+
+def read_index(container: pathlib.Path) -> dict:
+    """
+    Read the member index of a container.
+
+    Parameters
+    ----------
+    container: Path to the container.
+
+    Returns
+    -------
+    index: The day of the container and a mapping of member name to its offset,
+           length, size, mtime, and checksum.
+
+    """
+
+    with container.open("rb") as f:
+        f.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{container} is not an archive container.")
+        f.seek(index_offset)
+        index = json.loads(zstd.ZstdDecompressor().decompress(f.read(index_length)))
+
+    return index
+
+
+def read_member(container: pathlib.Path, name: str, index: dict | None = None) -> bytes:
+    """
+    Read a single member out of a container, decompressing only that member.
+
+    Parameters
+    ----------
+    container: Path to the container.
+    name: Name of the member to be read.
+    index: The container index, if already read.
+
+    Returns
+    -------
+    data: The contents of the member.
+
+    """
+
+    if index is None:
+        index = read_index(container)
+    entry = index["members"][name]
+
+    with container.open("rb") as f:
+        f.seek(entry["offset"])
+        frame = f.read(entry["length"])
+
+    return zstd.ZstdDecompressor().decompress(frame)
+
+
+def _file_day(file_: pathlib.Path) -> str:
+    """Determine the (UTC) day to which a file belongs, as "YYYY-DDD"."""
+
+    if (match := DAY_PATTERN.search(file_.name)) is not None:
+        year, jday = match.groups()
+        if 1 <= int(jday) <= 366:
+            return f"{year}-{jday}"
+
+    mtime = dt.fromtimestamp(file_.stat().st_mtime, tz=timezone.utc)
+
+    return f"{mtime.year}-{mtime.timetuple().tm_yday:03d}"
+
+
+def container_path(file_: pathlib.Path) -> pathlib.Path:
+    """The path of the container that would hold a given archive file."""
+
+    return file_.parent / f"{_file_day(file_)}{CONTAINER_SUFFIX}"
+
+
+def open_archive_file(file_: pathlib.Path) -> io.BufferedIOBase:
+    """
+    Open a file from the archive for reading, whether it is still a loose file or has
+    been packed into a container.
+
+    Parameters
+    ----------
+    file_: Path at which the file was originally archived.
+
+    Returns
+    -------
+    f: A binary file object.
+
+    """
+
+    if file_.is_file():
+        return file_.open("rb")
+
+    container = container_path(file_)
+    if not container.is_file():
+        raise FileNotFoundError(file_)
+    try:
+        return io.BytesIO(read_member(container, file_.name))
+    except KeyError:
+        raise FileNotFoundError(file_)
+
+
+def _snapshot(file_: pathlib.Path) -> tuple[int, int]:
+    """The size and modification time of a file, to tell whether it has changed."""
+
+    stat = file_.stat()
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _read_settled(file_: pathlib.Path) -> tuple[bytes, tuple] | None:
+    """Read a file, or None if it changed while it was being read."""
+
+    before = _snapshot(file_)
+    data = file_.read_bytes()
+
+    return (data, before) if _snapshot(file_) == before else None
+
+
+def _packed_length(data: bytes, packed: list) -> int:
+    """How much of an append-style file is already held, from the prefixes packed."""
+
+    return max(
+        [
+            size
+            for size, sha256 in packed
+            if size <= len(data) and hashlib.sha256(data[:size]).hexdigest() == sha256
+        ],
+        default=0,
+    )
+
+
+def _merge_rows(member: bytes, rows: bytes, has_header: bool) -> bytes:
+    """Append the rows of a late CSV to those already held, dropping its header."""
+
+    if has_header:
+        header, _, rest = rows.partition(b"\n")
+        if header + b"\n" == member[: len(header) + 1]:
+            rows = rest
+    if member and not member.endswith(b"\n"):
+        member += b"\n"
+
+    return member + rows
+
+
+def _compress_member(data: bytes, mtime_ns: int, level: int) -> tuple[bytes, dict]:
+    entry = {
+        "size": len(data),
+        "mtime": mtime_ns / 1e9,
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+    return zstd.ZstdCompressor(level=level).compress(data), entry
+
+
+def pack_day(container: pathlib.Path, files: list, level: int = 10) -> int:
+    """
+    Pack a day's files into its container, then remove the originals.
+
+    Members already held by an existing container are carried over without being
+    recompressed. A late file replaces the member of the same name - except for
+    append-style files (CSVs, to which migration appends rows through the day), whose
+    rows are instead appended to those of the member. The new container is written in
+    full to a temporary file and atomically swapped in before any original is removed,
+    so an interrupted run leaves either the old or the new container intact, and simply
+    repeating it completes the job.
+
+    Any file that changes while it is being packed (e.g. a late row being appended) is
+    left in place, to be packed on a later run.
+
+    Parameters
+    ----------
+    container: Path to the day's container.
+    files: Paths of the loose files belonging to the day.
+    level: zstd compression level.
+
+    Returns
+    -------
+    n_packed: Number of files newly packed into the container.
+
+    """
+
+    index = read_index(container) if container.is_file() else {"members": {}}
+    members = index["members"]
+
+    # Files left behind by an interrupted run are already safely in the container
+    snapshots, new_files = {}, []
+    for file_ in files:
+        settled = _read_settled(file_)
+        if settled is None:
+            print(f"   ...{file_.name} is still being written, leaving it in place.")
+            continue
+        data, snapshots[file_] = settled
+
+        entry = members.get(file_.name)
+        sha256 = hashlib.sha256(data).hexdigest()
+        if entry is not None and sha256 == entry["sha256"]:
+            continue
+
+        # For append-style files, the prefixes already packed are recorded, so rows
+        # are never packed twice - even if a file grows after it was packed
+        packed = []
+        if file_.suffix in APPEND_SUFFIXES:
+            packed = [] if entry is None else entry.get("packed", [])
+            done = _packed_length(data, packed)
+            if done == len(data):
+                continue
+            packed = packed + [[len(data), sha256]]
+            if entry is not None:
+                member = read_member(container, file_.name, index)
+                data = _merge_rows(member, data[done:], has_header=done == 0)
+        new_files.append((file_, data, packed))
+
+    if new_files:
+        with ThreadPoolExecutor() as executor:
+            compressed = list(
+                executor.map(
+                    lambda new: _compress_member(
+                        new[1], snapshots[new[0]][1], level
+                    ),
+                    new_files,
+                )
+            )
+
+        replaced = {file_.name for file_, *_ in new_files}
+        tmp_container = container.with_name(f".{container.name}")
+        new_members = {}
+        with tmp_container.open("wb") as out:
+            if container.is_file():
+                with container.open("rb") as old:
+                    for name, entry in members.items():
+                        if name in replaced:
+                            continue
+                        old.seek(entry["offset"])
+                        new_members[name] = {**entry, "offset": out.tell()}
+                        out.write(old.read(entry["length"]))
+            for (file_, _, packed), (frame, entry) in zip(new_files, compressed):
+                new_members[file_.name] = {
+                    **entry,
+                    "offset": out.tell(),
+                    "length": len(frame),
+                }
+                if packed:
+                    new_members[file_.name]["packed"] = packed
+                out.write(frame)
+
+            index = {"day": container.stem, "members": new_members}
+            index_frame = zstd.ZstdCompressor(level=level).compress(
+                json.dumps(index).encode()
+            )
+            index_offset = out.tell()
+            out.write(index_frame)
+            out.write(FOOTER.pack(index_offset, len(index_frame), MAGIC))
+            out.flush()
+            os.fsync(out.fileno())
+
+        # Start again without any file that changed while the container was written
+        changed = [
+            file_ for file_, *_ in new_files if _snapshot(file_) != snapshots[file_]
+        ]
+        if changed:
+            tmp_container.unlink()
+            for file_ in changed:
+                print(f"   ...{file_.name} changed while packing, leaving it in place.")
+            return pack_day(
+                container, [file_ for file_ in files if file_ not in changed], level
+            )
+
+        os.replace(tmp_container, container)
+
+        dir_fd = os.open(container.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    for file_, snapshot in snapshots.items():
+        if _snapshot(file_) != snapshot:
+            print(f"   ...{file_.name} changed while packing, leaving it in place.")
+            continue
+        file_.unlink()
+
+    return len(new_files)
+
+
+def compact_directory(
+    directory: pathlib.Path,
+    before: dt,
+    patterns: list = DEFAULT_PATTERNS,
+    level: int = 10,
+) -> int:
+    """
+    Pack the loose files of each closed day in a single archive directory.
+
+    Parameters
+    ----------
+    directory: Path to an archive directory.
+    before: Only days wholly before this (UTC) date are packed.
+    patterns: Glob patterns selecting which files to pack.
+    level: zstd compression level.
+
+    Returns
+    -------
+    n_packed: Number of files packed.
+
+    """
+
+    days = {}
+    for pattern in patterns:
+        for file_ in directory.glob(pattern):
+            if file_.name.startswith(".") or not file_.is_file():
+                continue
+            days.setdefault(_file_day(file_), set()).add(file_)
+
+    cutoff = f"{before.year}-{before.timetuple().tm_yday:03d}"
+    n_packed = 0
+    for day, files in sorted(days.items()):
+        if day >= cutoff:
+            continue
+        container = directory / f"{day}{CONTAINER_SUFFIX}"
+        n_packed += pack_day(container, sorted(files), level)
+
+    return n_packed
+
+
+def compact_archive(
+    archive_root: pathlib.Path,
+    min_age_days: int = 2,
+    patterns: list = DEFAULT_PATTERNS,
+    level: int = 10,
+) -> int:
+    """
+    Walk an archive, packing every closed day of small files into containers.
+
+    Only days that ended at least `min_age_days` ago are packed, so late-arriving data
+    has time to land first. Any that arrive later still are packed into the existing
+    container on a subsequent run.
+
+    Parameters
+    ----------
+    archive_root: Path to the root of the archive.
+    min_age_days: Minimum time, in days, since the end of a day for it to be packed.
+    patterns: Glob patterns selecting which files to pack.
+    level: zstd compression level.
+
+    Returns
+    -------
+    n_packed: Number of files packed.
+
+    """
+
+    before = dt.now(timezone.utc) - td(days=min_age_days)
+
+    n_packed = 0
+    for directory, subdirs, _ in os.walk(archive_root):
+        subdirs[:] = [subdir for subdir in subdirs if not subdir.startswith(".")]
+        packed = compact_directory(pathlib.Path(directory), before, patterns, level)
+        if packed > 0:
+            print(f"   ...packed {packed} file(s) in {directory}.")
+        n_packed += packed
+
+    return n_packed
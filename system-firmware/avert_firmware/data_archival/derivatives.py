@@ -0,0 +1,238 @@
+"""
+Reduced-resolution derivatives (thumbnails, previews) of archived images.
+
+Derivatives are content-addressed - named by the SHA-256 digest of the original image -
+and stored in a cache directory that sits next to the image archive. The mapping from
+archived image to digest is kept in a small SQLite index, so the (comparatively
+expensive) hash is only ever computed once per image.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+import os
+import pathlib
+import sqlite3
+
+from PIL import Image
+
+from avert_firmware.utilities import sha256sum
+
+
+CACHE_DIRNAME = ".derivatives"
+DERIVATIVE_SIZES = {"thumbnail": 256, "preview": 1024}
+DERIVATIVE_QUALITY = 80
+
+_POOL = None
+
+
+def derivative_path(
+    cache_root: pathlib.Path, digest: str, size_name: str
+) -> pathlib.Path:
+    """Build the content-addressed path of a derivative within the cache."""
+
+    return cache_root / digest[:2] / f"{digest}.{size_name}.jpg"
+
+
+def _connect_index(cache_root: pathlib.Path) -> sqlite3.Connection:
+    """Open (creating, if necessary) the image -> digest index of a cache."""
+
+    cache_root.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(cache_root / "index.db", timeout=30)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS digests(
+            path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT
+        )
+        """
+    )
+
+    return conn
+
+
+def lookup_digest(image: pathlib.Path, cache_root: pathlib.Path) -> str:
+    """
+    Return the content digest of an archived image, hashing it only if the file has
+    changed (or has never been seen) since it was last indexed.
+
+    Parameters
+    ----------
+    image: Path to the full-resolution image in the archive.
+    cache_root: Path to the derivative cache.
+
+    Returns
+    -------
+    digest: SHA-256 digest of the image contents.
+
+    """
+
+    stat = image.stat()
+    conn = _connect_index(cache_root)
+    with conn:
+        row = conn.execute(
+            "SELECT mtime_ns, size, digest FROM digests WHERE path = ?",
+            (str(image),),
+        ).fetchone()
+        if row is not None and row[:2] == (stat.st_mtime_ns, stat.st_size):
+            digest = row[2]
+        else:
+            digest = sha256sum(image)
+            conn.execute(
+                "INSERT OR REPLACE INTO digests VALUES(?,?,?,?)",
+                (str(image), stat.st_mtime_ns, stat.st_size, digest),
+            )
+    conn.close()
+
+    return digest
+
+
+def generate_derivatives(
+    image: pathlib.Path,
+    cache_root: pathlib.Path,
+    sizes: dict = DERIVATIVE_SIZES,
+) -> dict:
+    """
+    Generate each of the reduced-resolution derivatives of an image.
+
+    The image is decoded once. For JPEGs, the decoder is asked to downscale during
+    the decode (DCT scaling), so a full-resolution frame is never held in memory.
+    Existing derivatives are left untouched.
+
+    Parameters
+    ----------
+    image: Path to the full-resolution image in the archive.
+    cache_root: Path to the derivative cache.
+    sizes: Mapping of derivative name to the maximum dimension, in pixels.
+
+    Returns
+    -------
+    derivatives: Mapping of derivative name to its path in the cache.
+
+    """
+
+    digest = lookup_digest(image, cache_root)
+    derivatives = {name: derivative_path(cache_root, digest, name) for name in sizes}
+    missing = [name for name, path in derivatives.items() if not path.is_file()]
+    if not missing:
+        return derivatives
+
+    with Image.open(image) as img:
+        largest = max(sizes[name] for name in missing)
+        img.draft("RGB", (largest, largest))
+        img = img.convert("RGB")
+
+        # Work from largest to smallest, so each resize starts from the last
+        for name in sorted(missing, key=lambda name: sizes[name], reverse=True):
+            img.thumbnail((sizes[name], sizes[name]), reducing_gap=2.0)
+            path = derivatives[name]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}")
+            img.save(tmp_path, "JPEG", quality=DERIVATIVE_QUALITY, progressive=True)
+            os.replace(tmp_path, path)
+
+    return derivatives
+
+
+def _log_failure(image: pathlib.Path, future: Future) -> None:
+    """Report a failed generation of derivatives, which would otherwise go unseen."""
+
+    if not future.cancelled() and (e := future.exception()) is not None:
+        print(f"Could not generate derivatives of {image.name} ({e!r}).")
+
+
+def queue_derivatives(image: pathlib.Path, cache_root: pathlib.Path) -> Future:
+    """
+    Submit the generation of derivatives for an image to a pool of worker processes,
+    so migration of subsequent files is not held up. Any failure is logged, as the
+    future is usually not waited on.
+
+    Parameters
+    ----------
+    image: Path to the full-resolution image in the archive.
+    cache_root: Path to the derivative cache.
+
+    Returns
+    -------
+    future: Resolves to the mapping of derivative name to path in the cache.
+
+    """
+
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor()
+
+    future = _POOL.submit(generate_derivatives, image, cache_root)
+    future.add_done_callback(partial(_log_failure, image))
+
+    return future
+
+
+def get_derivative(
+    image: pathlib.Path, size_name: str, cache_root: pathlib.Path
+) -> pathlib.Path:
+    """
+    Retrieve a derivative of an image, generating it on first request.
+
+    Parameters
+    ----------
+    image: Path to the full-resolution image in the archive.
+    size_name: Name of the derivative, e.g. "thumbnail".
+    cache_root: Path to the derivative cache.
+
+    Returns
+    -------
+    path: Path to the derivative in the cache.
+
+    """
+
+    path = derivative_path(cache_root, lookup_digest(image, cache_root), size_name)
+    try:
+        # Mark as recently used, for eviction
+        os.utime(path)
+    except FileNotFoundError:
+        # Never generated, or since evicted
+        path = queue_derivatives(image, cache_root).result()[size_name]
+
+    return path
+
+
+def evict_derivatives(cache_root: pathlib.Path, max_bytes: int) -> int:
+    """
+    Remove the least-recently used derivatives until the cache fits within a size
+    bound. Derivatives can always be regenerated from the originals.
+
+    Parameters
+    ----------
+    cache_root: Path to the derivative cache.
+    max_bytes: Maximum total size of the cache, in bytes.
+
+    Returns
+    -------
+    n_evicted: Number of derivatives removed from the cache.
+
+    """
+
+    entries = []
+    for path in cache_root.glob("??/*.jpg"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    n_evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        n_evicted += 1
+
+    return n_evicted
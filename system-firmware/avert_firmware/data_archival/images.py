@@ -10,10 +10,18 @@ Migration functions for imagery files.
 """
 
 from datetime import datetime as dt
+import json
 import pathlib
 import sqlite3
 import subprocess
 
+from PIL import Image
+
+from .derivatives import CACHE_DIRNAME, queue_derivatives
+
+
+EXIF_DESCRIPTION = 0x010E
+
 
 def _migrate_image_file(
     file_: pathlib.Path, archive_root: pathlib.Path, append_datatype: bool = False
@@ -38,6 +46,34 @@ def _migrate_image_file(
             return _migrate_visible_image(file_, archive_root, append_datatype)
 
 
+def _image_tier(image: pathlib.Path) -> str | None:
+    """
+    Identify the resolution tier of an image, e.g. "thumbnail" for
+    `V.SITE.2024.123_120000-0000.thumbnail.jpg`, or None for an original frame. Tier
+    copies are filed alongside their originals, but are not frames in their own right,
+    so are kept out of the image database.
+
+    """
+
+    parts = image.name.split(".")
+
+    return parts[4] if len(parts) == 6 else None
+
+
+def _encoding_parameters(image: pathlib.Path) -> dict:
+    """
+    Read the encoding parameters (format, quality, etc) recorded by the node in the
+    EXIF ImageDescription tag of an image, if any.
+
+    """
+
+    try:
+        with Image.open(image) as im:
+            return json.loads(im.getexif().get(EXIF_DESCRIPTION, "{}"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
 def _create_connection(db_file: str) -> None:
     """
     Create a new database connection to the SQLite database specified by the
@@ -68,7 +104,7 @@ def _add_image2db(image: pathlib.Path, image_type: str):
     conn = _create_connection("/home/webmaster/data-api/data/imagery.db")
     with conn:
         cursor = conn.cursor()
-        vnum, station, year, julday_timeframe, ext = image.name.split(".")
+        vnum, station, year, julday_timeframe, *_, ext = image.name.split(".")
         julday, timeframe = julday_timeframe.split("_")
         time, frame = timeframe.split("-")
 
@@ -81,7 +117,7 @@ def _add_image2db(image: pathlib.Path, image_type: str):
             "site": str(station),
             "frame": int(frame),
             "file_format": ext,
-            "quality": 0,
+            "quality": _encoding_parameters(image).get("quality", 0),
             "timestamp": timestamp,
         }
         try:
@@ -142,10 +178,12 @@ def _migrate_infrared_image(
     new_file_path = archive_path / file_.name
     subprocess.Popen(["rsync", "-auz", file_, new_file_path]).wait()
 
-    if append_datatype:
+    if append_datatype and _image_tier(new_file_path) is None:
         # On server
         print("\t    ...adding to database...")
         _add_image2db(new_file_path, "infrared")
+        print("\t    ...queueing thumbnail/preview generation...")
+        queue_derivatives(new_file_path, archive_root / CACHE_DIRNAME)
 
     return 0
 
@@ -183,9 +221,11 @@ def _migrate_visible_image(
     new_file_path = archive_path / file_.name
     subprocess.Popen(["rsync", "-auz", file_, new_file_path]).wait()
 
-    if append_datatype:
+    if append_datatype and _image_tier(new_file_path) is None:
         # On server
         print("\t    ...adding to database...")
         _add_image2db(new_file_path, "visible")
+        print("\t    ...queueing thumbnail/preview generation...")
+        queue_derivatives(new_file_path, archive_root / CACHE_DIRNAME)
 
     return 0
@@ -0,0 +1,79 @@
+"""
+Migration functions for time-series products derived on the node (e.g. radiometric
+statistics from infrared imagery, or RSAM and detected events from seismic data).
+
+Product files are small CSVs, named
+
+    {source}.{year}.{julday:03d}_{HHMMSS}.{PRODUCT}.csv
+
+each holding a header and the rows produced by one acquisition. As with the CO2 soil
+probe files, they are appended into a single file per source, per day.
+
+:copyright:
+    2024, the AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import pathlib
+
+
+PRODUCTS = ["IRSTATS", "RSAM", "EVENTS"]
+
+
+def is_product_file(file_: pathlib.Path) -> bool:
+    """Whether a file is a recognised product file."""
+
+    parts = file_.name.split(".")
+
+    return file_.suffix == ".csv" and len(parts) >= 5 and parts[-2] in PRODUCTS
+
+
+def _migrate_product_file(
+    file_: pathlib.Path, archive_root: pathlib.Path, append_datatype: bool = False
+) -> int:
+    """
+    Takes a new product file and appends its rows to the relevant daily file in the
+    archive.
+
+    Parameters
+    ----------
+    file_: Path to the file in the upload directory.
+    archive_root: Path to the root of the final archive.
+    append_datatype: appends the data filetype to the root archive, if true.
+
+    """
+
+    if append_datatype:
+        archive_root = archive_root / "products"
+
+    archive_path_format = (
+        "{product}/{year}/{source}/{source}.{year}.{julday:03d}.{product_code}.csv"
+    )
+
+    *source, year, julday_time, product, _ = file_.name.split(".")
+    source = ".".join(source)
+    julday, _ = julday_time.split("_")
+
+    archive_file = archive_root / archive_path_format.format(
+        product=product.lower(),
+        year=year,
+        source=source,
+        julday=int(julday),
+        product_code=product,
+    )
+
+    with file_.open("r") as f:
+        header, *rows = f.readlines()
+
+    if not archive_file.is_file():
+        archive_file.parent.mkdir(exist_ok=True, parents=True)
+        with archive_file.open("w") as f:
+            print(header, file=f, end="")
+
+    with archive_file.open("a") as f:
+        print("".join(rows), file=f, end="")
+
+    return 0
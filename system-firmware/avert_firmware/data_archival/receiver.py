@@ -0,0 +1,291 @@
+"""
+An asyncio HTTP receiver for files telemetered from the field, which streams uploads
+straight to disk and hands completed files directly to a migration queue.
+
+Two forms of upload are accepted:
+
+    POST /upload?token=<token>
+        A multipart/form-data body with a single file field (e.g. `curl -Ffile=@...`).
+
+    PUT /upload/<filename>?token=<token>&offset=<offset>
+        A raw chunk of a file, starting at the given byte offset. The total size of the
+        file is given by the `X-Upload-Length` header - the file is complete once the
+        final chunk arrives. `HEAD /upload/<filename>` reports the number of bytes
+        already received in the `Upload-Offset` header, so an interrupted upload can be
+        resumed rather than restarted. A chunk at offset 0 always starts the file
+        afresh; a chunk at any other offset must follow on from the bytes already
+        received, or is refused (409), with the offset to resume from in
+        `Upload-Offset`.
+
+If an `X-Checksum-Sha256` header is supplied, the completed file is verified against it
+and discarded on a mismatch.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import asyncio
+from collections.abc import Callable
+import hashlib
+import hmac
+import os
+import pathlib
+import re
+import urllib.parse
+
+from avert_firmware.utilities import sha256sum
+
+
+CHUNK_SIZE = 1 << 16
+MAX_HEADER_SIZE = 1 << 14
+PARTIAL_DIRNAME = ".partial"
+FILENAME_PATTERN = re.compile(rb'filename="([^"]+)"')
+
+
+class UploadError(Exception):
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+def _sanitise_filename(filename: str) -> str:
+    """Strip any directory components from a client-supplied file name."""
+
+    name = pathlib.PurePosixPath(filename.replace("\\", "/")).name
+    if name in ("", ".", "..") or name.startswith("."):
+        raise UploadError(400, "Bad Request")
+
+    return name
+
+
+async def _write(f, chunk: bytes) -> None:
+    """Write to disk without blocking the event loop."""
+
+    await asyncio.to_thread(f.write, chunk)
+
+
+class UploadReceiver:
+    """
+    Receives uploads over HTTP and passes each completed file to a callback.
+
+    Parameters
+    ----------
+    upload_dir: Directory into which completed uploads are placed.
+    token: Shared secret that clients must supply to upload.
+    on_complete: Called with the path of each completed, verified upload.
+
+    """
+
+    def __init__(
+        self,
+        upload_dir: pathlib.Path,
+        token: str,
+        on_complete: Callable[[pathlib.Path], None],
+    ):
+        self.upload_dir = upload_dir
+        self.partial_dir = upload_dir / PARTIAL_DIRNAME
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        self.token = token
+        self.on_complete = on_complete
+
+    async def serve(self, host: str = "", port: int = 8000) -> None:
+        """Accept uploads until cancelled."""
+
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            status, reason, headers = await self._handle_request(reader)
+        except UploadError as e:
+            status, reason, headers = e.status, e.reason, {}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Client went away mid-upload; anything received is kept for resumption
+            writer.close()
+            return
+
+        response = f"HTTP/1.1 {status} {reason}\r\n"
+        headers = {"Content-Length": "0", "Connection": "close", **headers}
+        response += "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+        writer.write(f"{response}\r\n".encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _handle_request(self, reader) -> tuple[int, str, dict]:
+        """Parse the request line and headers, then dispatch on the method."""
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise UploadError(431, "Request Header Fields Too Large")
+        if len(head) > MAX_HEADER_SIZE:
+            raise UploadError(431, "Request Header Fields Too Large")
+
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ")
+        except ValueError:
+            raise UploadError(400, "Bad Request")
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        token = query.get("token", "").encode()
+        if not hmac.compare_digest(token, self.token.encode()):
+            raise UploadError(401, "Unauthorized")
+
+        match method, url.path.rstrip("/").split("/")[1:]:
+            case "POST", ["upload"]:
+                return await self._receive_multipart(reader, headers)
+            case "PUT", ["upload", filename]:
+                return await self._receive_chunk(reader, headers, query, filename)
+            case "HEAD", ["upload", filename]:
+                partial = self.partial_dir / _sanitise_filename(filename)
+                offset = partial.stat().st_size if partial.is_file() else 0
+                return 200, "OK", {"Upload-Offset": str(offset)}
+            case _:
+                raise UploadError(404, "Not Found")
+
+    def _content_length(self, headers: dict) -> int:
+        try:
+            return int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise UploadError(411, "Length Required")
+
+    async def _receive_multipart(self, reader, headers: dict) -> tuple[int, str, dict]:
+        """Stream the file part of a multipart/form-data body to disk."""
+
+        remaining = self._content_length(headers)
+        match = re.search(r'boundary="?([^";]+)"?', headers.get("content-type", ""))
+        if match is None:
+            raise UploadError(400, "Bad Request")
+        delimiter = b"\r\n--" + match.group(1).encode()
+
+        # Part headers, up to the blank line that precedes the file contents
+        preamble = await reader.readuntil(b"\r\n\r\n")
+        remaining -= len(preamble)
+        if (filename := FILENAME_PATTERN.search(preamble)) is None:
+            raise UploadError(400, "Bad Request")
+        filename = _sanitise_filename(filename.group(1).decode())
+
+        partial = self.partial_dir / filename
+        sha256 = hashlib.sha256()
+        buffer = b""
+        with partial.open("wb") as f:
+            while True:
+                if remaining <= 0:
+                    raise UploadError(400, "Bad Request")
+                chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(buffer, remaining)
+                remaining -= len(chunk)
+                buffer += chunk
+
+                if (end := buffer.find(delimiter)) != -1:
+                    sha256.update(buffer[:end])
+                    await _write(f, buffer[:end])
+                    break
+
+                # Hold back enough bytes to catch a delimiter split across reads
+                safe = len(buffer) - len(delimiter) + 1
+                if safe > 0:
+                    sha256.update(buffer[:safe])
+                    await _write(f, buffer[:safe])
+                    buffer = buffer[safe:]
+
+        # Discard the epilogue (and any further parts)
+        while remaining > 0:
+            chunk = await reader.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+        return self._complete(partial, sha256.hexdigest(), headers)
+
+    async def _receive_chunk(
+        self, reader, headers: dict, query: dict, filename: str
+    ) -> tuple[int, str, dict]:
+        """Write a chunk of a resumable upload at its offset."""
+
+        partial = self.partial_dir / _sanitise_filename(filename)
+        length = self._content_length(headers)
+        try:
+            offset = int(query.get("offset", 0))
+            total = int(headers["x-upload-length"])
+        except (KeyError, ValueError):
+            raise UploadError(400, "Bad Request")
+
+        # A chunk at offset 0 restarts the upload, discarding any stale partial file
+        # (e.g. from an earlier file of the same name)
+        current = partial.stat().st_size if partial.is_file() else 0
+        if offset not in (0, current) or offset + length > total:
+            return 409, "Conflict", {"Upload-Offset": str(current)}
+
+        with partial.open("r+b" if offset else "wb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                await _write(f, chunk)
+                remaining -= len(chunk)
+
+        if offset + length < total:
+            return 200, "OK", {"Upload-Offset": str(offset + length)}
+
+        digest = await asyncio.to_thread(sha256sum, partial)
+
+        return self._complete(partial, digest, headers)
+
+    def _complete(
+        self, partial: pathlib.Path, digest: str, headers: dict
+    ) -> tuple[int, str, dict]:
+        """Verify a fully received file, then release it for migration."""
+
+        expected = headers.get("x-checksum-sha256")
+        if expected is not None and not hmac.compare_digest(
+            expected.lower().encode(), digest.encode()
+        ):
+            partial.unlink()
+            raise UploadError(422, "Checksum Mismatch")
+
+        upload = self.upload_dir / partial.name
+        os.replace(partial, upload)
+        self.on_complete(upload)
+
+        return 201, "Created", {"X-Checksum-Sha256": digest}
+
+
+def run_upload_receiver(
+    upload_dir: pathlib.Path,
+    token: str,
+    on_complete: Callable[[pathlib.Path], None],
+    port: int = 8000,
+) -> None:
+    """
+    Run an upload receiver in the current thread until interrupted.
+
+    Parameters
+    ----------
+    upload_dir: Directory into which completed uploads are placed.
+    token: Shared secret that clients must supply to upload.
+    on_complete: Called with the path of each completed, verified upload.
+    port: Port on which to listen.
+
+    """
+
+    receiver = UploadReceiver(upload_dir, token, on_complete)
+    asyncio.run(receiver.serve(port=port))
@@ -10,59 +10,453 @@ webcameras.
 
 """
 
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime as dt
+from functools import partial
+import os
+import pathlib
 import sys
 import time
 
 import imageio.v3 as iio
 import numpy as np
-try:
-    from picamera2 import Picamera2 as pc2
-except ModuleNotFoundError:
-    print("Could not import Picamera2 module, some features may not work.")
+from PIL import Image
 
+from avert_firmware.drivers.network_relay import set_relay_state
+from avert_firmware.utilities.policy import DEFAULT_POLICY, write_policy
 from avert_firmware.utilities.solar_tracker import is_it_daytime
-from .stardot import capture_image as capture_image_stardot
-from .gigev import capture_image as capture_image_gigev
-from .picam import capture_image as capture_image_picam
+from .analysis import (
+    DuplicateFilter,
+    VisibilityFilter,
+    jpeg_signature,
+    signature,
+    visibility as measure_visibility,
+)
+from .encoding import EXTENSIONS, describe, encode_to_target
+from .stardot import (
+    capture_image as capture_image_stardot,
+    download_image as download_image_stardot,
+)
+from .gigev import GigEVSession
+from .mosaic import Mosaic
+from .pipeline import run_burst
+from .scheduler import plan_captures
+from .radiometry import PRODUCT as RADIOMETRY_PRODUCT, RadiometryLog
+from .stacking import FrameStack
+from .tiers import FULL_TIER, ROI_TIER, TierSchedule, tier_name, write_tier
+from .trigger import TRIGGER_SOCKET, FrameRing, TriggerListener
+from .picam import PicamSession
+
+
+def _to_8bit(image: np.ndarray, bit_depth: int = 8) -> np.ndarray:
+    """Utility function that scales an image down to 8 bits per sample, if needed."""
+
+    if image.dtype == np.uint8:
+        return image
+
+    return (image >> (bit_depth - 8)).astype(np.uint8)
 
 
 def _write_image(
-    image: np.ndarray, image_name: str, dirs: dict, quality: int = 75
+    image: np.ndarray,
+    image_name: str,
+    dirs: dict,
+    quality: int = 75,
+    bit_depth: int = 8,
+    exif: bytes = b"",
 ) -> None:
-    """Utility function that writes an image to file."""
+    """
+    Utility function that writes an image to file.
 
-    iio.imwrite(dirs["receive"] / image_name, image, quality=quality, optimize=True)
+    PNGs are written at the full depth of the image (e.g. 16-bit for radiometric
+    thermal frames). JPEG only holds 8 bits per sample, so deeper images are scaled
+    down to fit.
 
+    """
 
-def handle_query(instrument_config: dict, dirs: dict, metadata: dict) -> None:
+    kwargs = {"exif": exif} if exif else {}
+    if image_name.endswith(".png"):
+        iio.imwrite(dirs["receive"] / image_name, image, **kwargs)
+        return
+
+    image = _to_8bit(image, bit_depth)
+    iio.imwrite(
+        dirs["receive"] / image_name, image, quality=quality, optimize=True, **kwargs
+    )
+
+
+TRANSFORMS = ("crop", "binning", "scale")
+VISIBLE_MODELS = ("stardot", "picam")
+CAMERAS_DIRNAME = ".cameras"
+SPECTRA = {"gigev": "infrared", "picam": "visible", "stardot": "visible"}
+
+
+def spectrum_dirs(imagery_dir: pathlib.Path, model: str) -> dict:
     """
-    Handles queries to cameras attached to the AVERT system.
+    The directories for receipt, archival, and transmission of a camera's images, filed
+    by the spectrum the camera's model captures in.
 
     Parameters
     ----------
-    instrument_config: Camera configuration information.
-    component_ip: Address of component within network.
+    imagery_dir: Path to the imagery data directory.
+    model: Camera model, e.g. "gigev".
+
+    Returns
+    -------
     dirs: Directories to use for receipt, archival, and transmission.
 
     """
 
+    data_dir = imagery_dir / SPECTRA[model]
+
+    return {
+        "receive": data_dir / "receive",
+        "transmit": data_dir / "transmit",
+        "archive": data_dir / "ARCHIVE",
+    }
+
+
+def _needs_pixels(instrument_config: dict) -> bool:
+    """
+    Whether any configured transform, analysis, or encoding requires a camera's images
+    to be decoded - a camera's own JPEGs can only be passed through untouched.
+
+    """
+
+    return any(
+        key in instrument_config for key in (*TRANSFORMS, "visibility", "target_bytes")
+    )
+
+
+def _transform(image: np.ndarray, instrument_config: dict) -> np.ndarray:
+    """
+    Utility function that applies any configured transforms to an image.
+
+    `crop` is the region of interest, a box in pixels - [left, top, right, bottom] -
+    `binning` an integer factor by which to decimate the (cropped) image, and `scale` a
+    factor by which to resize it. Cropping and binning are both done by slicing, so
+    give a view of the frame (e.g. straight into a camera's buffer) rather than a copy,
+    and the encoder only ever touches the pixels kept.
+
+    """
+
+    if (crop := instrument_config.get("crop")) is not None:
+        left, top, right, bottom = crop
+        image = image[top:bottom, left:right]
+
+    if (binning := instrument_config.get("binning", 1)) > 1:
+        image = image[::binning, ::binning]
+
+    if (scale := instrument_config.get("scale")) is not None:
+        height, width = image.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image = np.asarray(Image.fromarray(image).resize(size, Image.LANCZOS))
+
+    return image
+
+
+def _frame_stack(instrument_config: dict, metadata: dict) -> FrameStack | None:
+    """
+    Utility function that sets up frame stacking, if it is configured and - where it
+    is limited to `twilight` hours either side of sunrise and sunset - currently due.
+
+    """
+
+    if (stacking_config := instrument_config.get("stacking")) is None:
+        return
+
+    twilight = stacking_config.get("twilight")
+    if twilight is not None and is_it_daytime(
+        metadata["longitude"], metadata["latitude"], metadata["timezone"], -twilight
+    ):
+        return
+
+    print("   ...stacking frames for low light...")
+    return FrameStack(
+        stacking_config["frames"],
+        stacking_config.get("method", "mean"),
+        stacking_config.get("align_window", 512),
+        stacking_config.get("max_shift", 64),
+    )
+
+
+def _image_name(metadata: dict, utcnow: dt, file_format: str = "jpg") -> str:
+    """Utility function that builds the standard name for an image."""
+
+    julday = utcnow.timetuple().tm_yday
+
+    # The frame field holds tenths of a millisecond, to tell apart frames captured
+    # within the same second
+    return (
+        f"{metadata['vnum']}.{metadata['site_code']}."
+        f"{utcnow.year}.{julday:03d}_"
+        f"{utcnow.hour:02d}{utcnow.minute:02d}{utcnow.second:02d}-"
+        f"{utcnow.microsecond // 100:04d}.{file_format}"
+    )
+
+
+def _telemetry_policy(
+    frame_signature: Callable[[], np.ndarray],
+    utcnow: dt,
+    duplicates: DuplicateFilter | None = None,
+    tiers: TierSchedule | None = None,
+) -> tuple[dict, list]:
+    """
+    Utility function that decides how a frame is to be telemetered.
+
+    Returns
+    -------
+    policy: The telemetry policy for the frame itself.
+    tiers_due: Names of the tiers for which reduced copies of the frame are to be made.
+
+    """
+
+    signature = None
+    if duplicates is not None:
+        signature = frame_signature()
+        if duplicates.is_duplicate(signature):
+            return {"transmit": False}, []
+
+    tiers_due, policy = [], {}
+    if tiers is not None:
+        tiers_due = tiers.due(utcnow)
+        if (full_tier := tiers.tiers.get(FULL_TIER)) is not None:
+            policy["transmit"] = FULL_TIER in tiers_due
+            policy["priority"] = full_tier.get("priority", DEFAULT_POLICY["priority"])
+        tiers_due = [tier for tier in tiers_due if tier != FULL_TIER]
+
+    # Only a frame the receiver will see - itself, or a copy of it - is a reference
+    if signature is not None and (policy.get("transmit", True) or tiers_due):
+        duplicates.accept(signature)
+
+    return policy, tiers_due
+
+
+def _product_name(metadata: dict, utcnow: dt, product: str) -> str:
+    """Utility function that builds the standard name for a product of a burst."""
+
+    julday = utcnow.timetuple().tm_yday
+
+    return (
+        f"{metadata['vnum']}.{metadata['site_code']}.{utcnow.year}.{julday:03d}_"
+        f"{utcnow.hour:02d}{utcnow.minute:02d}{utcnow.second:02d}.{product}.csv"
+    )
+
+
+def _save_frame(
+    image: np.ndarray,
+    utcnow: dt,
+    instrument_config: dict,
+    dirs: dict,
+    metadata: dict,
+    duplicates: DuplicateFilter | None = None,
+    tiers: TierSchedule | None = None,
+    radiometry: RadiometryLog | None = None,
+    visibility: VisibilityFilter | None = None,
+    mosaic: Mosaic | None = None,
+    bit_depth: int = 8,
+    priority: int | None = None,
+) -> None:
+    """
+    Utility function that transforms and writes a captured frame, along with any
+    reduced-resolution tier copies that are due, and adds it to the mosaic. Frames
+    that are near-duplicates of the last frame sent are archived, but not telemetered,
+    as are - or, optionally, are discarded - frames with poor visibility. A `priority`
+    overrides the telemetry priority the frame would otherwise have.
+
+    """
+
+    if radiometry is not None:
+        radiometry.add_frame(image, utcnow)
+
+    full_frame = image
+    image = _transform(image, instrument_config)
+    file_format = instrument_config.get("file_format", "jpg")
+    frame_name = _image_name(metadata, utcnow, file_format)
+
+    description, poor_visibility = {}, False
+    if visibility is not None:
+        description["visibility"] = measure_visibility(image, bit_depth)
+        poor_visibility = visibility.is_poor(description["visibility"])
+        if poor_visibility and visibility.action == "discard":
+            print(f"   ...discarding {frame_name}, visibility is poor...")
+            return
+
+    # Encoding to a target size also decides the format, and so the file name
+    encoded = None
+    if (target_bytes := instrument_config.get("target_bytes")) and file_format != "png":
+        encoded, params = encode_to_target(
+            _to_8bit(image, bit_depth),
+            target_bytes,
+            instrument_config.get("formats", ["jpeg"]),
+            instrument_config.get("min_quality", 20),
+            instrument_config.get("max_quality", 95),
+            description,
+        )
+        file_format = EXTENSIONS[params["format"]]
+    image_name = _image_name(metadata, utcnow, file_format)
+
+    if poor_visibility:
+        policy, tiers_due = {"transmit": False}, []
+    else:
+        policy, tiers_due = _telemetry_policy(
+            lambda: signature(image, bit_depth), utcnow, duplicates, tiers
+        )
+    if priority is not None:
+        policy["priority"] = priority
+
+    # The full frame is archived, but never sent; the region of interest is sent in
+    # its place, as a copy that is not archived
+    if instrument_config.get("archive_full_frame") and image is not full_frame:
+        write_policy(dirs["receive"] / frame_name, transmit=False)
+        _write_image(
+            full_frame, frame_name, dirs, instrument_config["quality"], bit_depth
+        )
+        policy["archive"] = False
+        image_name = tier_name(image_name, ROI_TIER, file_format)
+    image_path = dirs["receive"] / image_name
+
+    if tiers_due or mosaic is not None:
+        preview = Image.fromarray(_to_8bit(image, bit_depth))
+        for tier in tiers_due:
+            write_tier(preview, dirs["receive"] / frame_name, tier, tiers.tiers[tier])
+        if mosaic is not None:
+            mosaic.add(preview, utcnow)
+    if policy:
+        write_policy(image_path, **policy)
+
+    if encoded is not None:
+        image_path.write_bytes(encoded)
+    else:
+        _write_image(
+            image,
+            image_path.name,
+            dirs,
+            instrument_config["quality"],
+            bit_depth,
+            describe(description) if description else b"",
+        )
+
+
+def _save_jpeg(
+    tmp_path: pathlib.Path,
+    utcnow: dt,
+    dirs: dict,
+    metadata: dict,
+    duplicates: DuplicateFilter | None = None,
+    tiers: TierSchedule | None = None,
+    mosaic: Mosaic | None = None,
+) -> None:
+    """Utility function that moves a downloaded JPEG into the receive directory."""
+
+    image_path = dirs["receive"] / _image_name(metadata, utcnow)
+
+    policy, tiers_due = _telemetry_policy(
+        lambda: jpeg_signature(tmp_path), utcnow, duplicates, tiers
+    )
+    if tiers_due or mosaic is not None:
+        widths = [tiers.tiers[tier]["width"] for tier in tiers_due]
+        if mosaic is not None:
+            widths.append(mosaic.tile_width)
+        width = max(widths)
+        with Image.open(tmp_path) as image:
+            # Decode at the smallest scale that still covers the largest tier
+            image.draft("RGB", (width, round(image.height * width / image.width)))
+            image.load()
+            for tier in tiers_due:
+                write_tier(image, image_path, tier, tiers.tiers[tier])
+            if mosaic is not None:
+                mosaic.add(image, utcnow)
+    if policy:
+        write_policy(image_path, **policy)
+
+    os.replace(tmp_path, image_path)
+
+
+def _query_camera(
+    instrument_config: dict, dirs: dict, metadata: dict, state_dir: pathlib.Path
+) -> None:
+    """Capture a burst from a single camera (see `handle_query`)."""
+
+    workers = instrument_config.get("encode_workers")
+    burst = {
+        "frame_count": instrument_config["frame_count"],
+        "interval": instrument_config["time_between_frames"],
+        "workers": workers,
+        "max_in_flight": 2 * (workers or os.cpu_count()),
+    }
+
+    duplicates = None
+    if (threshold := instrument_config.get("duplicate_threshold")) is not None:
+        duplicates = DuplicateFilter(
+            state_dir / ".last_transmitted.npy",
+            threshold,
+            instrument_config.get("duplicate_max_age"),
+        )
+    visibility = None
+    if (visibility_config := instrument_config.get("visibility")) is not None:
+        visibility = VisibilityFilter(
+            state_dir / ".visibility.json",
+            visibility_config["threshold"],
+            visibility_config.get("action", "archive"),
+        )
+        poor_frame_count = visibility_config.get("poor_frame_count")
+        if visibility.last_was_poor and poor_frame_count is not None:
+            print("   ...visibility is poor, capturing fewer frames...")
+            burst["frame_count"] = min(burst["frame_count"], poor_frame_count)
+    tiers = None
+    if (tier_configs := instrument_config.get("tiers")) is not None:
+        tiers = TierSchedule(state_dir / ".tiers.json", tier_configs)
+    mosaic = None
+    if (mosaic_config := instrument_config.get("mosaic")) is not None:
+        mosaic = Mosaic(
+            state_dir / ".mosaic",
+            mosaic_config,
+            lambda utcnow: dirs["receive"] / _image_name(metadata, utcnow),
+        )
+        mosaic.flush(dt.utcnow())
+    save_kwargs = {
+        "instrument_config": instrument_config,
+        "dirs": dirs,
+        "metadata": metadata,
+        "duplicates": duplicates,
+        "tiers": tiers,
+        "visibility": visibility,
+        "mosaic": mosaic,
+    }
+
     print("Capturing images...")
     match instrument_config["model"]:
         case "gigev":
-            for _ in range(instrument_config["frame_count"]):
-                utcnow = dt.utcnow()
-                julday = utcnow.timetuple().tm_yday
-                image = capture_image_gigev(instrument_config)
-                image_name = (
-                    f"{metadata['vnum']}.{metadata['site_code']}."
-                    f"{utcnow.year}.{julday:03d}_"
-                    f"{utcnow.hour:02d}{utcnow.minute:02d}{utcnow.second:02d}-0000.jpg"
+            started = dt.utcnow()
+            with GigEVSession(instrument_config) as camera:
+                radiometry = None
+                radiometry_config = instrument_config.get("radiometry")
+                if radiometry_config is not None:
+                    radiometry = RadiometryLog(
+                        radiometry_config,
+                        2 ** (8 * camera.bytes_per_sample),
+                        state_dir / ".calibration",
+                    )
+                write = partial(
+                    _save_frame,
+                    radiometry=radiometry,
+                    bit_depth=camera.bit_depth,
+                    **save_kwargs,
                 )
 
-                _write_image(image, image_name, dirs, instrument_config["quality"])
+                # Frames are encoded straight out of the buffer ring, so one buffer is
+                # always kept free for the next frame to arrive into
+                burst["max_in_flight"] = max(1, camera.n_buffers - 1)
+                run_burst(camera.frame, write, **burst)
 
-                time.sleep(instrument_config["time_between_frames"])
+            if radiometry is not None:
+                radiometry.write(
+                    dirs["receive"]
+                    / _product_name(metadata, started, RADIOMETRY_PRODUCT)
+                )
         case "stardot":
             daytime = is_it_daytime(
                 metadata["longitude"],
@@ -72,20 +466,38 @@ def handle_query(instrument_config: dict, dirs: dict, metadata: dict) -> None:
             )
 
             if not daytime:
-                sys.exit(1)
-
-            for _ in range(instrument_config["frame_count"]):
-                utcnow = dt.utcnow()
-                image = capture_image_stardot(instrument_config)
-                image_name = (
-                    f"{metadata['vnum']}.{metadata['site_code']}."
-                    f"{utcnow.year}.{julday:03d}_"
-                    f"{utcnow.hour:02d}{utcnow.minute:02d}{utcnow.second:02d}-0000.jpg"
-                )
+                print("   ...it is night, nothing to capture.")
+                return
 
-                _write_image(image, image_name, dirs, instrument_config["quality"])
-
-                time.sleep(instrument_config["time_between_frames"])
+            ip = instrument_config["ip"]
+            if (stack := _frame_stack(instrument_config, metadata)) is not None:
+                run_burst(
+                    lambda: nullcontext(
+                        stack.capture(lambda: capture_image_stardot(ip))
+                    ),
+                    partial(_save_frame, **save_kwargs),
+                    **burst,
+                )
+            elif _needs_pixels(instrument_config):
+                run_burst(
+                    lambda: nullcontext(capture_image_stardot(ip)),
+                    partial(_save_frame, **save_kwargs),
+                    **burst,
+                )
+            else:
+                # Pass the camera's own JPEGs straight through, without re-encoding
+                run_burst(
+                    lambda: nullcontext(download_image_stardot(ip, dirs["receive"])),
+                    partial(
+                        _save_jpeg,
+                        dirs=dirs,
+                        metadata=metadata,
+                        duplicates=duplicates,
+                        tiers=tiers,
+                        mosaic=mosaic,
+                    ),
+                    **burst,
+                )
         case "picam":
             daytime = is_it_daytime(
                 metadata["longitude"],
@@ -95,18 +507,357 @@ def handle_query(instrument_config: dict, dirs: dict, metadata: dict) -> None:
             )
 
             if not daytime:
-                sys.exit(1)
-
-            camera = pc2(instrument_config["camera_port"])
-            for _ in range(instrument_config["frame_count"]):
-                image = capture_image_picam(camera)
-                utcnow = dt.utcnow()
-                image_name = (
-                    f"{metadata['vnum']}.{metadata['site_code']}."
-                    f"{utcnow.year}.{julday:03d}_"
-                    f"{utcnow.hour:02d}{utcnow.minute:02d}{utcnow.second:02d}-0000.jpg"
+                print("   ...it is night, nothing to capture.")
+                return
+
+            with PicamSession(instrument_config) as camera:
+                if (stack := _frame_stack(instrument_config, metadata)) is not None:
+
+                    def capture():
+                        return nullcontext(stack.capture(camera.grab))
+
+                else:
+                    # Frames are encoded straight out of the camera's buffers, so one
+                    # buffer is always kept free for the next frame to arrive into
+                    capture = camera.frame
+                    burst["max_in_flight"] = max(1, camera.n_buffers - 1)
+                run_burst(capture, partial(_save_frame, **save_kwargs), **burst)
+
+
+@contextmanager
+def _frame_source(instrument_config: dict):
+    """
+    Utility context manager that opens a camera for capture of raw frames.
+
+    Yields
+    ------
+    capture: Returns a context manager that lends out the next frame.
+    bit_depth: Significant bits per sample of the frames.
+    max_in_flight: Maximum number of frames that may be held at once.
+
+    """
+
+    match instrument_config["model"]:
+        case "gigev":
+            with GigEVSession(instrument_config) as camera:
+                yield camera.frame, camera.bit_depth, max(1, camera.n_buffers - 1)
+        case "stardot":
+            ip = instrument_config["ip"]
+            yield lambda: nullcontext(capture_image_stardot(ip)), 8, 2
+        case "picam":
+            with PicamSession(instrument_config) as camera:
+                yield camera.frame, 8, max(1, camera.n_buffers - 1)
+
+
+def _trigger_camera(
+    instrument_config: dict, dirs: dict, metadata: dict, state_dir: pathlib.Path
+) -> None:
+    """Run a single camera in triggered mode (see `handle_triggered`)."""
+
+    trigger_config = instrument_config["trigger"]
+    ring_binning = trigger_config.get("ring_binning", 1)
+    ring_interval = trigger_config.get("ring_interval", 1.0)
+    priority = trigger_config.get("priority", 0)
+    frame_count = trigger_config.get("frame_count", 30)
+    ring = FrameRing(trigger_config.get("ring_bytes", 64 * 2**20))
+
+    # Frames in the ring have already been transformed
+    ring_config = {
+        key: value for key, value in instrument_config.items() if key not in TRANSFORMS
+    }
+    ring_config["archive_full_frame"] = False
+
+    with (
+        _frame_source(instrument_config) as (capture, bit_depth, max_in_flight),
+        TriggerListener(state_dir / TRIGGER_SOCKET) as listener,
+    ):
+        print("Waiting for triggers...")
+        while True:
+            started = time.monotonic()
+            with capture() as image:
+                image = _transform(image, instrument_config)
+                ring.push(image[::ring_binning, ::ring_binning], dt.utcnow())
+
+            trigger = listener.wait(ring_interval - (time.monotonic() - started))
+            if trigger is None:
+                continue
+
+            print(f"Triggered by {trigger['source']}, capturing...")
+            write_ring = partial(
+                _save_frame,
+                instrument_config=ring_config,
+                dirs=dirs,
+                metadata=metadata,
+                bit_depth=bit_depth,
+                priority=priority,
+            )
+
+            # The ring is left untouched during the burst, so its frames are written
+            # straight out of it alongside
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                pre_trigger = executor.submit(
+                    lambda: [write_ring(*frame) for frame in ring.frames()]
                 )
+                run_burst(
+                    capture,
+                    partial(
+                        _save_frame,
+                        instrument_config=instrument_config,
+                        dirs=dirs,
+                        metadata=metadata,
+                        bit_depth=bit_depth,
+                        priority=priority,
+                    ),
+                    frame_count,
+                    trigger_config.get("time_between_frames", 0.25),
+                    max_in_flight,
+                    instrument_config.get("encode_workers"),
+                )
+                pre_trigger.result()
+            print(f"   ...{len(ring)} pre-, {frame_count} post-trigger frames written.")
+            ring.clear()
+
+
+def _camera_configs(instrument_config: dict) -> list[dict]:
+    """The configuration of each camera, as used by `_for_each_camera`."""
+
+    if (cameras := instrument_config.get("cameras")) is None:
+        return [instrument_config]
+
+    base_config = {
+        key: value for key, value in instrument_config.items() if key != "cameras"
+    }
+
+    return [{**base_config, **camera} for camera in cameras]
+
+
+def _for_each_camera(
+    handler: Callable[[dict, dict, dict, pathlib.Path], None],
+    instrument_config: dict,
+    dirs: dict,
+    metadata: dict,
+) -> None:
+    """
+    Utility function that runs a handler for each configured camera, in parallel.
+
+    Each entry in `cameras` is a camera's own configuration, which overrides the rest
+    of the imagery configuration, and must include a `name`. This is appended to the
+    site code in the names of the camera's images, e.g. `V.SITE-north.2024.123_...`.
+    GigE-V cameras are picked out by `serial` number (or else by `camera_index`). Each
+    camera's images are filed under the spectrum of its own `model` (see
+    `spectrum_dirs`), and it keeps its state - the last frame sent, tier cadences, etc -
+    in its own hidden directory there.
+
+    If no `cameras` are configured, the imagery configuration is for a single camera.
+
+    """
+
+    if (cameras := instrument_config.get("cameras")) is None:
+        handler(instrument_config, dirs, metadata, dirs["receive"].parent)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(cameras)) as executor:
+        futures = {}
+        for camera, camera_config in zip(cameras, _camera_configs(instrument_config)):
+            camera_metadata = {
+                **metadata,
+                "site_code": f"{metadata['site_code']}-{camera['name']}",
+            }
+            # The directories given are those of one spectrum of the imagery directory
+            camera_dirs = spectrum_dirs(
+                dirs["receive"].parents[1], camera_config["model"]
+            )
+            state_dir = (
+                camera_dirs["receive"].parent / CAMERAS_DIRNAME / camera["name"]
+            )
+            camera_dirs["receive"].mkdir(parents=True, exist_ok=True)
+            state_dir.mkdir(parents=True, exist_ok=True)
+            futures[camera["name"]] = executor.submit(
+                handler, camera_config, camera_dirs, camera_metadata, state_dir
+            )
+
+    # A failure with one camera should not stop the others
+    status = 0
+    for name, future in futures.items():
+        try:
+            future.result()
+        except SystemExit as e:
+            print(f"Camera '{name}' exited with status {e.code}.")
+            status = status or e.code
+    if status:
+        sys.exit(status)
+
+
+def handle_query(instrument_config: dict, dirs: dict, metadata: dict) -> None:
+    """
+    Handles queries to cameras attached to the AVERT system.
+
+    Frames are captured on a fixed schedule, `time_between_frames` apart, while a pool
+    of `encode_workers` workers encodes and writes them in the background.
+
+    If a `duplicate_threshold` is configured, frames that differ from the last frame
+    sent by less than it are archived but not telemetered - unless more than
+    `duplicate_max_age` seconds have passed since a frame was last sent.
+
+    If `tiers` are configured, reduced-resolution copies of frames are also made, each
+    telemetered with its own priority and cadence (see `tiers`).
+
+    If `radiometry` is configured for a thermal camera, temperature statistics for
+    each region of interest of each frame are written out for the burst as a single
+    product file, telemetered with high priority (see `radiometry`).
+
+    If `stacking` is configured for a visible camera, each frame is instead the stack
+    of several frames captured back-to-back, for a better signal-to-noise ratio in low
+    light (see `stacking`).
+
+    If a region of interest (`crop`) or `binning` is configured, only those pixels of
+    each frame are encoded. With `archive_full_frame`, the full frame is also archived
+    on the node, though only the region of interest is telemetered.
+
+    If `visibility` is configured, each frame is scored for visibility, and the score
+    stored with the image. Frames scoring under the `threshold` are archived but not
+    telemetered or, if the `action` is "discard", not even written. After a frame with
+    poor visibility, bursts are cut to `poor_frame_count` frames until it clears (see
+    `analysis`).
+
+    If a `mosaic` is configured, frames are also laid out, downsampled, on a contact
+    sheet for each day (or hour), telemetered as a single image once it is over (see
+    `mosaic`).
+
+    If `target_bytes` is configured, frames are encoded as close to that size as
+    possible, rather than at a fixed `quality`, in any of the allowed `formats` (see
+    `encoding`).
+
+    If `cameras` are configured, each is captured from at once, in its own thread (see
+    `_for_each_camera`).
+
+    Outside of a visible camera's daylight window, nothing is captured, and the query
+    returns quietly. To capture only within that window, see `handle_scheduled`.
+
+    Parameters
+    ----------
+    instrument_config: Camera configuration information.
+    dirs: Directories to use for receipt, archival, and transmission.
+    metadata: Node metadata, used to name images.
+
+    """
+
+    _for_each_camera(_query_camera, instrument_config, dirs, metadata)
+
+
+def handle_triggered(instrument_config: dict, dirs: dict, metadata: dict) -> None:
+    """
+    Runs a camera in triggered mode, until stopped.
+
+    Low-cost frames - transformed as configured, then decimated by a further
+    `ring_binning` - are captured every `ring_interval` seconds into a ring buffer of
+    at most `ring_bytes` bytes. On a trigger (see `trigger`), the frames in the ring
+    are written out, while a burst of `frame_count` full frames is captured every
+    `time_between_frames` seconds (both as set for the trigger, rather than for the
+    scheduled bursts). All are telemetered at top `priority`.
+
+    If `cameras` are configured, each runs in triggered mode at once, in its own thread
+    (see `_for_each_camera`).
+
+    Parameters
+    ----------
+    instrument_config: Camera configuration information.
+    dirs: Directories to use for receipt, archival, and transmission.
+    metadata: Node metadata, used to name images.
+
+    """
+
+    _for_each_camera(_trigger_camera, instrument_config, dirs, metadata)
+
+
+def _schedule_buffer(instrument_config: dict) -> float | None:
+    """
+    The daylight buffer whose capture windows cover those of every camera, or None if
+    any camera (e.g. a thermal camera) has no daylight restriction.
+
+    """
+
+    buffers = [
+        config["daylight_buffer"] if config["model"] in VISIBLE_MODELS else None
+        for config in _camera_configs(instrument_config)
+    ]
+
+    # Each day's window only widens with the buffer, so the widest covers the rest
+    return None if None in buffers else max(buffers)
+
+
+def handle_scheduled(
+    instrument_config: dict, dirs: dict, metadata: dict, relay: dict | None = None
+) -> None:
+    """
+    Runs cameras on a sun-aligned schedule, until stopped.
+
+    Bursts are planned a day ahead from the site's solar timetable, within daylight
+    for visible cameras, and more often around sunrise and sunset if configured. Where
+    several `cameras` are configured, bursts are planned within the windows of any of
+    them, and each camera then captures only within its own. If a relay channel and
+    the network relay are configured, the cameras are powered only while they are
+    needed (see `scheduler`) - otherwise they are left as they are.
+    Each burst is then as for `handle_query`, and a failed burst does not stop the
+    schedule.
+
+    Parameters
+    ----------
+    instrument_config: Camera configuration information.
+    dirs: Directories to use for receipt, archival, and transmission.
+    metadata: Node metadata, used to name images.
+    relay: Network-attached relay configuration, if any.
+
+    """
+
+    schedule_config = instrument_config.get("schedule", {})
+    buffer = _schedule_buffer(instrument_config)
+
+    relay_channel = schedule_config.get("relay_channel")
+    if relay_channel is not None and not (relay or {}).get("ip"):
+        print("No network relay is configured, so cameras will be left powered.")
+        relay_channel = None
+    power_lead = schedule_config.get("power_lead", 60)
+    powered = relay_channel is None
+
+    def power(state: bool) -> None:
+        nonlocal powered
+        if relay_channel is not None and powered != state:
+            print(f"   ...powering cameras {'on' if state else 'off'}...")
+            set_relay_state(relay["ip"], relay_channel, int(state))
+            powered = state
+
+    while True:
+        now = time.time()
+        captures, windows = plan_captures(
+            metadata["longitude"],
+            metadata["latitude"],
+            now,
+            now + 86400,
+            schedule_config,
+            buffer,
+        )
+        if len(captures) == 0:
+            power(False)
+            time.sleep(3600)
+            continue
+
+        next_capture = captures[0]
+        if not powered:
+            print(f"Next capture at {dt.utcfromtimestamp(next_capture)}.")
+            time.sleep(max(0.0, next_capture - power_lead - time.time()))
+            power(True)
+        time.sleep(max(0.0, next_capture - time.time()))
 
-                _write_image(image, image_name, dirs, instrument_config["quality"])
+        try:
+            handle_query(instrument_config, dirs, metadata)
+        except SystemExit as e:
+            print(f"Capture failed with status {e.code}.")
+        except Exception as e:
+            print(f"Capture failed ({e}).")
 
-                time.sleep(instrument_config["time_between_frames"])
+        # Power down if the next capture is in a later window
+        window = np.searchsorted(windows[:, 0], next_capture, side="right") - 1
+        following = captures[captures > time.time()]
+        if len(following) == 0 or following[0] > windows[window, 1]:
+            power(False)
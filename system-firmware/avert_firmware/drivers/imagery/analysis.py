@@ -0,0 +1,270 @@
+"""
+Lightweight image analysis used on the imagery path - the detection of frames that are
+near-duplicates of the last frame sent, and of frames with poor visibility (fog, low
+cloud, etc), so they can be archived without being telemetered.
+
+Frames are compared by their signatures: a heavily downsampled (block-averaged),
+greyscale copy of the frame, normalised to [0, 1]. Two frames differ by the mean
+absolute difference of their signatures, which is insensitive to sensor noise but
+picks up changes in a plume, the onset of fog, etc.
+
+Visibility is scored on a less heavily downsampled copy, from three measures that all
+collapse when the view is obscured:
+
+    contrast: Standard deviation of the brightness.
+    edges: Mean magnitude of the brightness gradient.
+    spread: Range between the 5th and 95th percentiles of brightness.
+
+Each is expressed as a fraction of its value for a typical clear view (capped at 1),
+and the score is their mean - so 0 for a uniformly grey frame, and 1 for a clear one.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import json
+import os
+import pathlib
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+
+SIGNATURE_SIZE = 32
+VISIBILITY_SIZE = 128
+CLEAR_VIEW = {"contrast": 0.15, "edges": 0.02, "spread": 0.5}
+
+
+def _block_mean(image: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Downsample a frame to (rows, cols) greyscale blocks, by averaging."""
+
+    height, width = image.shape[:2]
+    block_h, block_w = height // rows, width // cols
+    blocks = image[: block_h * rows, : block_w * cols].reshape(
+        rows, block_h, cols, block_w, -1
+    )
+
+    return blocks.mean(axis=(1, 3, 4), dtype=np.float32)
+
+
+def signature(
+    image: np.ndarray, bit_depth: int = 8, size: int = SIGNATURE_SIZE
+) -> np.ndarray:
+    """
+    Compute the signature of a frame.
+
+    Parameters
+    ----------
+    image: The frame, as a (height, width) or (height, width, channels) array.
+    bit_depth: Significant bits per sample of the frame.
+    size: Side length, in pixels, of the (square) signature.
+
+    Returns
+    -------
+    signature: The signature of the frame.
+
+    """
+
+    means = _block_mean(image, size, size)
+
+    return means / np.float32(2**bit_depth - 1)
+
+
+def jpeg_signature(path: pathlib.Path, size: int = SIGNATURE_SIZE) -> np.ndarray:
+    """
+    Compute the signature of a JPEG frame, decoding only a reduced-resolution copy of
+    it (the JPEG decoder can scale by up to 1/8 essentially for free).
+
+    Parameters
+    ----------
+    path: Path to the JPEG file.
+    size: Side length, in pixels, of the (square) signature.
+
+    Returns
+    -------
+    signature: The signature of the frame.
+
+    """
+
+    with Image.open(path) as image:
+        image.draft("L", (size, size))
+        proxy = np.asarray(image.convert("L"))
+
+    return signature(proxy, 8, size)
+
+
+def visibility(
+    image: np.ndarray, bit_depth: int = 8, size: int = VISIBILITY_SIZE
+) -> dict:
+    """
+    Score the visibility of a frame.
+
+    Parameters
+    ----------
+    image: The frame, as a (height, width) or (height, width, channels) array.
+    bit_depth: Significant bits per sample of the frame.
+    size: Length, in pixels, of the short side of the copy the frame is scored on.
+
+    Returns
+    -------
+    visibility: The contrast, edges, and spread of the frame, and its overall score.
+
+    """
+
+    height, width = image.shape[:2]
+    block = max(1, min(height, width) // size)
+    proxy = _block_mean(image, height // block, width // block)
+    proxy /= np.float32(2**bit_depth - 1)
+
+    low, high = np.percentile(proxy, [5, 95])
+    measures = {
+        "contrast": float(proxy.std()),
+        "edges": float(
+            np.hypot(np.diff(proxy, axis=0)[:, :-1], np.diff(proxy, axis=1)[:-1]).mean()
+        ),
+        "spread": float(high - low),
+    }
+    score = float(np.mean([min(1.0, measures[k] / CLEAR_VIEW[k]) for k in CLEAR_VIEW]))
+
+    return {**{k: round(v, 4) for k, v in measures.items()}, "score": round(score, 3)}
+
+
+def difference(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Mean absolute difference between two frame signatures, in [0, 1]."""
+
+    return float(np.abs(signature_a - signature_b).mean())
+
+
+class DuplicateFilter:
+    """
+    Tracks the signature of the last frame sent, to decide whether each new frame has
+    changed enough to be worth telemetering too. The signature is kept on disk, so
+    frames are compared across bursts. A frame only becomes the reference once it is
+    `accept`ed - i.e. once it is known to be telemetered - so frames are never compared
+    against one the receiver never got.
+
+    Frames are checked in the order they are finished encoding, which - with several
+    encoding workers - can differ slightly from the order they were captured in.
+
+    Parameters
+    ----------
+    state_file: Path to the file holding the signature of the last frame sent.
+    threshold: Minimum difference from the last frame sent for a frame to be sent.
+    max_age: Maximum time, in seconds, between frames sent, regardless of change.
+
+    """
+
+    def __init__(
+        self, state_file: pathlib.Path, threshold: float, max_age: float | None = None
+    ):
+        self.state_file = state_file
+        self.threshold = threshold
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+        try:
+            self.last = np.load(state_file)
+            self.last_time = state_file.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            self.last, self.last_time = None, 0.0
+
+    def is_duplicate(self, frame_signature: np.ndarray) -> bool:
+        """
+        Check a frame against the last frame sent.
+
+        Parameters
+        ----------
+        frame_signature: Signature of the new frame.
+
+        Returns
+        -------
+        is_duplicate: True if the frame need not be telemetered.
+
+        """
+
+        with self._lock:
+            return (
+                self.last is not None
+                and self.last.shape == frame_signature.shape
+                and (
+                    self.max_age is None or time.time() - self.last_time < self.max_age
+                )
+                and difference(self.last, frame_signature) < self.threshold
+            )
+
+    def accept(self, frame_signature: np.ndarray) -> None:
+        """
+        Make a frame the new reference, once it is certain to be telemetered.
+
+        Parameters
+        ----------
+        frame_signature: Signature of the frame.
+
+        """
+
+        with self._lock:
+            self.last, self.last_time = frame_signature, time.time()
+            tmp_state_file = self.state_file.with_name(f".tmp{self.state_file.name}")
+            with tmp_state_file.open("wb") as f:
+                np.save(f, frame_signature)
+            os.replace(tmp_state_file, self.state_file)
+
+
+class VisibilityFilter:
+    """
+    Decides what becomes of frames with poor visibility, and remembers whether the
+    latest frame scored was poor, so the next burst can be cut short.
+
+    Parameters
+    ----------
+    state_file: Path to the file holding the score of the latest frame.
+    threshold: Frames scoring less than this have poor visibility.
+    action: What to do with frames with poor visibility - "archive" them without
+            telemetering them, or "discard" them altogether.
+
+    """
+
+    def __init__(self, state_file: pathlib.Path, threshold: float, action: str):
+        self.state_file = state_file
+        self.threshold = threshold
+        self.action = action
+        self._lock = threading.Lock()
+
+        try:
+            self.last = json.loads(state_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.last = None
+
+    @property
+    def last_was_poor(self) -> bool:
+        """Whether the latest frame scored had poor visibility."""
+
+        return self.last is not None and self.last["score"] < self.threshold
+
+    def is_poor(self, frame_visibility: dict) -> bool:
+        """
+        Check, and record, the visibility of a frame.
+
+        Parameters
+        ----------
+        frame_visibility: Visibility of the new frame.
+
+        Returns
+        -------
+        is_poor: True if the frame has poor visibility.
+
+        """
+
+        with self._lock:
+            self.last = frame_visibility
+            tmp_state_file = self.state_file.with_name(f".tmp{self.state_file.name}")
+            tmp_state_file.write_text(json.dumps(frame_visibility))
+            os.replace(tmp_state_file, self.state_file)
+
+        return frame_visibility["score"] < self.threshold
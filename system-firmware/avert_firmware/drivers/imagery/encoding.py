@@ -0,0 +1,173 @@
+"""
+An image encoder that aims for a target file size, rather than a fixed quality, so the
+bandwidth used by each imagery cycle is predictable regardless of scene content.
+
+The quality is found by binary search, encoding a downsampled proxy of the frame rather
+than the frame itself, with the proxy's size scaled up to estimate that of the full
+frame. The estimate is then checked against a real encode of the full frame, and the
+scaling refined and the search repeated, a few times at most.
+
+The parameters chosen are recorded in the image itself, as JSON in the EXIF
+ImageDescription tag, e.g.:
+
+    {"encoder": "target-size", "format": "webp", "quality": 62, "target_bytes": 150000}
+
+along with anything else to be stored with the image, such as its visibility score.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from collections.abc import Callable
+import io
+import json
+
+import numpy as np
+from PIL import Image
+
+
+EXIF_DESCRIPTION = 0x010E
+EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+PROXY_SCALE = 4
+MAX_ATTEMPTS = 5
+FORMAT_TEST_QUALITY = 75
+
+
+def describe(description: dict) -> bytes:
+    """EXIF data recording a description of an image, as JSON."""
+
+    exif = Image.Exif()
+    exif[EXIF_DESCRIPTION] = json.dumps(description)
+
+    return exif.tobytes()
+
+
+def encode(image: Image.Image, format_: str, quality: int, exif: bytes = b"") -> bytes:
+    """
+    Encode an image in memory.
+
+    Parameters
+    ----------
+    image: The image to be encoded.
+    format_: Either "jpeg" or "webp".
+    quality: Quality setting, from 1 to 100.
+    exif: Any EXIF data to be embedded.
+
+    Returns
+    -------
+    data: The encoded image.
+
+    """
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=format_.upper(), quality=quality, exif=exif)
+
+    return buffer.getvalue()
+
+
+def _search_quality(fits: Callable[[int], bool], low: int, high: int) -> int:
+    """Find the highest quality, from low to high, at which an image fits."""
+
+    while low < high:
+        quality = (low + high + 1) // 2
+        if fits(quality):
+            low = quality
+        else:
+            high = quality - 1
+
+    return low
+
+
+def encode_to_target(
+    image: np.ndarray,
+    target_bytes: int,
+    formats: list | None = None,
+    min_quality: int = 20,
+    max_quality: int = 95,
+    description: dict | None = None,
+) -> tuple[bytes, dict]:
+    """
+    Encode an image as close to, without exceeding, a target size as possible.
+
+    Where more than one format is allowed, whichever encodes the proxy smallest at the
+    same quality is used - WebP typically, for the same quality, being smaller than
+    JPEG. Should even the lowest quality exceed the target, the image is encoded at
+    `min_quality` regardless.
+
+    Parameters
+    ----------
+    image: The image to be encoded, with 8 bits per sample.
+    target_bytes: Target size, in bytes, of the encoded image.
+    formats: Formats that may be used - "jpeg" and/or "webp". Defaults to "jpeg" only.
+    min_quality: Lowest quality setting that may be used.
+    max_quality: Highest quality setting that may be used.
+    description: Anything else to be recorded alongside the encoding parameters.
+
+    Returns
+    -------
+    data: The encoded image.
+    params: The encoding parameters chosen, including the format.
+
+    """
+
+    formats = ["jpeg"] if formats is None else formats
+    description = {} if description is None else description
+
+    full = Image.fromarray(image)
+    proxy = full.reduce(PROXY_SCALE)
+
+    # Use whichever format encodes the proxy smallest at a middling quality
+    format_ = min(
+        formats, key=lambda format_: len(encode(proxy, format_, FORMAT_TEST_QUALITY))
+    )
+
+    # Full size is estimated by scaling up the proxy size. The ratio between them
+    # varies with quality (and scene), so starts as the ratio of areas and is then
+    # interpolated from the full encodes made so far, each of which also narrows the
+    # range of qualities left to search
+    proxy_sizes = {}
+    ratios = {}
+
+    def fits(quality: int) -> bool:
+        if quality not in proxy_sizes:
+            proxy_sizes[quality] = len(encode(proxy, format_, quality))
+        if ratios:
+            qualities = sorted(ratios)
+            ratio = np.interp(quality, qualities, [ratios[q] for q in qualities])
+        else:
+            ratio = (full.width * full.height) / (proxy.width * proxy.height)
+        return proxy_sizes[quality] * ratio <= target_bytes
+
+    low, high = min_quality, max_quality
+    quality = None
+    for _ in range(MAX_ATTEMPTS):
+        guess = _search_quality(fits, low, high)
+        if guess == quality:
+            break
+        size = len(encode(full, format_, guess))
+        if size <= target_bytes:
+            quality = low = guess
+        else:
+            high = guess - 1
+        if low >= high:
+            break
+        fits(guess)
+        ratios[guess] = size / proxy_sizes[guess]
+
+    if quality is None:
+        quality = low
+
+    params = {
+        "encoder": "target-size",
+        "format": format_,
+        "quality": quality,
+        "target_bytes": target_bytes,
+    }
+    exif = describe({**params, **description})
+
+    return encode(full, format_, quality, exif), params
+
@@ -10,10 +10,11 @@ GigE-Vision interface standard.
 
 """
 
+from contextlib import contextmanager
 import ctypes
 import sys
+import threading
 
-from PIL import Image
 import numpy as np
 
 try:
@@ -22,112 +23,339 @@ except OSError:
     print("Could not import GigE-V library")
 
 
-def capture_image(instrument_config: dict) -> np.ndarray:
+MAX_CAMERAS = 16
+CONTINUOUS = 0xFFFFFFFF
+
+
+def _unpack_mono10(packed: np.ndarray) -> np.ndarray:
+    """Unpack GigE Vision Mono10Packed - two 10-bit pixels in every three bytes."""
+
+    b = packed.reshape(-1, 3).astype(np.uint16)
+    pixels = np.empty((b.shape[0], 2), dtype=np.uint16)
+    pixels[:, 0] = (b[:, 0] << 2) | (b[:, 1] & 0x03)
+    pixels[:, 1] = (b[:, 2] << 2) | ((b[:, 1] >> 4) & 0x03)
+
+    return pixels
+
+
+def _unpack_mono12(packed: np.ndarray) -> np.ndarray:
+    """Unpack GigE Vision Mono12Packed - two 12-bit pixels in every three bytes."""
+
+    b = packed.reshape(-1, 3).astype(np.uint16)
+    pixels = np.empty((b.shape[0], 2), dtype=np.uint16)
+    pixels[:, 0] = (b[:, 0] << 4) | (b[:, 1] & 0x0F)
+    pixels[:, 1] = (b[:, 2] << 4) | (b[:, 1] >> 4)
+
+    return pixels
+
+
+# Pixel format code: (bytes per pixel, samples per pixel, bit depth, unpacker)
+# Unpacked formats are exposed as views over the frame buffer; packed formats can only
+# be exposed by unpacking them into a new array.
+PIXEL_FORMATS = {
+    0x01080001: (1, 1, 8, None),  # Mono8
+    0x01100003: (2, 1, 10, None),  # Mono10
+    0x010C0004: (1.5, 1, 10, _unpack_mono10),  # Mono10Packed
+    0x01100005: (2, 1, 12, None),  # Mono12
+    0x010C0006: (1.5, 1, 12, _unpack_mono12),  # Mono12Packed
+    0x01100025: (2, 1, 14, None),  # Mono14
+    0x01100007: (2, 1, 16, None),  # Mono16
+    0x02180014: (1, 3, 8, None),  # RGB8Packed
+}
+
+# The GigE-V API is initialised once per process, however many sessions are open
+_api_lock = threading.Lock()
+_api_users = 0
+_discovery_lock = threading.Lock()
+
+
+def _acquire_api() -> None:
+    global _api_users
+    with _api_lock:
+        if _api_users == 0:
+            gev.GevApiInitialize()
+        _api_users += 1
+
+
+def _release_api() -> None:
+    global _api_users
+    with _api_lock:
+        _api_users -= 1
+        if _api_users == 0:
+            gev.GevApiUninitialize()
+
+
+class GigEVSession:
     """
-    Captures an image using a camera that implements the GenICam/GigEV standard
-    interface.
+    A session with a camera that implements the GenICam/GigEV standard interface.
+
+    The camera is opened, its payload parameters queried, and a ring of frame buffers
+    allocated once, when the session is opened. Frames then stream continuously into
+    the ring for as long as the session is open, so each additional frame costs only
+    the wait for it to arrive. A buffer is only refilled once it has been handed back,
+    so frames lent out are never overwritten, and any frames left queued since the
+    last capture are discarded, so each capture is of a frame that arrives after it
+    was asked for.
+
+    Where several cameras are attached, the camera is picked out by its `serial`
+    number, if configured, or else by its `camera_index` in the list of those
+    discovered.
 
     Parameters
     ----------
-    instrument_config: 
-
-    Returns
-    -------
-    image: GigEV camera configuration information.
+    instrument_config: GigEV camera configuration information.
+    camera_index: Index of the camera in the list of those discovered, if not
+                  configured.
 
     """
 
-    # Initialize the API
-    gev.GevApiInitialize()
-
-    # Allocate a maximum number of camera info structures.
-    max_cameras = 16
-    n_cameras = (ctypes.c_uint32)(0)
-    camera_info = (gev.GEV_CAMERA_INFO * max_cameras)()
-
-    status = gev.GevGetCameraList(camera_info, max_cameras, ctypes.byref(n_cameras))
-    if status != 0:
-        print(f"Error {status} getting camera list. Exiting.")
-        sys.exit(status)
-
-    if n_cameras.value == 0:
-        print("No cameras found. Exiting.")
-        sys.exit(1)
-
-    handle = (ctypes.c_void_p)()
-    status = gev.GevOpenCamera(camera_info[0], gev.GevExclusiveMode, ctypes.byref(handle))
-    if status != 0:
-        print(f"Error {status} opening camera. Exiting.")
-        sys.exit(status)
-
-    # Get the payload parameters
-    print("   ...getting payload information...")
-    payload_size = (ctypes.c_uint64)()
-    pixel_format = (ctypes.c_uint32)()
-    status = gev.GevGetPayloadParameters(
-        handle, ctypes.byref(payload_size), ctypes.byref(pixel_format)
-    )
-    if status != 0:
-        print(f"Error {status} getting camera payload parameters. Exiting.")
-        _free_and_close_camera(handle)
-        sys.exit(status)
-
-    feature_strlen = (ctypes.c_int)(gev.MAX_GEVSTRING_LENGTH)
-    unused = (ctypes.c_int)(0)
-
-    width_str = ((ctypes.c_char) * feature_strlen.value)()
-    height_str = ((ctypes.c_char) * feature_strlen.value)()
-    status = gev.GevGetFeatureValueAsString(
-        handle, b"Width", unused, feature_strlen, width_str
-    )
-    status = gev.GevGetFeatureValueAsString(
-        handle, b"Height", ctypes.byref(unused), feature_strlen, height_str
-    )
-
-    buffer_address = ((ctypes.c_void_p) * instrument_config["buffers"])()
-    for i in range(1):
-        buffer_address[i] = ctypes.cast(
-            ((ctypes.c_char) * payload_size.value)(), ctypes.c_void_p
+    def __init__(self, instrument_config: dict, camera_index: int = 0):
+        self.n_buffers = instrument_config["buffers"]
+        self.timeout = instrument_config.get("frame_timeout", 3000)
+        self.camera_index = instrument_config.get("camera_index", camera_index)
+        self.serial = instrument_config.get("serial")
+        if self.serial is not None:
+            self.serial = str(self.serial)
+        self.handle = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def open(self) -> None:
+        """Open the camera, allocate the buffer ring, and start streaming."""
+
+        _acquire_api()
+
+        # Allocate a maximum number of camera info structures.
+        n_cameras = (ctypes.c_uint32)(0)
+        camera_info = (gev.GEV_CAMERA_INFO * MAX_CAMERAS)()
+
+        # Sessions opened in parallel take turns discovering and opening cameras
+        with _discovery_lock:
+            status = gev.GevGetCameraList(
+                camera_info, MAX_CAMERAS, ctypes.byref(n_cameras)
+            )
+            if status != 0:
+                print(f"Error {status} getting camera list. Exiting.")
+                _release_api()
+                sys.exit(status)
+
+            if self.serial is not None:
+                serials = [
+                    camera_info[i].serial.decode() for i in range(n_cameras.value)
+                ]
+                if self.serial not in serials:
+                    print(f"No camera with serial number {self.serial} found. Exiting.")
+                    _release_api()
+                    sys.exit(1)
+                self.camera_index = serials.index(self.serial)
+            elif n_cameras.value <= self.camera_index:
+                print("No cameras found. Exiting.")
+                _release_api()
+                sys.exit(1)
+
+            self.handle = (ctypes.c_void_p)()
+            status = gev.GevOpenCamera(
+                camera_info[self.camera_index],
+                gev.GevExclusiveMode,
+                ctypes.byref(self.handle),
+            )
+        if status != 0:
+            print(f"Error {status} opening camera. Exiting.")
+            self.handle = None
+            _release_api()
+            sys.exit(status)
+
+        # Get the payload parameters
+        print("   ...getting payload information...")
+        self.payload_size = (ctypes.c_uint64)()
+        self.pixel_format = (ctypes.c_uint32)()
+        status = gev.GevGetPayloadParameters(
+            self.handle,
+            ctypes.byref(self.payload_size),
+            ctypes.byref(self.pixel_format),
+        )
+        if status != 0:
+            print(f"Error {status} getting camera payload parameters. Exiting.")
+            self.close()
+            sys.exit(status)
+
+        feature_strlen = (ctypes.c_int)(gev.MAX_GEVSTRING_LENGTH)
+        unused = (ctypes.c_int)(0)
+
+        width_str = ((ctypes.c_char) * feature_strlen.value)()
+        height_str = ((ctypes.c_char) * feature_strlen.value)()
+        status = gev.GevGetFeatureValueAsString(
+            self.handle, b"Width", ctypes.byref(unused), feature_strlen, width_str
+        )
+        status = gev.GevGetFeatureValueAsString(
+            self.handle, b"Height", ctypes.byref(unused), feature_strlen, height_str
+        )
+        self.width, self.height = int(width_str.value), int(height_str.value)
+
+        # Allocate the ring of frame buffers, kept alive for the life of the session
+        self._buffers = [
+            ((ctypes.c_char) * self.payload_size.value)()
+            for _ in range(self.n_buffers)
+        ]
+        buffer_address = ((ctypes.c_void_p) * self.n_buffers)(
+            *[ctypes.cast(buffer, ctypes.c_void_p) for buffer in self._buffers]
         )
 
-    status = gev.GevInitializeTransfer(
-        handle, gev.Asynchronous, payload_size, instrument_config["buffers"], buffer_address
-    )
-
-    # Grab images to fill the buffer
-    status = gev.GevStartTransfer(handle, instrument_config["buffers"])
-    if status != 0:
-        print(f"Error {status} starting transfer. Exiting.")
-        _free_and_close_camera(handle)
-        sys.exit(status)
-
-    # Read the images out
-    gev_buffer_ptr = ctypes.POINTER(gev.GEV_BUFFER_OBJECT)()
-
-    tmout = (ctypes.c_uint32)(3000)
-    status = gev.GevWaitForNextFrame(handle, ctypes.byref(gev_buffer_ptr), tmout.value)
-    if status != 0:
-        print(f"Error {status} waiting for frame. Exiting.")
-        _free_and_close_camera(handle)
-        sys.exit(status)
-
-    gevbuf = gev_buffer_ptr.contents
-    if gevbuf.status == 0:
-        im_size = (gevbuf.w, gevbuf.h)
-        im_addr = ctypes.cast(
-            gevbuf.address,
-            ctypes.POINTER(ctypes.c_ubyte * gevbuf.recv_size),
+        status = gev.GevInitializeTransfer(
+            self.handle,
+            gev.SynchronousNextEmpty,
+            self.payload_size,
+            self.n_buffers,
+            buffer_address,
         )
-        image = Image.frombuffer("L", im_size, im_addr.contents, "raw", "L", 0, 1)
+        if status != 0:
+            print(f"Error {status} initialising transfer. Exiting.")
+            self.close()
+            sys.exit(status)
 
-    _free_and_close_camera(handle)
+        # Stream frames into the ring continuously, until the session is closed
+        status = gev.GevStartTransfer(self.handle, CONTINUOUS)
+        if status != 0:
+            print(f"Error {status} starting transfer. Exiting.")
+            self.close()
+            sys.exit(status)
 
-    return image
+    def _frame_view(self, gevbuf) -> np.ndarray:
+        """Expose the contents of a frame buffer as an array, without copying."""
 
+        try:
+            bytes_pp, samples, _, unpacker = PIXEL_FORMATS[gevbuf.format]
+        except KeyError:
+            print(f"Unsupported pixel format {gevbuf.format:#010x}. Exiting.")
+            self.close()
+            sys.exit(1)
 
-def _free_and_close_camera(handle):
-    """Utility function to quickly free and close the camera."""
+        height, width = gevbuf.h, gevbuf.w
+        row_size = int(width * samples * bytes_pp)
+        stride = row_size + gevbuf.x_padding
+        raw = np.ctypeslib.as_array(
+            ctypes.cast(gevbuf.address, ctypes.POINTER(ctypes.c_ubyte)),
+            shape=(height * stride,),
+        )
+        rows = raw.reshape(height, stride)[:, :row_size]
+
+        if unpacker is not None:
+            return unpacker(np.ascontiguousarray(rows)).reshape(height, width)
+
+        dtype = np.uint8 if bytes_pp == 1 else np.dtype("<u2")
+        image = rows.view(dtype)
+
+        return image.reshape(height, width, samples) if samples > 1 else image
+
+    def _discard_queued(self) -> None:
+        """Hand back any frames that arrived in the ring before they were asked for."""
+
+        gev_buffer_ptr = ctypes.POINTER(gev.GEV_BUFFER_OBJECT)()
+        for _ in range(self.n_buffers):
+            status = gev.GevWaitForNextFrame(
+                self.handle, ctypes.byref(gev_buffer_ptr), 0
+            )
+            if status != 0:
+                return
+            gev.GevReleaseFrame(self.handle, gev_buffer_ptr)
+
+    @contextmanager
+    def frame(self):
+        """
+        Wait for the next frame to arrive in the buffer ring, and lend it out as an
+        array over the frame buffer itself. The buffer is handed back to the ring when
+        the context exits, so the array must not be used beyond it.
+
+        Frames already queued in the ring were captured before this was called, so
+        are discarded first.
+
+        Yields
+        ------
+        image: The most recent frame from the camera.
+
+        """
+
+        self._discard_queued()
+
+        gev_buffer_ptr = ctypes.POINTER(gev.GEV_BUFFER_OBJECT)()
+        status = gev.GevWaitForNextFrame(
+            self.handle, ctypes.byref(gev_buffer_ptr), self.timeout
+        )
+        if status != 0:
+            print(f"Error {status} waiting for frame. Exiting.")
+            self.close()
+            sys.exit(status)
+
+        gevbuf = gev_buffer_ptr.contents
+        try:
+            if gevbuf.status != 0:
+                print(f"Error {gevbuf.status} in received frame. Exiting.")
+                self.close()
+                sys.exit(1)
+
+            yield self._frame_view(gevbuf)
+        finally:
+            if self.handle is not None:
+                gev.GevReleaseFrame(self.handle, gev_buffer_ptr)
+
+    def grab(self) -> np.ndarray:
+        """
+        Wait for the next frame and return a copy of it, independent of the ring.
+
+        Returns
+        -------
+        image: The most recent frame from the camera.
+
+        """
+
+        with self.frame() as image:
+            return image.copy()
+
+    @property
+    def bit_depth(self) -> int:
+        """Significant bits per sample of the camera's current pixel format."""
+
+        return PIXEL_FORMATS.get(self.pixel_format.value, (1, 1, 8, None))[2]
+
+    @property
+    def bytes_per_sample(self) -> int:
+        """Bytes per sample of the frames lent out, once unpacked."""
+
+        return 1 if self.bit_depth == 8 else 2
+
+    def close(self) -> None:
+        """Stop streaming, free the buffer ring, and close the camera."""
+
+        if self.handle is None:
+            return
+
+        gev.GevStopTransfer(self.handle)
+        gev.GevFreeTransfer(self.handle)
+        gev.GevCloseCamera(ctypes.byref(self.handle))
+        self.handle = None
+        self._buffers = None
+        _release_api()
+
+
+def capture_image(instrument_config: dict) -> np.ndarray:
+    """
+    Captures a single image using a camera that implements the GenICam/GigEV standard
+    interface. For more than one frame, use a `GigEVSession` directly.
+
+    Parameters
+    ----------
+    instrument_config: GigEV camera configuration information.
+
+    Returns
+    -------
+    image: The captured frame.
+
+    """
 
-    gev.GevFreeTransfer(handle)
-    gev.GevCloseCamera(ctypes.byref(handle))
-    gev.GevApiUninitialize()
+    with GigEVSession(instrument_config) as camera:
+        return camera.grab()
@@ -0,0 +1,191 @@
+"""
+Contact-sheet mosaics of a camera's frames, as a compact first-look product for review
+over low-bandwidth links, e.g.:
+
+    [components.imagery.mosaic]
+    period = "day"
+    every = 1200
+    columns = 12
+    tile_width = 160
+    quality = 70
+    priority = 2
+
+Here a mosaic is built for each day, of one tile every 20 minutes - the first frame to
+arrive in that 20 minutes, downsampled and stamped with its capture time - laid out 12
+tiles to a row. Once the day is over, the mosaic is written out as a single JPEG,
+named after the start of the day with the "mosaic" tier, e.g.
+`V.SITE.2024.123_000000-0000.mosaic.jpg`, and telemetered at its own priority.
+
+The mosaic is built incrementally, as frames arrive, on a canvas allocated once per
+period and kept on disk as a memory-mapped array - so it carries over from one burst
+to the next, and each frame costs only one resize and one copy into the canvas.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from collections.abc import Callable
+from datetime import datetime as dt, timedelta
+import math
+import os
+import pathlib
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from avert_firmware.utilities.policy import write_policy
+from .tiers import tier_name
+
+
+MOSAIC_TIER = "mosaic"
+PERIODS = {"hour": 3600, "day": 86400}
+CANVAS_SUFFIX = ".canvas.npy"
+
+
+class Mosaic:
+    """
+    Builds mosaics of frames, one per period.
+
+    Parameters
+    ----------
+    state_dir: Directory in which the canvases are kept.
+    mosaic_config: Mosaic configuration.
+    image_path: Gives the path at which an image captured at a given time is written.
+
+    """
+
+    def __init__(
+        self,
+        state_dir: pathlib.Path,
+        mosaic_config: dict,
+        image_path: Callable[[dt], pathlib.Path],
+    ):
+        self.state_dir = state_dir
+        self.image_path = image_path
+        self.period = PERIODS[mosaic_config.get("period", "day")]
+        self.every = mosaic_config.get("every", 1200)
+        self.columns = mosaic_config.get("columns", 12)
+        self.tile_width = mosaic_config.get("tile_width", 160)
+        self.quality = mosaic_config.get("quality", 70)
+        self.priority = mosaic_config.get("priority", 2)
+        self.n_tiles = math.ceil(self.period / self.every)
+        self.rows = math.ceil(self.n_tiles / self.columns)
+        self._lock = threading.Lock()
+
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    def _period_start(self, utcnow: dt) -> dt:
+        midnight = utcnow.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (utcnow - midnight).total_seconds()
+
+        return midnight + timedelta(seconds=elapsed // self.period * self.period)
+
+    def _canvas_file(self, period_start: dt) -> pathlib.Path:
+        return self.state_dir / f"{period_start:%Y%m%dT%H%M%S}{CANVAS_SUFFIX}"
+
+    def _canvas(self, period_start: dt, tile_height: int) -> tuple:
+        """Open the canvas for a period, and its record of tiles filled so far."""
+
+        canvas_file = self._canvas_file(period_start)
+        filled_file = canvas_file.with_suffix(".filled.npy")
+        if canvas_file.is_file():
+            return (
+                np.load(canvas_file, mmap_mode="r+"),
+                np.load(filled_file, mmap_mode="r+"),
+            )
+
+        canvas = np.lib.format.open_memmap(
+            canvas_file,
+            mode="w+",
+            dtype=np.uint8,
+            shape=(self.rows * tile_height, self.columns * self.tile_width, 3),
+        )
+        filled = np.lib.format.open_memmap(
+            filled_file, mode="w+", dtype=np.bool_, shape=(self.n_tiles,)
+        )
+
+        return canvas, filled
+
+    def add(self, image: Image.Image, utcnow: dt) -> None:
+        """
+        Add a frame to the mosaic for its period, if its tile is not yet filled.
+
+        Parameters
+        ----------
+        image: The frame, with 8 bits per sample.
+        utcnow: Capture time of the frame.
+
+        """
+
+        period_start = self._period_start(utcnow)
+        tile = int((utcnow - period_start).total_seconds() // self.every)
+        tile_height = max(1, round(image.height * self.tile_width / image.width))
+
+        with self._lock:
+            self._flush(utcnow)
+            canvas, filled = self._canvas(period_start, tile_height)
+            if filled[tile]:
+                return
+            tile_height = canvas.shape[0] // self.rows
+
+            thumbnail = image.convert("RGB").resize(
+                (self.tile_width, tile_height), Image.BILINEAR, reducing_gap=2.0
+            )
+            stamp = "%H:%M" if self.period > 3600 else "%H:%M:%S"
+            ImageDraw.Draw(thumbnail).text(
+                (4, 2),
+                f"{utcnow:{stamp}}",
+                fill="white",
+                stroke_width=1,
+                stroke_fill="black",
+            )
+
+            row, column = divmod(tile, self.columns)
+            top, left = row * tile_height, column * self.tile_width
+            canvas[top : top + tile_height, left : left + self.tile_width] = np.asarray(
+                thumbnail
+            )
+            filled[tile] = True
+            canvas.flush()
+            filled.flush()
+
+    def flush(self, utcnow: dt) -> None:
+        """
+        Write out the mosaics of any periods that are over.
+
+        Parameters
+        ----------
+        utcnow: Current time.
+
+        """
+
+        with self._lock:
+            self._flush(utcnow)
+
+    def _flush(self, utcnow: dt) -> None:
+        current = self._canvas_file(self._period_start(utcnow))
+        for canvas_file in sorted(self.state_dir.glob(f"*{CANVAS_SUFFIX}")):
+            if canvas_file == current:
+                continue
+
+            period_start = dt.strptime(
+                canvas_file.name.removesuffix(CANVAS_SUFFIX), "%Y%m%dT%H%M%S"
+            )
+            image_path = self.image_path(period_start)
+            mosaic_path = image_path.with_name(tier_name(image_path.name, MOSAIC_TIER))
+            print(f"   ...writing mosaic {mosaic_path.name}...")
+
+            write_policy(mosaic_path, priority=self.priority)
+            tmp_path = mosaic_path.with_name(f".{mosaic_path.name}")
+            Image.fromarray(np.load(canvas_file)).save(
+                tmp_path, format="JPEG", quality=self.quality, optimize=True
+            )
+            os.replace(tmp_path, mosaic_path)
+
+            canvas_file.with_suffix(".filled.npy").unlink(missing_ok=True)
+            canvas_file.unlink()
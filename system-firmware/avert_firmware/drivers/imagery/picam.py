@@ -9,34 +9,134 @@ Retrieve webcam images from Raspberry Pi camera using libcamera and picamera2.
 
 """
 
+from contextlib import contextmanager
+
 import numpy as np
 try:
-    from picamera2 import Picamera2 as pc2
+    from picamera2 import MappedArray, Picamera2 as pc2
     from libcamera import controls
 except ModuleNotFoundError:
-    class pc2:
-        def __init__(self):
-            pass
     print("Could not import Picamera2 module, some features may not work.")
 
 
-def capture_image(
-    camera: pc2 | None = None, camera_port: int | None = None
-) -> np.ndarray:
+WARMUP_FRAMES = 30
+
+
+def _controls(instrument_config: dict) -> dict:
+    """
+    The camera controls to apply: a fixed, manual focus at infinity and no colour
+    saturation, unless configured otherwise under `controls`. Enumerated controls may
+    be configured by name, e.g. `AfMode = "Auto"`.
+
+    """
+
+    camera_controls = {
+        "Saturation": 0.0,
+        "AfMode": controls.AfModeEnum.Manual,
+        "LensPosition": 0.0,
+    }
+    for name, value in instrument_config.get("controls", {}).items():
+        if isinstance(value, str):
+            value = getattr(getattr(controls, f"{name}Enum"), value)
+        camera_controls[name] = value
+
+    return camera_controls
+
+
+class PicamSession:
     """
-    Utility function that retrieves an image from the attached Raspberry Pi camera.
-    
+    A session with a Raspberry Pi camera.
+
+    The camera is configured, and its controls applied, once, when the session is
+    opened. The sensor then streams continuously into a ring of buffers for as long as
+    the session is open, so the auto-exposure stays converged and each additional
+    frame costs only the wait for it to arrive.
+
+    Parameters
+    ----------
+    instrument_config: Raspberry Pi camera configuration information.
+
     """
 
-    if camera is None:
-        camera = pc2(camera_port)
-        camera.set_controls(
-            {
-                "Saturation": 0.0,
-                "AfMode": controls.AfModeEnum.Manual,
-                "LensPosition": 0.0
-            }
+    def __init__(self, instrument_config: dict):
+        self.camera_port = instrument_config.get("camera_port", 0)
+        self.n_buffers = instrument_config.get("buffers", 4)
+        self.resolution = instrument_config.get("resolution")
+        self.warmup_frames = instrument_config.get("warmup_frames", WARMUP_FRAMES)
+        self.controls = _controls(instrument_config)
+        self.camera = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def open(self) -> None:
+        """Configure the camera, start streaming, and let the exposure settle."""
+
+        self.camera = pc2(self.camera_port)
+
+        # libcamera's BGR888 is RGB, in memory order
+        main = {"format": "BGR888"}
+        if self.resolution is not None:
+            main["size"] = tuple(self.resolution)
+        self.camera.configure(
+            self.camera.create_still_configuration(
+                main=main, buffer_count=self.n_buffers
+            )
         )
-        camera.start()
+        self.camera.set_controls(self.controls)
+        self.camera.start()
+
+        print("   ...waiting for auto-exposure to converge...")
+        for _ in range(self.warmup_frames):
+            if self.camera.capture_metadata().get("AeLocked", False):
+                break
+        else:
+            print("   ...auto-exposure did not converge, continuing anyway...")
+
+    def close(self) -> None:
+        """Stop streaming and release the camera."""
+
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera.close()
+            self.camera = None
+
+    @contextmanager
+    def frame(self):
+        """
+        Lend out the next frame, as a view straight into the buffer it arrived in. The
+        buffer is handed back to the camera once the context is exited.
+
+        Yields
+        ------
+        image: The frame, valid only within the context.
+
+        """
+
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, "main") as mapped:
+                yield mapped.array
+        finally:
+            request.release()
+
+    def grab(self) -> np.ndarray:
+        """Capture the next frame, as an array of its own."""
+
+        with self.frame() as image:
+            return image.copy()
+
+
+def capture_image(instrument_config: dict) -> np.ndarray:
+    """
+    Utility function that retrieves an image from the attached Raspberry Pi camera. For
+    more than one frame, use a `PicamSession` directly.
+
+    """
 
-    return camera.capture_array()
+    with PicamSession(instrument_config) as camera:
+        return camera.grab()
@@ -0,0 +1,96 @@
+"""
+A producer/consumer pipeline for capturing bursts of images.
+
+Frames are captured on a fixed schedule by the calling thread, while a pool of workers
+encodes and writes them out, so the time spent encoding does not stretch the interval
+between frames and the encoding of successive frames is spread across the available
+cores.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager
+from datetime import datetime as dt
+import threading
+import time
+from typing import Any
+
+
+def _encode(
+    frame: AbstractContextManager,
+    image: Any,
+    utcnow: dt,
+    write: Callable[[Any, dt], None],
+    slots: threading.Semaphore,
+) -> None:
+    """Write a captured frame, then hand it (and its slot) back."""
+
+    try:
+        write(image, utcnow)
+    finally:
+        frame.__exit__(None, None, None)
+        slots.release()
+
+
+def run_burst(
+    capture: Callable[[], AbstractContextManager],
+    write: Callable[[Any, dt], None],
+    frame_count: int,
+    interval: float,
+    max_in_flight: int = 2,
+    workers: int | None = None,
+) -> None:
+    """
+    Capture a burst of frames at a fixed cadence, encoding them in the background.
+
+    Frame `n` is captured as close as possible to `n * interval` seconds after the
+    first. Should capture fall behind (e.g. because all encoding slots are busy), the
+    following frames are still aimed at their original slots, so the cadence recovers
+    rather than drifting.
+
+    Parameters
+    ----------
+    capture: Returns a context manager that lends out the next frame (an array, or
+             anything else `write` understands, e.g. the path to an already-encoded
+             image). The frame is held until it has been written, then the context is
+             exited - from the worker thread - so a camera can lend out its own frame
+             buffers.
+    write: Encodes and writes a frame, given the frame and its capture time.
+    frame_count: Number of frames to capture.
+    interval: Time, in seconds, between the start of successive captures.
+    max_in_flight: Maximum number of frames captured but not yet written.
+    workers: Number of encoding workers. Defaults to one per core.
+
+    """
+
+    slots = threading.Semaphore(max_in_flight)
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.monotonic()
+        for n in range(frame_count):
+            if (delay := start + n * interval - time.monotonic()) > 0:
+                time.sleep(delay)
+
+            slots.acquire()
+            utcnow = dt.utcnow()
+            frame = capture()
+            try:
+                image = frame.__enter__()
+            except BaseException:
+                slots.release()
+                raise
+            futures.append(
+                executor.submit(_encode, frame, image, utcnow, write, slots)
+            )
+
+    # Surface any errors raised while writing
+    for future in futures:
+        future.result()
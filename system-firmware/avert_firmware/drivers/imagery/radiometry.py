@@ -0,0 +1,173 @@
+"""
+Radiometric statistics from thermal infrared frames.
+
+Raw counts are converted to temperature using the camera's Planck calibration,
+
+    T = B / ln(R / (S - O) + F) - 273.15
+
+where S is the raw count and R, B, F, and O the calibration constants. Rather than
+evaluating this for every pixel of every frame, it is evaluated once for every possible
+count, and the resulting lookup table cached on disk.
+
+For each configured region of interest (ROI), the maximum, mean, and percentile
+temperatures of each frame are computed, and the statistics for a burst written out as
+a single, compact CSV file - a product that can be telemetered in near-real time, ahead
+of the frames themselves.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from datetime import datetime as dt
+import hashlib
+import json
+import os
+import pathlib
+import threading
+
+import numpy as np
+
+from avert_firmware.utilities.policy import write_policy
+
+
+PRODUCT = "IRSTATS"
+
+
+def calibration_lut(
+    radiometry_config: dict, n_counts: int, cache_dir: pathlib.Path
+) -> np.ndarray:
+    """
+    Get the count-to-temperature lookup table for a calibration, building and caching
+    it on first use.
+
+    Parameters
+    ----------
+    radiometry_config: Radiometry configuration, including the Planck constants.
+    n_counts: Number of possible raw counts, e.g. 65536 for 16-bit frames.
+    cache_dir: Directory in which lookup tables are cached.
+
+    Returns
+    -------
+    lut: Temperature, in degrees Celsius, for each raw count (NaN where undefined).
+
+    """
+
+    constants = [radiometry_config[f"planck_{c}"] for c in ("r", "b", "f", "o")]
+    key = hashlib.sha256(json.dumps([constants, n_counts]).encode()).hexdigest()[:16]
+    lut_file = cache_dir / f"planck-{key}.npy"
+    try:
+        return np.load(lut_file)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    planck_r, planck_b, planck_f, planck_o = constants
+    counts = np.arange(n_counts, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kelvin = planck_b / np.log(planck_r / (counts - planck_o) + planck_f)
+    lut = np.where(counts > planck_o, kelvin - 273.15, np.nan).astype(np.float32)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_lut_file = cache_dir / f".{lut_file.name}"
+    with tmp_lut_file.open("wb") as f:
+        np.save(f, lut)
+    os.replace(tmp_lut_file, lut_file)
+
+    return lut
+
+
+def roi_statistics(
+    counts: np.ndarray, lut: np.ndarray, rois: dict, percentiles: list
+) -> dict:
+    """
+    Compute temperature statistics for each region of interest of a frame.
+
+    As temperature increases monotonically with raw count, the maximum and percentiles
+    are found on the raw counts and only they are converted, so only the mean requires
+    every pixel of an ROI to be converted.
+
+    Parameters
+    ----------
+    counts: Raw frame, as an array of counts.
+    lut: Count-to-temperature lookup table.
+    rois: Regions of interest, by name, as [left, top, right, bottom] in pixels.
+    percentiles: Percentiles to compute.
+
+    Returns
+    -------
+    statistics: For each ROI, the max, mean, and percentile temperatures.
+
+    """
+
+    statistics = {}
+    for name, (left, top, right, bottom) in rois.items():
+        roi = counts[top:bottom, left:right]
+        levels = np.percentile(roi, percentiles, method="lower").astype(np.intp)
+        statistics[name] = {
+            "max": float(lut[roi.max()]),
+            "mean": float(np.take(lut, roi).mean(dtype=np.float64)),
+            **{f"p{p:g}": float(lut[level]) for p, level in zip(percentiles, levels)},
+        }
+
+    return statistics
+
+
+class RadiometryLog:
+    """
+    Collects the ROI statistics of each frame of a burst, to be written out as one file
+    at the end of the burst. Frames may be added from several threads at once.
+
+    Parameters
+    ----------
+    radiometry_config: Radiometry configuration.
+    n_counts: Number of possible raw counts, e.g. 65536 for 16-bit frames.
+    cache_dir: Directory in which lookup tables are cached.
+
+    """
+
+    def __init__(
+        self, radiometry_config: dict, n_counts: int, cache_dir: pathlib.Path
+    ):
+        self.rois = radiometry_config["rois"]
+        self.percentiles = radiometry_config.get("percentiles", [50, 95, 99])
+        self.priority = radiometry_config.get("priority", 1)
+        self.lut = calibration_lut(radiometry_config, n_counts, cache_dir)
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def add_frame(self, counts: np.ndarray, utcnow: dt) -> None:
+        """Compute and record the statistics of a frame."""
+
+        statistics = roi_statistics(counts, self.lut, self.rois, self.percentiles)
+        with self._lock:
+            for roi, values in statistics.items():
+                self.rows.append(
+                    [utcnow.isoformat(timespec="milliseconds"), roi]
+                    + [f"{value:.2f}" for value in values.values()]
+                )
+
+    def write(self, file_: pathlib.Path) -> None:
+        """
+        Write out the statistics collected, in time order, with a telemetry priority.
+
+        Parameters
+        ----------
+        file_: Path of the file to be written.
+
+        """
+
+        if not self.rows:
+            return
+
+        header = ["timestamp", "roi", "max", "mean"]
+        header += [f"p{p:g}" for p in self.percentiles]
+        lines = [",".join(header)]
+        lines += [",".join(row) for row in sorted(self.rows)]
+
+        write_policy(file_, priority=self.priority)
+        tmp_file = file_.with_name(f".{file_.name}")
+        tmp_file.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_file, file_)
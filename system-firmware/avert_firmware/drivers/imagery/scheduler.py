@@ -0,0 +1,147 @@
+"""
+Sun-aligned scheduling of imagery bursts, for cameras run continuously rather than
+woken by a fixed timer, e.g.:
+
+    [components.imagery.schedule]
+    every = 1200
+    twilight_every = 300
+    twilight = 1
+    relay_channel = 2
+    power_lead = 90
+
+Each day's capture window runs from `daylight_buffer` hours before sunrise to
+`daylight_buffer` hours after sunset, from the site's solar timetable. Bursts are
+planned every `every` seconds within the window - or, within `twilight` hours of
+sunrise and sunset, every `twilight_every` seconds (of which `every` should be a
+multiple) - on a grid aligned to the hour, so capture times are the same from day to
+day. Where a camera has no `daylight_buffer` (e.g. a thermal camera), the window is the
+whole day.
+
+If a `relay_channel` is configured, the camera is powered through the network relay
+only within its windows, `power_lead` seconds ahead of the first burst to let it boot.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from datetime import datetime as dt, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from avert_firmware.utilities.solar_tracker import solar_timetable
+
+
+def _timetable(
+    longitude: float, latitude: float, start: float, end: float
+) -> np.ndarray:
+    """Sunrise, solar noon, and sunset for each UTC day around a span of time."""
+
+    first = dt.fromtimestamp(start, ZoneInfo("UTC")).date() - timedelta(days=1)
+    last = dt.fromtimestamp(end, ZoneInfo("UTC")).date() + timedelta(days=1)
+
+    rows = []
+    for year in range(first.year, last.year + 1):
+        timetable = solar_timetable(longitude, latitude, year)
+        first_day = first.timetuple().tm_yday if year == first.year else 1
+        last_day = last.timetuple().tm_yday if year == last.year else len(timetable) - 2
+        rows.append(timetable[first_day : last_day + 1])
+
+    return np.concatenate(rows)
+
+
+def capture_windows(
+    longitude: float,
+    latitude: float,
+    start: float,
+    end: float,
+    buffer: float | None,
+) -> np.ndarray:
+    """
+    Find the capture windows overlapping a span of time.
+
+    Parameters
+    ----------
+    longitude: Geographical coordinate denoting how many degrees E(+) or W(-).
+    latitude: Geographical coordinate denoting how many degrees N(+) or S(-).
+    start: Start of the span, as a UTC POSIX timestamp.
+    end: End of the span, as a UTC POSIX timestamp.
+    buffer: How many hours of buffer to use at the start/end of the day, or None for
+            no daylight restriction.
+
+    Returns
+    -------
+    windows: Start and end of each window, as UTC POSIX timestamps.
+
+    """
+
+    if buffer is None:
+        return np.array([[start, end]])
+
+    timetable = _timetable(longitude, latitude, start, end)
+    windows = np.stack(
+        [timetable[:, 0] - buffer * 3600, timetable[:, 2] + buffer * 3600], axis=1
+    )
+
+    # No window at all in polar night, and overlapping windows in polar day
+    windows = windows[(windows[:, 1] > windows[:, 0]) & (windows[:, 1] > start)]
+    windows = windows[windows[:, 0] < end]
+    merged = []
+    for window_start, window_end in windows:
+        if merged and window_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], window_end)
+        else:
+            merged.append([window_start, window_end])
+
+    return np.array(merged).reshape(-1, 2)
+
+
+def plan_captures(
+    longitude: float,
+    latitude: float,
+    start: float,
+    end: float,
+    schedule_config: dict,
+    buffer: float | None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Plan the bursts within a span of time.
+
+    Parameters
+    ----------
+    longitude: Geographical coordinate denoting how many degrees E(+) or W(-).
+    latitude: Geographical coordinate denoting how many degrees N(+) or S(-).
+    start: Start of the span, as a UTC POSIX timestamp.
+    end: End of the span, as a UTC POSIX timestamp.
+    schedule_config: Schedule configuration.
+    buffer: How many hours of buffer to use at the start/end of the day, or None for
+            no daylight restriction.
+
+    Returns
+    -------
+    captures: Time of each burst, as UTC POSIX timestamps.
+    windows: Start and end of each capture window, as UTC POSIX timestamps.
+
+    """
+
+    every = schedule_config.get("every", 1200)
+    step = schedule_config.get("twilight_every", every)
+    twilight = schedule_config.get("twilight", 0) * 3600
+
+    windows = capture_windows(longitude, latitude, start, end, buffer)
+    grid = np.arange(np.ceil(start / step) * step, end, step)
+    in_window = (
+        (grid[:, None] >= windows[:, 0]) & (grid[:, None] <= windows[:, 1])
+    ).any(axis=1)
+
+    due = grid % every == 0
+    if twilight > 0 and step != every:
+        timetable = _timetable(longitude, latitude, start, end)
+        sun_events = np.concatenate([timetable[:, 0], timetable[:, 2]])
+        due |= (np.abs(grid[:, None] - sun_events) <= twilight).any(axis=1)
+
+    return grid[in_window & due], windows
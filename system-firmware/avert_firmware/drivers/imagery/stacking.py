@@ -0,0 +1,208 @@
+"""
+Stacking of bursts of frames into a single, higher signal-to-noise image, for use in low
+light, e.g. at dawn and dusk.
+
+Each frame is aligned to the first by the integer shift that maximises their
+cross-correlation (found by phase correlation, using FFTs over a central window of the
+frames), then accumulated in place into a buffer allocated once for the whole stack.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from collections.abc import Callable
+
+import numpy as np
+
+
+def _window(image: np.ndarray, size: int) -> np.ndarray:
+    """A central, greyscale window of a frame, for alignment."""
+
+    height, width = image.shape[:2]
+    top, left = max(0, (height - size) // 2), max(0, (width - size) // 2)
+    window = image[top : top + size, left : left + size]
+    if window.ndim == 3:
+        return window.mean(axis=2, dtype=np.float32)
+
+    return window.astype(np.float32)
+
+
+def _spectrum(window: np.ndarray) -> np.ndarray:
+    return np.fft.rfft2(window - window.mean())
+
+
+def estimate_shift(reference: np.ndarray, window: np.ndarray) -> tuple[int, int]:
+    """
+    Estimate the integer shift of a frame relative to a reference by phase correlation.
+
+    Parameters
+    ----------
+    reference: Spectrum of the reference window.
+    window: Window of the frame to be aligned, the same size as the reference window.
+
+    Returns
+    -------
+    shift: Shift, (rows, columns), of the frame relative to the reference.
+
+    """
+
+    cross_power = _spectrum(window) * np.conj(reference)
+    cross_power /= np.abs(cross_power) + 1e-12
+    correlation = np.fft.irfft2(cross_power, s=window.shape)
+
+    peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+    return tuple(
+        int(p) - size if p > size // 2 else int(p)
+        for p, size in zip(peak, correlation.shape)
+    )
+
+
+class FrameStack:
+    """
+    Accumulates aligned frames into a mean or median image.
+
+    For the mean, frames are summed in place into a single buffer, with a count of the
+    frames contributing to each pixel (as shifted frames do not cover the edges). For
+    the median, every frame must be kept, in a buffer of `n_frames` frames in their
+    original data type - so memory is bounded, but larger - with any edges a shifted
+    frame does not cover taken from the first frame.
+
+    Parameters
+    ----------
+    n_frames: Number of frames per stack.
+    method: Either "mean" or "median".
+    align_window: Size, in pixels, of the central window used for alignment.
+    max_shift: Shifts larger than this (in pixels) are taken to be spurious, and the
+               frame is discarded.
+
+    """
+
+    def __init__(
+        self,
+        n_frames: int,
+        method: str = "mean",
+        align_window: int = 512,
+        max_shift: int = 64,
+    ):
+        self.n_frames = n_frames
+        self.method = method
+        self.align_window = align_window
+        self.max_shift = max_shift
+        self._buffer = None
+
+    def _allocate(self, image: np.ndarray) -> None:
+        self.shape, self.dtype = image.shape, image.dtype
+        if self.method == "median":
+            self._buffer = np.empty((self.n_frames, *image.shape), dtype=image.dtype)
+        else:
+            self._buffer = np.empty(image.shape, dtype=np.float32)
+            self._counts = np.empty(image.shape[:2], dtype=np.uint16)
+
+    def reset(self) -> None:
+        """Empty the stack, ready for the next set of frames."""
+
+        self.n_added = 0
+        self._reference = None
+        if self._buffer is not None and self.method != "median":
+            self._buffer.fill(0.0)
+            self._counts.fill(0)
+
+    def add(self, image: np.ndarray) -> bool:
+        """
+        Align a frame to the first in the stack, and accumulate it.
+
+        Parameters
+        ----------
+        image: The frame.
+
+        Returns
+        -------
+        added: False if the frame could not be aligned, and so was discarded.
+
+        """
+
+        if self._buffer is None or image.shape != self.shape:
+            self._allocate(image)
+            self.reset()
+
+        window = _window(image, self.align_window)
+        if self._reference is None:
+            self._reference = _spectrum(window)
+            shift = (0, 0)
+        else:
+            shift = estimate_shift(self._reference, window)
+            if max(abs(s) for s in shift) > self.max_shift:
+                return False
+
+        # The overlap of the shifted frame with the reference
+        (dy, dx), (height, width) = shift, image.shape[:2]
+        dst = (
+            slice(max(0, -dy), height - max(0, dy)),
+            slice(max(0, -dx), width - max(0, dx)),
+        )
+        src = (
+            slice(max(0, dy), height - max(0, -dy)),
+            slice(max(0, dx), width - max(0, -dx)),
+        )
+
+        if self.method == "median":
+            if shift != (0, 0):
+                self._buffer[self.n_added] = self._buffer[0]
+            self._buffer[(self.n_added, *dst)] = image[src]
+        else:
+            self._buffer[dst] += image[src]
+            self._counts[dst] += 1
+        self.n_added += 1
+
+        return True
+
+    def result(self) -> np.ndarray:
+        """
+        The stacked image.
+
+        Returns
+        -------
+        image: The mean or median of the frames added, in their original data type.
+
+        """
+
+        if self.method == "median":
+            stacked = np.median(self._buffer[: self.n_added], axis=0)
+        else:
+            # Averaged in place - the accumulator is cleared for the next stack anyway
+            counts = np.maximum(self._counts, 1)
+            if self._buffer.ndim == 3:
+                counts = counts[..., None]
+            stacked = np.divide(self._buffer, counts, out=self._buffer)
+
+        if np.issubdtype(self.dtype, np.integer):
+            limits = np.iinfo(self.dtype)
+            np.rint(stacked, out=stacked)
+            np.clip(stacked, limits.min, limits.max, out=stacked)
+
+        return stacked.astype(self.dtype)
+
+    def capture(self, grab: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Capture and stack a full set of frames.
+
+        Parameters
+        ----------
+        grab: Captures and returns a single frame.
+
+        Returns
+        -------
+        image: The stacked image.
+
+        """
+
+        self.reset()
+        for _ in range(self.n_frames):
+            self.add(grab())
+
+        return self.result()
@@ -9,15 +9,21 @@ Retrieve webcam images from a networked webcam.
 
 """
 
+import pathlib
 import sys
+import uuid
 
 import imageio.v3 as iio
 import numpy as np
 import requests
 
 
-def capture_image(ip: str) -> np.ndarray:
-    """Utility function that retrieves an image via the camera's webserver."""
+CHUNK_SIZE = 1 << 16
+
+
+def _request_image(ip: str) -> requests.Response:
+    """Utility function that requests an image from the camera's webserver."""
+
     try:
         r = requests.get(f"http://{ip}/image.jpg", stream=True)
     except OSError:
@@ -28,4 +34,41 @@ def capture_image(ip: str) -> np.ndarray:
         print("HTTP GET request failed - exiting.")
         sys.exit(r.status_code)
 
-    return iio.imread(r.content)
+    return r
+
+
+def capture_image(ip: str) -> np.ndarray:
+    """Utility function that retrieves an image via the camera's webserver."""
+
+    return iio.imread(_request_image(ip).content)
+
+
+def download_image(ip: str, directory: pathlib.Path) -> pathlib.Path:
+    """
+    Stream the camera's JPEG straight to disk, without decoding it.
+
+    The image is written to a hidden temporary file, which is ignored by the file
+    monitor, so it can be renamed into place once it is complete.
+
+    Parameters
+    ----------
+    ip: Address of the camera within the network.
+    directory: Directory into which to download the image.
+
+    Returns
+    -------
+    tmp_path: Path to the downloaded image.
+
+    """
+
+    tmp_path = directory / f".{uuid.uuid4().hex}.jpg"
+    with _request_image(ip) as r, tmp_path.open("wb") as f:
+        try:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+        except requests.RequestException:
+            print("Connection lost during capture. Exiting.")
+            tmp_path.unlink()
+            sys.exit(1)
+
+    return tmp_path
@@ -0,0 +1,142 @@
+"""
+Resolution tiers for imagery telemetry.
+
+Alongside each full-resolution frame, reduced-resolution copies - tiers - can be
+produced at acquisition time, each with its own telemetry priority and cadence, e.g.:
+
+    [components.imagery.tiers.thumbnail]
+    width = 320
+    quality = 60
+    priority = 1
+    every = 0
+
+    [components.imagery.tiers.full]
+    priority = 8
+    every = 600
+
+Here a thumbnail of every frame is sent ahead of most other data, whereas a full frame
+is sent at most once every 10 minutes. The "full" tier is the original frame itself; if
+it is not configured, every original frame is sent, as normal. All frames are archived
+on the node, regardless; tier copies are made for telemetry only.
+
+Tier copies are JPEGs, named after their original with the tier inserted before the
+file extension, e.g. `V.SITE.2024.123_120000-0000.thumbnail.jpg`. Lower priorities are
+sent first.
+
+Where the full frame is archived, but only a region of interest of it is to be sent,
+the region of interest is also written as a tier copy - the "roi" tier - in whichever
+format the frame itself is encoded.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from datetime import datetime as dt
+import json
+import os
+import pathlib
+import threading
+
+from PIL import Image
+
+from avert_firmware.utilities.policy import DEFAULT_POLICY, write_policy
+
+
+FULL_TIER = "full"
+ROI_TIER = "roi"
+
+
+def tier_name(image_name: str, tier: str, extension: str = "jpg") -> str:
+    """The name of a tier copy of an image (a JPEG, unless otherwise specified)."""
+
+    stem, _ = image_name.rsplit(".", 1)
+
+    return f"{stem}.{tier}.{extension}"
+
+
+class TierSchedule:
+    """
+    Tracks when each tier last had a frame, to decide which tiers are due for each new
+    frame. The times are kept on disk, so cadences hold across bursts.
+
+    Parameters
+    ----------
+    state_file: Path to the file holding the time at which each tier was last due.
+    tiers: The tier configurations, by name.
+
+    """
+
+    def __init__(self, state_file: pathlib.Path, tiers: dict):
+        self.state_file = state_file
+        self.tiers = tiers
+        self._lock = threading.Lock()
+
+        try:
+            self.last = json.loads(state_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.last = {}
+
+    def due(self, utcnow: dt) -> list:
+        """
+        Determine which tiers are due a copy of a frame.
+
+        Parameters
+        ----------
+        utcnow: Capture time of the frame.
+
+        Returns
+        -------
+        tiers: The names of the tiers that are due.
+
+        """
+
+        now = utcnow.timestamp()
+        with self._lock:
+            due = [
+                tier
+                for tier, tier_config in self.tiers.items()
+                if now - self.last.get(tier, 0.0) >= tier_config.get("every", 0)
+            ]
+            if due:
+                self.last.update({tier: now for tier in due})
+                tmp_state_file = self.state_file.with_name(
+                    f".tmp{self.state_file.name}"
+                )
+                tmp_state_file.write_text(json.dumps(self.last))
+                os.replace(tmp_state_file, self.state_file)
+
+        return due
+
+
+def write_tier(
+    image: Image.Image, image_path: pathlib.Path, tier: str, tier_config: dict
+) -> None:
+    """
+    Write a reduced-resolution copy of an image for telemetry only.
+
+    Parameters
+    ----------
+    image: The full-resolution image, with 8 bits per sample.
+    image_path: Path at which the full-resolution image is written.
+    tier: Name of the tier.
+    tier_config: Configuration of the tier.
+
+    """
+
+    tier_path = image_path.with_name(tier_name(image_path.name, tier))
+    width = tier_config["width"]
+    if image.width > width:
+        size = (width, max(1, round(image.height * width / image.width)))
+        image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    priority = tier_config.get("priority", DEFAULT_POLICY["priority"])
+    write_policy(tier_path, archive=False, priority=priority)
+
+    # Written under a hidden name, so the file monitor only sees the finished copy
+    tmp_path = tier_path.with_name(f".{tier_path.name}")
+    image.save(tmp_path, format="JPEG", quality=tier_config.get("quality", 75))
+    os.replace(tmp_path, tier_path)
@@ -0,0 +1,196 @@
+"""
+Support for imagery bursts triggered by other subsystems, e.g. by an event detected on
+the seismic path, so eruptive onsets between scheduled bursts are not missed.
+
+In triggered mode, a camera captures low-cost frames continuously into a ring buffer of
+fixed size, allocated once, so it always holds the last few seconds or minutes before a
+trigger arrives. Triggers are small JSON datagrams sent to a Unix socket held open by
+each camera in triggered mode, in its data directory:
+
+    {data_archive}/imagery/{infrared,visible}/.trigger.sock
+
+(or, where several cameras are configured, in each camera's own state directory), so
+they cost the sender nothing when no camera is listening.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from datetime import datetime as dt
+import json
+import pathlib
+import socket
+
+import numpy as np
+
+
+TRIGGER_SOCKET = ".trigger.sock"
+SOCKET_PATTERNS = [f"*/{TRIGGER_SOCKET}", f"*/.cameras/*/{TRIGGER_SOCKET}"]
+MAX_DATAGRAM = 4096
+
+
+def send_trigger(data_archive: pathlib.Path, source: str, **details) -> int:
+    """
+    Trigger every camera currently in triggered mode.
+
+    Parameters
+    ----------
+    data_archive: Path to the root of the node's data directory.
+    source: Name of the subsystem sending the trigger, e.g. "seismic".
+    details: Any further details of the trigger, e.g. the detection time.
+
+    Returns
+    -------
+    n_triggered: Number of cameras the trigger was delivered to.
+
+    """
+
+    trigger = json.dumps(
+        {"source": source, "sent": dt.utcnow().isoformat(), **details}
+    ).encode()
+
+    socket_paths = [
+        socket_path
+        for pattern in SOCKET_PATTERNS
+        for socket_path in (data_archive / "imagery").glob(pattern)
+    ]
+
+    n_triggered = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        for socket_path in socket_paths:
+            try:
+                sock.sendto(trigger, str(socket_path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a camera no longer in triggered mode
+                continue
+            n_triggered += 1
+
+    return n_triggered
+
+
+class TriggerListener:
+    """
+    Receives triggers for a camera.
+
+    Parameters
+    ----------
+    socket_path: Path of the socket to listen on.
+
+    """
+
+    def __init__(self, socket_path: pathlib.Path):
+        self.socket_path = socket_path
+
+    def __enter__(self):
+        self.socket_path.unlink(missing_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(self.socket_path))
+
+        return self
+
+    def __exit__(self, *_):
+        self._sock.close()
+        self.socket_path.unlink(missing_ok=True)
+
+    def wait(self, timeout: float) -> dict | None:
+        """
+        Wait for a trigger.
+
+        Parameters
+        ----------
+        timeout: Time, in seconds, to wait.
+
+        Returns
+        -------
+        trigger: The trigger, or None if none arrived in time.
+
+        """
+
+        self._sock.settimeout(max(timeout, 0.0))
+        try:
+            data = self._sock.recv(MAX_DATAGRAM)
+        except (BlockingIOError, socket.timeout):
+            return
+
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            return {"source": "unknown"}
+
+
+class FrameRing:
+    """
+    A ring buffer of the most recent frames, within a fixed memory ceiling. The buffer
+    is allocated for as many frames as fit on the first frame pushed, and frames are
+    copied into it, so holding them never allocates.
+
+    Parameters
+    ----------
+    max_bytes: Memory ceiling, in bytes.
+
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._frames = None
+        self.clear()
+
+    def _allocate(self, image: np.ndarray) -> None:
+        n_frames = self.max_bytes // image.nbytes
+        if n_frames < 1:
+            raise ValueError(
+                f"A {image.nbytes}-byte frame exceeds the {self.max_bytes}-byte ring."
+            )
+        self._frames = np.empty((n_frames, *image.shape), dtype=image.dtype)
+        self._times = [None] * n_frames
+        self.clear()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clear(self) -> None:
+        """Empty the ring."""
+
+        self._next, self._count = 0, 0
+
+    def push(self, image: np.ndarray, utcnow: dt) -> None:
+        """
+        Add a frame to the ring, overwriting the oldest frame if it is full.
+
+        Parameters
+        ----------
+        image: The frame.
+        utcnow: Capture time of the frame.
+
+        """
+
+        if self._frames is None or self._frames.shape[1:] != image.shape:
+            self._allocate(image)
+
+        np.copyto(self._frames[self._next], image)
+        self._times[self._next] = utcnow
+        self._next = (self._next + 1) % len(self._frames)
+        self._count = min(self._count + 1, len(self._frames))
+
+    def frames(self) -> list[tuple[np.ndarray, dt]]:
+        """
+        The frames held, oldest first. These are views into the ring, so are only valid
+        until further frames are pushed.
+
+        Returns
+        -------
+        frames: Each frame, with its capture time.
+
+        """
+
+        if self._frames is None:
+            return []
+
+        start = (self._next - self._count) % len(self._frames)
+        slots = [(start + i) % len(self._frames) for i in range(self._count)]
+
+        return [(self._frames[slot], self._times[slot]) for slot in slots]
@@ -11,16 +11,86 @@ dataloggers for seismic systems.
 """
 
 from datetime import datetime as dt
+import os
+import pathlib
 
+from avert_firmware.drivers.imagery.trigger import send_trigger
 from avert_firmware.utilities import get_starttime_endtime
 from avert_firmware.utilities.errors import FileQueryException
+from avert_firmware.utilities.policy import write_policy
+from .detection import (
+    COINCIDENCE,
+    PRODUCT as EVENTS_PRODUCT,
+    STALTADetector,
+    coincident_channels,
+    write_events,
+)
+from .miniseed import read_channel
 from .nanometrics import query_centaur
+from .rsam import PRODUCT as RSAM_PRODUCT, RSAMStream, write_measurements
+
+
+STAGING_DIRNAME = ".staging"
+RSAM_DIRNAME = ".rsam"
+DETECTION_DIRNAME = ".detection"
+
+
+def _product_name(instrument_config: dict, starttime: dt, product: str) -> str:
+    """Utility function that builds the standard name for a product of a query."""
+
+    julday = starttime.timetuple().tm_yday
+
+    return (
+        f"{instrument_config['network_code']}.{instrument_config['site_code']}."
+        f"{starttime.year}.{julday:03d}_{starttime:%H%M%S}.{product}.csv"
+    )
+
+
+def _release_staged(
+    staging_dir: pathlib.Path, receive_dir: pathlib.Path, priority: int | None = None
+) -> None:
+    """
+    Release staged waveform data to the file monitor, with their policy set first.
+
+    Parameters
+    ----------
+    staging_dir: Path to the staging directory.
+    receive_dir: Path to the receive directory.
+    priority: Telemetry priority of the waveform data, if not the default.
+
+    """
+
+    if not staging_dir.is_dir():
+        return
+
+    for file_ in sorted(staging_dir.iterdir()):
+        if file_.name.startswith(".") or not file_.is_file():
+            continue
+        if priority is not None:
+            write_policy(receive_dir / file_.name, priority=priority)
+        os.replace(file_, receive_dir / file_.name)
 
 
 def handle_query(instrument_config: dict, dirs: dict) -> None:
     """
     Handles queries to seismic instruments attached to the AVERT system.
 
+    Waveform data are retrieved into a hidden staging directory, and only moved into
+    the receive directory once any processing of them is complete - so the file monitor
+    never sees them before their telemetry policy is set. They are released even if
+    their processing fails, and any left in staging by an earlier query that did not
+    finish are released before anything new is retrieved.
+
+    If `rsam` is configured, RSAM and SSAM are computed from the waveform data as they
+    are retrieved, and written out as a single product file, telemetered with high
+    priority (see `rsam`).
+
+    If `detection` is configured, events are detected in the waveform data by STA/LTA.
+    Where events start on at least `min_channels` channels within `coincidence`
+    seconds of one another, the waveform data are telemetered with top priority, any
+    cameras in triggered mode are triggered, and the events are written out as a
+    product file (see `detection`).
+
     Parameters
     ----------
     instrument_config: Seismometer configuration information.
@@ -33,24 +103,95 @@ def handle_query(instrument_config: dict, dirs: dict) -> None:
         timestep=instrument_config["timestep"],
     )
 
-    print("Retrieving waveform data...")
-    for channel in instrument_config["channel_codes"]:
-        print(f"  ...retrieving {channel} data...")
+    rsam_config = instrument_config.get("rsam")
+    detection_config = instrument_config.get("detection")
+    staging_dir = dirs["receive"] / STAGING_DIRNAME
+    state_dir = dirs["receive"].parent
+    rsam_rows, events, priority = [], [], None
 
-        match instrument_config["model"]:
-            case "centaur":
-                try:
-                    filename = query_centaur(
-                        starttime,
-                        endtime,
-                        channel,
-                        "D",
-                        instrument_config,
-                        dirs,
+    # Release any waveform data left in staging by a query that did not finish
+    _release_staged(staging_dir, dirs["receive"])
+
+    try:
+        print("Retrieving waveform data...")
+        for channel in instrument_config["channel_codes"]:
+            print(f"  ...retrieving {channel} data...")
+
+            match instrument_config["model"]:
+                case "centaur":
+                    try:
+                        filename = query_centaur(
+                            starttime,
+                            endtime,
+                            channel,
+                            "D",
+                            instrument_config,
+                            {**dirs, "receive": staging_dir},
+                        )
+                    except FileQueryException:
+                        continue
+
+            if rsam_config is None and detection_config is None:
+                continue
+            try:
+                segments = read_channel(staging_dir / filename, channel)
+            except (OSError, ValueError) as e:
+                print(f"    ...could not read {filename} ({e}), continuing...")
+                continue
+
+            if rsam_config is not None:
+                print(f"  ...computing RSAM for {channel}...")
+                rsam = RSAMStream(
+                    rsam_config, state_dir / RSAM_DIRNAME / f"{channel}.npz"
+                )
+                rsam_rows += [
+                    (window_start, channel, values)
+                    for window_start, values in rsam.update(segments)
+                ]
+                rsam.save()
+
+            if detection_config is not None:
+                print(f"  ...detecting events on {channel}...")
+                detector = STALTADetector(
+                    detection_config, state_dir / DETECTION_DIRNAME / f"{channel}.json"
+                )
+                events += [(channel, event) for event in detector.update(segments)]
+                detector.save()
+
+        if events:
+            n_channels = coincident_channels(
+                events, detection_config.get("coincidence", COINCIDENCE)
+            )
+            if n_channels >= detection_config.get("min_channels", 1):
+                priority = detection_config.get("priority", 0)
+                print(f"  ...coincident events on {n_channels} channel(s)...")
+
+                onsets = [event["on"] for _, event in events if not event["continued"]]
+                if onsets:
+                    n_triggered = send_trigger(
+                        dirs["receive"].parents[1],
+                        "seismic",
+                        onset=min(onsets).isoformat(),
                     )
-                    # Read, then write a lock file for the endtime?
-                except FileQueryException:
-                    continue
+                    print(f"  ...triggered {n_triggered} camera(s)...")
+
+                write_events(
+                    dirs["receive"]
+                    / _product_name(instrument_config, starttime, EVENTS_PRODUCT),
+                    events,
+                    priority,
+                )
+    finally:
+        # Release the waveform data to the file monitor, with their policy set first
+        _release_staged(staging_dir, dirs["receive"], priority)
+
+    if rsam_rows:
+        write_measurements(
+            dirs["receive"] / _product_name(instrument_config, starttime, RSAM_PRODUCT),
+            rsam.columns,
+            rsam_rows,
+            rsam_config.get("priority", 1),
+        )
 
     print("Retrieving SOH log data...")
     for channel in instrument_config["soh_channel_codes"]:
@@ -59,7 +200,7 @@ def handle_query(instrument_config: dict, dirs: dict) -> None:
         match instrument_config["model"]:
             case "centaur":
                 try:
-                    filename = query_centaur(
+                    query_centaur(
                         starttime,
                         endtime,
                         channel,
@@ -0,0 +1,328 @@
+"""
+Event detection on the node, by a recursive STA/LTA detector run over the waveform data
+as they are retrieved from the datalogger, e.g.:
+
+    [components.seismic.detection]
+    sta = 1.0
+    lta = 30.0
+    trigger_on = 3.5
+    trigger_off = 1.5
+    min_channels = 2
+    coincidence = 10.0
+    priority = 0
+
+For each channel, the short- and long-term averages (STA and LTA) of the squared,
+demeaned waveform are tracked by recursive (exponential) averages, over `sta` and `lta`
+seconds. An event starts when their ratio rises above `trigger_on`, and ends when it
+falls below `trigger_off`. Events count as a detection only where they start on at
+least `min_channels` channels within `coincidence` seconds of one another.
+
+Each recursive average is evaluated in blocks: within a block, the response to the
+samples of that block is found with array operations, and only the state at the end of
+each block is passed on from one block to the next in Python. The state of the detector
+is kept, in the state directory, from one retrieval to the next, so the averages run on
+seamlessly across retrievals and events may span several.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from calendar import timegm
+from datetime import datetime as dt, timedelta as td
+import json
+import os
+import pathlib
+
+import numpy as np
+
+from avert_firmware.utilities.policy import write_policy
+
+
+PRODUCT = "EVENTS"
+COINCIDENCE = 10.0
+
+# Within a block, terms are scaled by up to this factor - small enough to keep the
+# precision of the averages well within that of the data
+MAX_BLOCK_GAIN = 1e6
+
+STATE_KEYS = ["end", "rate", "mean", "sta", "lta", "warmup", "on", "peak"]
+
+
+def exponential_average(
+    samples: np.ndarray, alpha: float, initial: float = 0.0
+) -> tuple[np.ndarray, float]:
+    """
+    The recursive average y[i] = (1 - alpha) * y[i - 1] + alpha * x[i], evaluated in
+    blocks.
+
+    Parameters
+    ----------
+    samples: The samples, x.
+    alpha: Weight given to each new sample.
+    initial: The average before the first sample.
+
+    Returns
+    -------
+    average: The average after each sample.
+    final: The average after the last sample.
+
+    """
+
+    if len(samples) == 0:
+        return np.empty(0), initial
+
+    decay = 1.0 - alpha
+    block = max(1, min(len(samples), int(np.log(MAX_BLOCK_GAIN) / -np.log(decay))))
+    n_blocks = -(-len(samples) // block)
+    blocks = np.zeros(n_blocks * block)
+    blocks[: len(samples)] = samples
+    blocks = blocks.reshape(n_blocks, block)
+
+    # Response of each block to its own samples, from rest
+    powers = decay ** np.arange(block)
+    average = alpha * powers * np.cumsum(blocks / powers, axis=1)
+
+    # Then the decaying contribution of the state at the start of each block
+    block_decay = decay**block
+    starts = np.empty(n_blocks)
+    state = initial
+    for i, end in enumerate(average[:, -1]):
+        starts[i] = state
+        state = end + block_decay * state
+    average += starts[:, None] * (powers * decay)
+
+    average = average.ravel()[: len(samples)]
+
+    return average, float(average[-1])
+
+
+class STALTADetector:
+    """
+    Detects events on one channel, as a stream of data.
+
+    Parameters
+    ----------
+    detection_config: Detection configuration.
+    state_file: Path of the file in which the state of the detector is kept.
+
+    """
+
+    def __init__(self, detection_config: dict, state_file: pathlib.Path):
+        self.sta = detection_config.get("sta", 1.0)
+        self.lta = detection_config.get("lta", 30.0)
+        self.trigger_on = detection_config.get("trigger_on", 3.5)
+        self.trigger_off = detection_config.get("trigger_off", 1.5)
+        self.state_file = state_file
+
+        try:
+            state = json.loads(state_file.read_text())
+            self.state = {key: state[key] for key in STATE_KEYS}
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            self.state = None
+
+    def _reset(self, start: float, rate: float, first: float) -> None:
+        """Start afresh, with no triggering until the LTA has warmed up."""
+
+        self.state = {
+            "end": start,
+            "rate": rate,
+            "mean": first,
+            "sta": 0.0,
+            "lta": 0.0,
+            "warmup": round(self.lta * rate),
+            "on": None,
+            "peak": 0.0,
+        }
+
+    def update(self, segments: list) -> list[dict]:
+        """
+        Process newly retrieved data.
+
+        Parameters
+        ----------
+        segments: Contiguous segments of data, in time order, each as its start time,
+                  sampling rate, and samples (see `miniseed.read_channel`).
+
+        Returns
+        -------
+        events: Each event found, as its start and end time (None if it has not yet
+                ended), its peak STA/LTA ratio, and whether it continues from an
+                earlier retrieval.
+
+        """
+
+        events = []
+        for starttime, rate, samples in segments:
+            start = timegm(starttime.timetuple()) + starttime.microsecond * 1e-6
+            samples = samples.astype(np.float64)
+
+            state = self.state
+            if state is not None and state["rate"] == rate:
+                overlap = round((state["end"] - start) * rate)
+                if overlap >= 0:
+                    start, samples = start + overlap / rate, samples[overlap:]
+                else:
+                    # A gap - any event in progress is taken to have ended with it
+                    events += self._close(state["end"])
+                    state = None
+            elif state is not None:
+                events += self._close(state["end"])
+                state = None
+            if len(samples) == 0:
+                continue
+            if state is None:
+                self._reset(start, rate, samples[0])
+
+            events += self._process(start, rate, samples)
+
+        return events
+
+    def _close(self, end: float) -> list[dict]:
+        if self.state["on"] is None:
+            return []
+
+        return [self._event(self.state["on"], end, self.state["peak"], True)]
+
+    @staticmethod
+    def _event(on: float, off: float | None, peak: float, continued: bool) -> dict:
+        def to_datetime(time):
+            return None if time is None else dt(1970, 1, 1) + td(seconds=time)
+
+        return {
+            "on": to_datetime(on),
+            "off": to_datetime(off),
+            "peak": peak,
+            "continued": continued,
+        }
+
+    def _process(self, start: float, rate: float, samples: np.ndarray) -> list:
+        state = self.state
+        mean, state["mean"] = exponential_average(
+            samples, 1 / (self.lta * rate), state["mean"]
+        )
+        energy = (samples - mean) ** 2
+        sta, state["sta"] = exponential_average(
+            energy, 1 / (self.sta * rate), state["sta"]
+        )
+        lta, state["lta"] = exponential_average(
+            energy, 1 / (self.lta * rate), state["lta"]
+        )
+
+        ratio = np.divide(sta, lta, out=np.zeros_like(sta), where=lta > 0)
+        warmup = min(state["warmup"], len(ratio))
+        ratio[:warmup] = 0.0
+        state["warmup"] -= warmup
+
+        # Triggered wherever the last crossing above the "on" level is more recent than
+        # the last crossing below the "off" level
+        index = np.arange(len(ratio))
+        last_on = np.maximum.accumulate(np.where(ratio > self.trigger_on, index, -1))
+        last_off = np.maximum.accumulate(np.where(ratio < self.trigger_off, index, -1))
+        was_triggered = state["on"] is not None
+        triggered = np.where(
+            (last_on < 0) & (last_off < 0), was_triggered, last_on > last_off
+        )
+
+        changes = np.flatnonzero(np.diff(triggered, prepend=was_triggered))
+        bounds = np.concatenate([[0], changes, [len(ratio)]])
+        events = []
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if last <= first or not triggered[first]:
+                continue
+            continued = bool(first == 0 and was_triggered)
+            on = state["on"] if continued else start + first / rate
+            peak = float(ratio[first:last].max())
+            peak = max(peak, state["peak"]) if continued else peak
+            if last < len(ratio):
+                events.append(self._event(on, start + last / rate, peak, continued))
+            else:
+                state["on"], state["peak"] = on, peak
+                events.append(self._event(on, None, peak, continued))
+        if not triggered[-1]:
+            state["on"], state["peak"] = None, 0.0
+
+        state["end"] = start + len(samples) / rate
+
+        return events
+
+    def save(self) -> None:
+        """Keep the state of the detector for the next retrieval."""
+
+        if self.state is None:
+            return
+
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_state_file = self.state_file.with_name(f".{self.state_file.name}")
+        tmp_state_file.write_text(json.dumps(self.state))
+        os.replace(tmp_state_file, self.state_file)
+
+
+def coincident_channels(rows: list, window: float = COINCIDENCE) -> int:
+    """
+    The greatest number of channels on which events start within a window of one
+    another.
+
+    Parameters
+    ----------
+    rows: Channel of each event, and the event.
+    window: Length of the coincidence window, in seconds.
+
+    Returns
+    -------
+    n_channels: Number of channels with an event starting in the busiest window.
+
+    """
+
+    onsets = sorted((event["on"], channel) for channel, event in rows)
+    window = td(seconds=window)
+
+    return max(
+        (
+            len({channel for on, channel in onsets[i:] if on - first <= window})
+            for i, (first, _) in enumerate(onsets)
+        ),
+        default=0,
+    )
+
+
+def write_events(file_: pathlib.Path, rows: list, priority: int = 0) -> None:
+    """
+    Write out the events that have ended, in time order, with a telemetry priority.
+
+    Parameters
+    ----------
+    file_: Path of the file to be written.
+    rows: Channel of each event, and the event.
+    priority: Telemetry priority of the file.
+
+    """
+
+    rows = sorted(
+        ((event["on"], channel, event) for channel, event in rows if event["off"]),
+        key=lambda row: row[:2],
+    )
+    if not rows:
+        return
+
+    lines = ["on,off,channel,duration,peak_ratio"]
+    lines += [
+        ",".join(
+            [
+                on.isoformat(timespec="milliseconds"),
+                event["off"].isoformat(timespec="milliseconds"),
+                channel,
+                f"{(event['off'] - on).total_seconds():.2f}",
+                f"{event['peak']:.2f}",
+            ]
+        )
+        for on, channel, event in rows
+    ]
+
+    write_policy(file_, priority=priority)
+    tmp_file = file_.with_name(f".{file_.name}")
+    tmp_file.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_file, file_)
@@ -0,0 +1,374 @@
+"""
+A self-contained reader for the miniSEED (SEED 2.x) records retrieved from the
+datalogger, so waveforms can be processed on the node without ObsPy.
+
+Steim1 and Steim2 compressed data are decoded for all of the records in a file at once:
+every 32-bit word of every 64-byte frame is unpacked into its differences in a single
+set of array operations, and the differences integrated with one cumulative sum, rather
+than word by word. Uncompressed 16- and 32-bit integer records are also read.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from calendar import timegm
+from datetime import datetime as dt, timedelta as td
+from fractions import Fraction
+import math
+import pathlib
+import struct
+
+import numpy as np
+
+
+# Byte order is given per record, so the header formats are given without one
+FIXED_HEADER = "6scc5s2s3s2sHHBBBxHHhhBBBBiHH"
+FIXED_HEADER_SIZE = struct.calcsize(f">{FIXED_HEADER}")
+FRAME_WORDS = 16
+FRAME_BYTES = 4 * FRAME_WORDS
+NS = 10**9
+
+STEIM1, STEIM2 = 10, 11
+INT16, INT32 = 1, 3
+
+# Number and width, in bits, of the differences packed in a word, indexed by
+# 4 * nibble + dnib (the top two bits of the word, used by Steim2 only)
+STEIM_CODES = {
+    STEIM1: (
+        np.repeat([0, 4, 2, 1], 4),
+        np.repeat([0, 8, 16, 32], 4),
+    ),
+    STEIM2: (
+        np.array([0, 0, 0, 0, 4, 4, 4, 4, 0, 1, 2, 3, 5, 6, 7, 0]),
+        np.array([0, 0, 0, 0, 8, 8, 8, 8, 0, 30, 15, 10, 6, 5, 4, 0]),
+    ),
+}
+
+
+def _byte_order(record: bytes) -> str:
+    """The byte order of a record's header, from whether its year is plausible."""
+
+    (year,) = struct.unpack(">H", record[20:22])
+
+    return ">" if 1900 <= year <= 2100 else "<"
+
+
+def _timestamp_ns(time: dt) -> int:
+    """A naive UTC datetime as a POSIX timestamp, in integer nanoseconds."""
+
+    return timegm(time.timetuple()) * NS + time.microsecond * 1000
+
+
+def _samples_before(offset_ns: int, rate: float) -> int:
+    """
+    The number of samples, at a sampling rate of rate, that fall before a time
+    offset_ns nanoseconds after the first - with sample times taken to the nearest
+    nanosecond, and the arithmetic done exactly, in fractions.
+
+    """
+
+    return math.ceil(Fraction(2 * offset_ns - 1, 2 * NS) * Fraction(rate))
+
+
+def _sampling_rate(factor: int, multiplier: int) -> float:
+    if factor == 0:
+        return 0.0
+    rate = float(factor) if factor > 0 else -1.0 / factor
+    if multiplier > 0:
+        rate *= multiplier
+    elif multiplier < 0:
+        rate /= -multiplier
+
+    return rate
+
+
+def read_records(data: bytes) -> list[dict]:
+    """
+    Read the headers of each record in a miniSEED file.
+
+    Parameters
+    ----------
+    data: Contents of the miniSEED file.
+
+    Returns
+    -------
+    records: The header of each record, with the position and length of its data,
+             and its start time as a POSIX timestamp in integer nanoseconds.
+
+    """
+
+    records, offset = [], 0
+    while offset + FIXED_HEADER_SIZE <= len(data):
+        header = data[offset : offset + FIXED_HEADER_SIZE]
+        order = _byte_order(header)
+        fields = struct.unpack(f"{order}{FIXED_HEADER}", header)
+        station, location, channel, network = fields[3:7]
+        year, day, hour, minute, second, fraction = fields[7:13]
+        n_samples, factor, multiplier, activity = fields[13:17]
+        correction, data_offset, blockette_offset = fields[20:23]
+
+        encoding, word_order, record_length, n_frames = None, 1, None, 0
+        rate = _sampling_rate(factor, multiplier)
+        microseconds = 0
+        while blockette_offset:
+            kind, next_offset = struct.unpack(
+                f"{order}HH",
+                data[offset + blockette_offset : offset + blockette_offset + 4],
+            )
+            body = offset + blockette_offset + 4
+            match kind:
+                case 100:
+                    (rate,) = struct.unpack(f"{order}f", data[body : body + 4])
+                case 1000:
+                    encoding, word_order, exponent = data[body : body + 3]
+                    record_length = 2**exponent
+                case 1001:
+                    microseconds = struct.unpack("b", data[body + 1 : body + 2])[0]
+                    n_frames = data[body + 3]
+            blockette_offset = next_offset
+
+        if record_length is None:
+            raise ValueError(f"Record at byte {offset} has no blockette 1000.")
+
+        seconds = timegm((year, 1, 1, hour, minute, second)) + (day - 1) * 86400
+        starttime_ns = seconds * NS + fraction * 100_000 + microseconds * 1000
+        if not activity & 0x02:
+            # Time correction not yet applied
+            starttime_ns += correction * 100_000
+
+        records.append(
+            {
+                "id": ".".join(
+                    code.decode("ascii").strip()
+                    for code in (network, station, location, channel)
+                ),
+                "channel": channel.decode("ascii").strip(),
+                "starttime_ns": starttime_ns,
+                "sampling_rate": rate,
+                "n_samples": n_samples,
+                "encoding": encoding,
+                "word_order": ">" if word_order == 1 else "<",
+                "data_offset": offset + data_offset,
+                "data_length": record_length - data_offset,
+                "n_frames": n_frames,
+            }
+        )
+        offset += record_length
+
+    return records
+
+
+def decode_steim(
+    frames: np.ndarray,
+    record_frames: np.ndarray,
+    n_samples: np.ndarray,
+    encoding: int = STEIM2,
+) -> np.ndarray:
+    """
+    Decode Steim1 or Steim2 compressed data, for any number of records at once.
+
+    Parameters
+    ----------
+    frames: The 64-byte frames of every record, in order, as an array of 16 words
+            per frame, in native byte order.
+    record_frames: Number of frames in each record.
+    n_samples: Number of samples in each record.
+    encoding: Either STEIM1 (10) or STEIM2 (11).
+
+    Returns
+    -------
+    samples: The samples of every record, in order.
+
+    Raises
+    ------
+    ValueError: If the data do not hold as many samples as the records claim.
+
+    """
+
+    if n_samples.sum() == 0:
+        return np.empty(0, dtype=np.int32)
+
+    counts_table, widths_table = STEIM_CODES[encoding]
+    words = frames.astype(np.int64)
+    nibbles = (words[:, :1] >> np.arange(30, -1, -2)) & 3
+
+    # Control words, and the integration constants in a record's first frame, all have
+    # a nibble of 0, so hold no differences
+    codes = (4 * nibbles + (words >> 30)).ravel()
+    words = words.ravel()
+    counts, widths = counts_table[codes], widths_table[codes]
+
+    # Unpack every word into up to 7 differences, most significant first
+    position = np.arange(counts_table.max())
+    valid = position < counts[:, None]
+    shifts = (counts[:, None] - 1 - position) * widths[:, None]
+    widths = np.maximum(widths, 1)[:, None]
+    diffs = (words[:, None] >> np.where(valid, shifts, 0)) & ((1 << widths) - 1)
+    diffs -= ((diffs >> (widths - 1)) & 1) << widths
+    diffs = diffs[valid]
+
+    # Drop any differences beyond each record's sample count
+    first_frames = np.concatenate([[0], np.cumsum(record_frames)[:-1]])
+    frame_diffs = counts.reshape(-1, FRAME_WORDS).sum(axis=1)
+    record_diffs = np.add.reduceat(frame_diffs, first_frames)
+    if np.any(record_diffs < n_samples):
+        raise ValueError("Steim data hold fewer samples than their records claim.")
+    record_starts = np.concatenate([[0], np.cumsum(record_diffs)[:-1]])
+    offsets = np.arange(len(diffs)) - np.repeat(record_starts, record_diffs)
+    diffs = diffs[offsets < np.repeat(n_samples, record_diffs)]
+
+    # Integrate from each record's forward integration constant - its first
+    # difference is relative to the previous record, so is not needed
+    starts = np.concatenate([[0], np.cumsum(n_samples)[:-1]])
+    diffs[starts[n_samples > 0]] = 0
+    integrated = np.cumsum(diffs)
+    forward = frames[first_frames, 1].astype(np.int32).astype(np.int64)
+    offsets = forward - integrated[np.minimum(starts, len(diffs) - 1)]
+    samples = integrated + np.repeat(offsets, n_samples)
+
+    reverse = frames[first_frames, 2].astype(np.int32)
+    ends = starts + n_samples - 1
+    mismatched = (n_samples > 0) & (samples[np.maximum(ends, 0)] != reverse)
+    if mismatched.any():
+        print(f"   ...{mismatched.sum()} record(s) failed the Steim integrity check...")
+
+    return samples.astype(np.int32)
+
+
+def _decode_records(data: bytes, records: list[dict]) -> list[np.ndarray]:
+    """Decode the samples of each record, batching records by encoding."""
+
+    samples = [None] * len(records)
+    batches = {}
+    for i, record in enumerate(records):
+        batches.setdefault((record["encoding"], record["word_order"]), []).append(i)
+
+    for (encoding, order), indices in batches.items():
+        if encoding in (INT16, INT32):
+            dtype = np.dtype(f"{order}i{2 if encoding == INT16 else 4}")
+            for i in indices:
+                record = records[i]
+                samples[i] = np.frombuffer(
+                    data,
+                    dtype=dtype,
+                    count=record["n_samples"],
+                    offset=record["data_offset"],
+                ).astype(np.int32)
+        elif encoding in STEIM_CODES:
+            record_frames = np.array(
+                [
+                    records[i]["n_frames"] or records[i]["data_length"] // FRAME_BYTES
+                    for i in indices
+                ]
+            )
+            frames = np.concatenate(
+                [
+                    np.frombuffer(
+                        data,
+                        dtype=f"{order}u4",
+                        count=n * FRAME_WORDS,
+                        offset=records[i]["data_offset"],
+                    )
+                    for i, n in zip(indices, record_frames)
+                ]
+            ).reshape(-1, FRAME_WORDS)
+            n_samples = np.array([records[i]["n_samples"] for i in indices])
+            decoded = decode_steim(
+                frames.astype(np.uint32), record_frames, n_samples, encoding
+            )
+            for i, record_samples in zip(
+                indices, np.split(decoded, np.cumsum(n_samples)[:-1])
+            ):
+                samples[i] = record_samples
+        else:
+            raise ValueError(f"Unsupported miniSEED data encoding: {encoding}.")
+
+    return samples
+
+
+def read_channel(
+    source: pathlib.Path | bytes,
+    channel: str,
+    starttime: dt | None = None,
+    endtime: dt | None = None,
+) -> list[tuple[dt, float, np.ndarray]]:
+    """
+    Read a window of waveform data for a channel from a miniSEED file.
+
+    Contiguous records are joined, and samples overlapping those already read are
+    dropped, so each gap in the data starts a new segment.
+
+    Parameters
+    ----------
+    source: Path to, or contents of, the miniSEED file.
+    channel: Channel code, e.g. "BHZ".
+    starttime: Beginning of the window, in UTC. Defaults to the start of the data.
+    endtime: End (exclusive) of the window, in UTC. Defaults to the end of the data.
+
+    Returns
+    -------
+    segments: Each contiguous segment of data, as its start time, sampling rate, and
+              samples.
+
+    """
+
+    data = source.read_bytes() if isinstance(source, pathlib.Path) else source
+    window_start = None if starttime is None else _timestamp_ns(starttime)
+    window_end = None if endtime is None else _timestamp_ns(endtime)
+
+    records = [
+        record
+        for record in read_records(data)
+        if record["channel"] == channel
+        and record["n_samples"] > 0
+        and record["sampling_rate"] > 0
+        and (window_end is None or record["starttime_ns"] < window_end)
+        and (
+            window_start is None
+            or _samples_before(
+                window_start - record["starttime_ns"], record["sampling_rate"]
+            )
+            < record["n_samples"]
+        )
+    ]
+    records.sort(key=lambda record: record["starttime_ns"])
+
+    # Start time (in nanoseconds), sampling rate, number of samples, and samples of
+    # each segment
+    segments = []
+    for record, samples in zip(records, _decode_records(data, records)):
+        rate, start = record["sampling_rate"], record["starttime_ns"]
+        if segments and segments[-1][1] == rate:
+            segment = segments[-1]
+            offset = Fraction(start - segment[0], NS) * Fraction(rate)
+            overlap = segment[2] - round(offset)
+            if overlap >= 0:
+                segment[2] += max(0, len(samples) - overlap)
+                segment[3].append(samples[overlap:])
+                continue
+        segments.append([start, rate, len(samples), [samples]])
+
+    trimmed = []
+    for start, rate, n_samples, samples in segments:
+        # Whole-sample offsets of the window from the segment's first sample
+        first, last = 0, n_samples
+        if window_start is not None:
+            first = min(max(_samples_before(window_start - start, rate), 0), n_samples)
+        if window_end is not None:
+            last = min(max(_samples_before(window_end - start, rate), 0), n_samples)
+        if last <= first:
+            continue
+        first_ns = start + round(first * Fraction(NS) / Fraction(rate))
+        trimmed.append(
+            (
+                dt(1970, 1, 1) + td(microseconds=(first_ns + 500) // 1000),
+                rate,
+                np.concatenate(samples)[first:last],
+            )
+        )
+
+    return trimmed
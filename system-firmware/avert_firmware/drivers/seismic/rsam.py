@@ -0,0 +1,255 @@
+"""
+Real-time seismic amplitude (RSAM) and spectral amplitude (SSAM) measurements, computed
+on the node as waveform data are retrieved from the datalogger, e.g.:
+
+    [components.seismic.rsam]
+    window = 60
+    band = [1.0, 10.0]
+    taps = 101
+    ssam_bands = [[0.5, 1.0], [1.0, 2.0], [2.0, 5.0], [5.0, 10.0]]
+    priority = 1
+
+For each channel, RSAM is the mean absolute amplitude, in counts, of the waveform after
+an FIR bandpass filter, and SSAM the mean spectral amplitude within each frequency band,
+over consecutive windows aligned to the clock (here, each minute). Windows are processed
+all at once, as the rows of a single array.
+
+The data are processed as a stream: the samples not yet filtered or not yet making up a
+full window are carried over, in the state directory, to the next retrieval, so the
+filter runs seamlessly from one retrieval to the next and no window is lost at the
+joins. Windows not fully covered by data (i.e. at a gap) are skipped.
+
+The measurements are written out as a small product file, telemetered ahead of the
+waveform data themselves.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from calendar import timegm
+from datetime import datetime as dt, timedelta as td
+from functools import lru_cache
+import os
+import pathlib
+
+import numpy as np
+
+from avert_firmware.utilities.policy import write_policy
+
+
+PRODUCT = "RSAM"
+
+
+@lru_cache
+def bandpass_taps(low: float, high: float, rate: float, n_taps: int) -> np.ndarray:
+    """
+    Design a linear-phase FIR bandpass filter, by the windowed-sinc method.
+
+    Parameters
+    ----------
+    low: Lower corner frequency, in Hz.
+    high: Upper corner frequency, in Hz. Limited to just under the Nyquist frequency.
+    rate: Sampling rate, in Hz.
+    n_taps: Number of taps. Must be odd.
+
+    Returns
+    -------
+    taps: The filter coefficients.
+
+    """
+
+    if n_taps % 2 == 0:
+        raise ValueError("An FIR bandpass filter needs an odd number of taps.")
+
+    high = min(high, 0.49 * rate)
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    window = np.hamming(n_taps)
+
+    def lowpass(corner):
+        taps = np.sinc(2 * corner / rate * n) * window
+        return taps / taps.sum()
+
+    # The difference of two unit-gain lowpass filters has no gain at DC
+    return lowpass(high) - lowpass(low)
+
+
+def _filter(samples: np.ndarray, taps: np.ndarray) -> np.ndarray:
+    """Filter by FFT convolution, keeping only the fully-overlapped output."""
+
+    n_fft = 1 << int(len(samples) + len(taps) - 1).bit_length()
+    filtered = np.fft.irfft(
+        np.fft.rfft(samples, n_fft) * np.fft.rfft(taps, n_fft), n_fft
+    )
+
+    return filtered[len(taps) - 1 : len(samples)]
+
+
+class RSAMStream:
+    """
+    Computes RSAM and SSAM for one channel, as a stream of data.
+
+    Parameters
+    ----------
+    rsam_config: RSAM configuration.
+    state_file: Path of the file in which the samples carried over are kept.
+
+    """
+
+    def __init__(self, rsam_config: dict, state_file: pathlib.Path):
+        self.window = rsam_config.get("window", 60)
+        self.band = rsam_config.get("band", [1.0, 10.0])
+        self.n_taps = rsam_config.get("taps", 101)
+        self.ssam_bands = rsam_config.get("ssam_bands", [])
+        self.state_file = state_file
+
+        try:
+            with np.load(state_file) as state:
+                self._start, self._rate = float(state["start"]), float(state["rate"])
+                self._carry = state["samples"]
+        except (FileNotFoundError, ValueError, KeyError):
+            self._start, self._rate, self._carry = None, None, None
+
+    @property
+    def columns(self) -> list[str]:
+        """Names of the measurements made for each window."""
+
+        return ["rsam"] + [f"ssam_{low:g}_{high:g}" for low, high in self.ssam_bands]
+
+    def _join(self, start: float, rate: float, samples: np.ndarray) -> tuple:
+        """Prepend the samples carried over, if the segment follows on from them."""
+
+        if self._carry is None or rate != self._rate:
+            return start, samples
+
+        expected = self._start + len(self._carry) / rate
+        overlap = round((expected - start) * rate)
+        if overlap < 0:
+            # A gap - the samples carried over are no longer of use
+            return start, samples
+
+        return self._start, np.concatenate([self._carry, samples[overlap:]])
+
+    def update(self, segments: list) -> list[tuple[dt, list[float]]]:
+        """
+        Process newly retrieved data.
+
+        Parameters
+        ----------
+        segments: Contiguous segments of data, in time order, each as its start time,
+                  sampling rate, and samples (see `miniseed.read_channel`).
+
+        Returns
+        -------
+        measurements: Start time of each full window, with its measurements.
+
+        """
+
+        measurements = []
+        for starttime, rate, samples in segments:
+            start = timegm(starttime.timetuple()) + starttime.microsecond * 1e-6
+            start, samples = self._join(start, rate, samples)
+            measurements += self._process(start, rate, samples.astype(np.float64))
+
+        return measurements
+
+    def _process(self, start: float, rate: float, samples: np.ndarray) -> list:
+        half = (self.n_taps - 1) // 2
+        per_window = round(self.window * rate)
+
+        # Position of the first sample relative to the clock, in whole samples - the
+        # window arithmetic is done in sample indices, as epoch-scale times are too
+        # coarse for it. Filtered sample j falls at raw sample j + half.
+        whole_seconds = int(start)
+        window_origin = whole_seconds - whole_seconds % self.window
+        position = round((whole_seconds - window_origin + start % 1) * rate) + half
+        first = -position % per_window
+        n_filtered = max(0, len(samples) - self.n_taps + 1)
+        n_windows = max(0, (n_filtered - first) // per_window)
+
+        measurements = []
+        if n_windows > 0:
+            taps = bandpass_taps(*self.band, rate, self.n_taps)
+            stop = first + n_windows * per_window
+            filtered = _filter(samples[: stop + self.n_taps - 1], taps)
+            windows = filtered[first:stop].reshape(n_windows, per_window)
+            values = [np.abs(windows).mean(axis=1)]
+
+            if self.ssam_bands:
+                raw = samples[first + half : stop + half].reshape(n_windows, per_window)
+                raw = raw - raw.mean(axis=1, keepdims=True)
+                amplitude = np.abs(np.fft.rfft(raw, axis=1)) * 2 / per_window
+                frequencies = np.fft.rfftfreq(per_window, 1 / rate)
+                bands = np.array(
+                    [
+                        (frequencies >= low) & (frequencies < high)
+                        for low, high in self.ssam_bands
+                    ],
+                    dtype=np.float64,
+                )
+                values += list(
+                    (amplitude @ bands.T / np.maximum(bands.sum(axis=1), 1)).T
+                )
+
+            windows_in = (position + first) // per_window
+            first_window = window_origin + windows_in * self.window
+            measurements = [
+                (dt(1970, 1, 1) + td(seconds=first_window + i * self.window), list(row))
+                for i, row in enumerate(np.stack(values, axis=1))
+            ]
+        else:
+            stop = min(first, n_filtered)
+
+        # Carry over whatever is needed to filter the next window through
+        self._start, self._rate = start + stop / rate, rate
+        self._carry = samples[stop:].astype(np.int32)
+
+        return measurements
+
+    def save(self) -> None:
+        """Keep the samples carried over for the next retrieval."""
+
+        if self._carry is None:
+            return
+
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_state_file = self.state_file.with_name(f".{self.state_file.name}")
+        with tmp_state_file.open("wb") as f:
+            np.savez(f, start=self._start, rate=self._rate, samples=self._carry)
+        os.replace(tmp_state_file, self.state_file)
+
+
+def write_measurements(
+    file_: pathlib.Path, columns: list[str], rows: list, priority: int = 1
+) -> None:
+    """
+    Write out RSAM and SSAM measurements, in time order, with a telemetry priority.
+
+    Parameters
+    ----------
+    file_: Path of the file to be written.
+    columns: Names of the measurements.
+    rows: Start time of each window, its channel, and its measurements.
+    priority: Telemetry priority of the file.
+
+    """
+
+    if not rows:
+        return
+
+    lines = [",".join(["timestamp", "channel"] + columns)]
+    lines += [
+        ",".join(
+            [window_start.isoformat(timespec="seconds"), channel]
+            + [f"{value:.2f}" for value in values]
+        )
+        for window_start, channel, values in sorted(rows)
+    ]
+
+    write_policy(file_, priority=priority)
+    tmp_file = file_.with_name(f".{file_.name}")
+    tmp_file.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_file, file_)
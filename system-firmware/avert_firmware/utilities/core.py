@@ -10,6 +10,7 @@ Module containing general utilities used throughout the package.
 """
 
 from datetime import datetime as dt, timedelta as td
+import hashlib
 import pathlib
 import subprocess
 from subprocess import DEVNULL
@@ -170,6 +171,17 @@ def _retry_command_on_failure(
     return return_code
 
 
+def sha256sum(file_: pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    """Compute the SHA-256 digest of a file, reading it in chunks."""
+
+    digest = hashlib.sha256()
+    with file_.open("rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
 def get_starttime_endtime(now: dt, timestep: int = 10) -> tuple[dt, dt]:
     """
     Utility function to calculate the UTC start/end times to request.
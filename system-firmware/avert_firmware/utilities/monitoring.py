@@ -0,0 +1,217 @@
+"""
+Utilities shared by the file monitors (on nodes and on the server), which watch
+directories for new files using `inotify`.
+
+`inotify` only reports files as they arrive, so anything that arrived while a monitor
+was not running - or whose event was dropped because the kernel event queue overflowed -
+would otherwise never be processed. The monitors therefore reconcile the watched
+directories against the pipeline by scanning them at start-up, whenever the queue
+overflows, and periodically thereafter, as a backstop.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pathlib
+import struct
+import threading
+import time
+
+import inotify.adapters
+import inotify.constants
+
+
+RECONCILE_INTERVAL = 300.0
+DEFERRED_INTERVAL = 5.0
+
+# Header of each event read from an inotify file descriptor: the watch descriptor,
+# mask, cookie, and length of the (NUL-padded) name that follows
+EVENT_HEADER = struct.Struct("iIII")
+EventHeader = namedtuple("EventHeader", ["wd", "mask", "cookie", "len"])
+
+
+class InFlight:
+    """
+    A thread-safe register of files currently queued for, or undergoing, processing.
+    Used to make sure a file discovered more than once (by a scan and by an event, for
+    example) only passes through the pipeline once.
+
+    """
+
+    def __init__(self):
+        self._paths = set()
+        self._lock = threading.Lock()
+
+    def claim(self, path: pathlib.Path) -> bool:
+        """Register a file, returning False if it is already in flight."""
+
+        with self._lock:
+            if path in self._paths:
+                return False
+            self._paths.add(path)
+            return True
+
+    def release(self, path: pathlib.Path) -> None:
+        """Remove a file from the register once it has been dealt with."""
+
+        with self._lock:
+            self._paths.discard(path)
+
+
+class Watcher(inotify.adapters.Inotify):
+    """
+    An inotify watcher that also reports queue overflows.
+
+    The kernel reports an overflow against no watch (a watch descriptor of -1), and the
+    `inotify` adapter drops any event it cannot map onto one of its watches - so the
+    events are read here instead, with an overflow yielded with an empty path.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._watched = {}
+        self._pending = b""
+        super().__init__(*args, **kwargs)
+
+    def add_watch(self, path_unicode, mask=inotify.constants.IN_ALL_EVENTS):
+        wd = super().add_watch(path_unicode, mask)
+        if wd is not None:
+            self._watched[wd] = path_unicode
+
+        return wd
+
+    def remove_watch_with_id(self, wd, superficial=False):
+        super().remove_watch_with_id(wd, superficial)
+        self._watched.pop(wd, None)
+
+    def _handle_inotify_event(self, wd):
+        data = os.read(wd, 4096)
+        if not data:
+            return
+
+        self._pending += data
+        while len(self._pending) >= EVENT_HEADER.size:
+            header = EventHeader(*EVENT_HEADER.unpack_from(self._pending))
+            event_length = EVENT_HEADER.size + header.len
+            if len(self._pending) < event_length:
+                return
+            filename = self._pending[EVENT_HEADER.size : event_length].rstrip(b"\0")
+            self._pending = self._pending[event_length:]
+
+            type_names = self._get_event_names(header.mask)
+            if header.mask & inotify.constants.IN_Q_OVERFLOW:
+                yield header, type_names, "", ""
+            elif (path := self._watched.get(header.wd)) is not None:
+                yield header, type_names, path, filename.decode("utf8")
+
+
+def watch_directories(directories: list) -> Watcher:
+    """
+    Create an inotify watcher over a set of directories.
+
+    Parameters
+    ----------
+    directories: Paths to the directories to be watched.
+
+    Returns
+    -------
+    watcher: The inotify watcher.
+
+    """
+
+    watcher = Watcher()
+    for directory in directories:
+        watcher.add_watch(str(directory))
+
+    return watcher
+
+
+def watch_events(watcher: Watcher):
+    """
+    Yield events from an inotify watcher, or None whenever it is idle.
+
+    By default, the `inotify` adapter raises on a queue overflow (or an unmount), which
+    would bring the monitor down - here, no event is terminal, so an overflow is
+    yielded like any other event (see `Watcher`) and the monitor can reconcile.
+
+    Parameters
+    ----------
+    watcher: The inotify watcher.
+
+    """
+
+    return watcher.event_gen(yield_nones=True, terminal_events=())
+
+
+def next_reconcile_time(deferred: bool) -> float:
+    """
+    When to next reconcile: soon, if files were deferred by the last scan, otherwise
+    after the regular interval, to catch anything missed (e.g. files written while a
+    watch was being set up).
+
+    """
+
+    return time.time() + (DEFERRED_INTERVAL if deferred else RECONCILE_INTERVAL)
+
+
+def _scan_directory(directory: pathlib.Path, min_age: float) -> tuple[list, bool]:
+    """List the settled, non-hidden regular files in a single directory."""
+
+    files, deferred = [], False
+    cutoff = time.time() - min_age
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file(
+                    follow_symlinks=False
+                ):
+                    continue
+                if min_age > 0 and entry.stat().st_mtime > cutoff:
+                    deferred = True
+                    continue
+                files.append(pathlib.Path(entry.path))
+    except FileNotFoundError:
+        pass
+
+    return files, deferred
+
+
+def scan_directories(
+    directories: list, min_age: float = 5.0, max_workers: int = 8
+) -> tuple[list, bool]:
+    """
+    Scan a set of directories in parallel for files awaiting processing.
+
+    Files modified within the last `min_age` seconds may still be being written, so
+    are deferred - they will either raise their own event once closed, or be picked up
+    by a subsequent scan.
+
+    Parameters
+    ----------
+    directories: Paths to the directories to be scanned.
+    min_age: Minimum time, in seconds, since a file was last modified.
+    max_workers: Maximum number of directories to scan concurrently.
+
+    Returns
+    -------
+    files: Paths of the files found, in name order within each directory.
+    deferred: True if any files were too recently modified to be included.
+
+    """
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(lambda d: _scan_directory(d, min_age), directories)
+        )
+
+    files = [file_ for found, _ in results for file_ in sorted(found)]
+    deferred = any(deferred for _, deferred in results)
+
+    return files, deferred
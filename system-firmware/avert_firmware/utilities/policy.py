@@ -0,0 +1,85 @@
+"""
+Per-file telemetry policies, which let a driver tell the node file monitor how a file it
+has acquired should be handled beyond archival - e.g. that it should be archived but not
+telemetered.
+
+A policy has three settings:
+
+    transmit: Whether the file is to be telemetered at all.
+    archive: Whether the file is to be archived on the node (tier copies of images, for
+             example, are made purely for telemetry).
+    priority: Order in which files are telemetered - lower numbers first.
+
+A policy is kept in a small JSON sidecar file, in a hidden directory alongside the data
+file, so it is invisible to the file monitor itself. The file monitor carries the policy
+along with the file from the receive directory to the transmit directory. Files without
+a policy are handled as they always have been.
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import json
+import os
+import pathlib
+
+
+POLICY_DIRNAME = ".policy"
+DEFAULT_POLICY = {"transmit": True, "archive": True, "priority": 5}
+
+
+def policy_path(file_: pathlib.Path) -> pathlib.Path:
+    """The path of the sidecar file holding the policy for a data file."""
+
+    return file_.parent / POLICY_DIRNAME / f"{file_.name}.json"
+
+
+def write_policy(file_: pathlib.Path, **policy) -> None:
+    """
+    Set the policy for a data file. This should be done before the data file itself
+    appears, so the file monitor never sees the file without its policy.
+
+    Parameters
+    ----------
+    file_: Path to the data file.
+    policy: Policy settings, e.g. `transmit=False`.
+
+    """
+
+    sidecar = policy_path(file_)
+    sidecar.parent.mkdir(parents=True, exist_ok=True)
+    tmp_sidecar = sidecar.with_name(f".{sidecar.name}")
+    tmp_sidecar.write_text(json.dumps(policy))
+    os.replace(tmp_sidecar, sidecar)
+
+
+def read_policy(file_: pathlib.Path) -> dict:
+    """
+    Get the policy for a data file.
+
+    Parameters
+    ----------
+    file_: Path to the data file.
+
+    Returns
+    -------
+    policy: The policy settings, with defaults for any that were not set.
+
+    """
+
+    try:
+        policy = json.loads(policy_path(file_).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        policy = {}
+
+    return {**DEFAULT_POLICY, **policy}
+
+
+def clear_policy(file_: pathlib.Path) -> None:
+    """Remove the policy for a data file, if it has one."""
+
+    policy_path(file_).unlink(missing_ok=True)
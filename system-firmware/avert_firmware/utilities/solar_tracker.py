@@ -1,6 +1,9 @@
 """
 Small module for calculating sunrise/sunset times for a given point in the world.
 
+Whole years of sunrise/sunset times are calculated at once, and cached on disk, so
+checking whether it is day or night is just a lookup.
+
 :copyright:
     2023, The AVERT System Team.
 :license:
@@ -9,11 +12,17 @@ Small module for calculating sunrise/sunset times for a given point in the world
 
 """
 
-from datetime import datetime, time, timedelta
-from math import degrees as deg, radians as rad
-from math import cos, sin, acos, asin, tan
+from datetime import date, datetime, time
+from functools import lru_cache
+import os
+import pathlib
 from zoneinfo import ZoneInfo
 
+import numpy as np
+
+
+SOLAR_CACHE_DIR = pathlib.Path.home() / ".cache" / "avert" / "solar"
+
 
 def calculate_solar_timetable(
     longitude: float, latitude: float, dt: datetime, timezone_offset: float
@@ -69,6 +78,24 @@ def evaluate_orbital_parameters(
     date = (dt - datetime(year=1900, month=1, day=1)).days + 2
     fraction_of_day = 0.5
     julian_day = date + 2415018.5 + fraction_of_day - timezone_offset / 24
+
+    equation_of_time, hour_angle = _orbital_parameters(
+        np.float64(julian_day), latitude
+    )
+
+    return float(equation_of_time), float(hour_angle)
+
+
+def _orbital_parameters(
+    julian_day: np.ndarray, latitude: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised core of `evaluate_orbital_parameters`, for any number of (Julian)
+    days at once. Where the Sun does not set (or rise) at all, the hour angle is
+    taken to be 180 (or 0) degrees.
+
+    """
+
     julian_century = (julian_day - 2451545) / 36525
     geom_mean_sun_longitude = (
         280.46646 + julian_century * (36000.76983 + julian_century * 0.0003032)
@@ -80,10 +107,11 @@ def evaluate_orbital_parameters(
         0.000042037 + 0.0000001267 * julian_century
     )
     eq_of_centre_sun = (
-        sin(rad(geom_mean_sun_anomaly))
+        np.sin(np.radians(geom_mean_sun_anomaly))
         * (1.914602 - julian_century * (0.004817 + 0.000014 * julian_century))
-        + sin(rad(2 * geom_mean_sun_anomaly)) * (0.019993 - 0.000101 * julian_century)
-        + sin(rad(3 * geom_mean_sun_anomaly)) * 0.000289
+        + np.sin(np.radians(2 * geom_mean_sun_anomaly))
+        * (0.019993 - 0.000101 * julian_century)
+        + np.sin(np.radians(3 * geom_mean_sun_anomaly)) * 0.000289
     )
     sun_true_longitude = geom_mean_sun_longitude + eq_of_centre_sun
     mean_oblique_ecliptic = (
@@ -102,37 +130,106 @@ def evaluate_orbital_parameters(
     sun_apparent_longitude = (
         sun_true_longitude
         - 0.00569
-        - 0.00478 * sin(rad(125.04 - 1934.136 * julian_century))
-    )
-    oblique_correction = mean_oblique_ecliptic + 0.00256 * cos(
-        rad(125.04 - 1934.136 * julian_century)
+        - 0.00478 * np.sin(np.radians(125.04 - 1934.136 * julian_century))
     )
-    var_y = tan(rad(oblique_correction / 2)) * tan(rad(oblique_correction / 2))
-    sun_declination = deg(
-        asin(sin(rad(oblique_correction)) * sin(rad(sun_apparent_longitude)))
+    oblique_correction = mean_oblique_ecliptic + 0.00256 * np.cos(
+        np.radians(125.04 - 1934.136 * julian_century)
     )
-
-    hour_angle = deg(
-        acos(
-            cos(rad(90.833)) / (cos(rad(latitude)) * cos(rad(sun_declination)))
-            - tan(rad(latitude)) * tan(rad(sun_declination))
+    var_y = np.tan(np.radians(oblique_correction / 2)) ** 2
+    sun_declination = np.degrees(
+        np.arcsin(
+            np.sin(np.radians(oblique_correction))
+            * np.sin(np.radians(sun_apparent_longitude))
         )
     )
 
-    equation_of_time = 4 * deg(
-        var_y * sin(2 * rad(geom_mean_sun_longitude))
-        - 2 * orbital_eccentricity * sin(rad(geom_mean_sun_anomaly))
+    cos_hour_angle = np.cos(np.radians(90.833)) / (
+        np.cos(np.radians(latitude)) * np.cos(np.radians(sun_declination))
+    ) - np.tan(np.radians(latitude)) * np.tan(np.radians(sun_declination))
+    hour_angle = np.degrees(np.arccos(np.clip(cos_hour_angle, -1.0, 1.0)))
+
+    sun_longitude = np.radians(geom_mean_sun_longitude)
+    sun_anomaly = np.radians(geom_mean_sun_anomaly)
+    equation_of_time = 4 * np.degrees(
+        var_y * np.sin(2 * sun_longitude)
+        - 2 * orbital_eccentricity * np.sin(sun_anomaly)
         + 4
         * orbital_eccentricity
         * var_y
-        * (sin(rad(geom_mean_sun_anomaly)) * cos(2 * rad(geom_mean_sun_longitude)))
-        - 0.5 * var_y**2 * sin(4 * rad(geom_mean_sun_longitude))
-        - 1.25 * orbital_eccentricity**2 * sin(2 * rad(geom_mean_sun_anomaly))
+        * (np.sin(sun_anomaly) * np.cos(2 * sun_longitude))
+        - 0.5 * var_y**2 * np.sin(4 * sun_longitude)
+        - 1.25 * orbital_eccentricity**2 * np.sin(2 * sun_anomaly)
     )
 
     return equation_of_time, hour_angle
 
 
+def solar_timetable(
+    longitude: float,
+    latitude: float,
+    year: int,
+    cache_dir: pathlib.Path = SOLAR_CACHE_DIR,
+) -> np.ndarray:
+    """
+    Calculate the sunrise, solar noon, and sunset times for every day of a year at a
+    location, in one go. Timetables are cached on disk (and in memory), so after the
+    first call for a location each year, this is just a lookup.
+
+    Parameters
+    ----------
+    longitude: Geographical coordinate denoting how many degrees E(+) or W(-).
+    latitude: Geographical coordinate denoting how many degrees N(+) or S(-).
+    year: The year of interest.
+    cache_dir: Directory in which timetables are cached.
+
+    Returns
+    -------
+    timetable: Sunrise, solar noon, and sunset, as UTC POSIX timestamps, for each
+               (UTC) day of the year - with one extra day either side, so row `n` is
+               day-of-year `n`.
+
+    """
+
+    return _solar_timetable(round(longitude, 4), round(latitude, 4), year, cache_dir)
+
+
+@lru_cache(maxsize=8)
+def _solar_timetable(
+    longitude: float, latitude: float, year: int, cache_dir: pathlib.Path
+) -> np.ndarray:
+    cache_file = cache_dir / f"{longitude:+.4f}_{latitude:+.4f}_{year}.npy"
+    try:
+        timetable = np.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        epoch = date(1900, 1, 1)
+        first_day = (date(year, 1, 1) - epoch).days - 1
+        last_day = (date(year + 1, 1, 1) - epoch).days
+        days = np.arange(first_day, last_day + 1, dtype=np.float64)
+
+        # As in `evaluate_orbital_parameters`, at noon UTC
+        equation_of_time, hour_angle = _orbital_parameters(
+            days + 2 + 2415019.0, latitude
+        )
+
+        # Minutes after midnight UTC, then seconds since the POSIX epoch
+        solar_noon = 720 - 4 * longitude - equation_of_time
+        midnight = (days - (date(1970, 1, 1) - epoch).days) * 86400
+        timetable = midnight[:, None] + 60 * np.stack(
+            [solar_noon - 4 * hour_angle, solar_noon, solar_noon + 4 * hour_angle],
+            axis=1,
+        )
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_cache_file = cache_dir / f".{cache_file.name}"
+        with tmp_cache_file.open("wb") as f:
+            np.save(f, timetable)
+        os.replace(tmp_cache_file, cache_file)
+
+    timetable.flags.writeable = False
+
+    return timetable
+
+
 def day_fraction2time(day: float) -> time:
     """
     Convert a fraction of a day to hours and minutes e.g. 0.5 = 12:00:00.
@@ -189,7 +286,8 @@ def is_it_daytime(
     ----------
     longitude: Geographical coordinate denoting how many degrees E(+) or W(-).
     latitude: Geographical coordinate denoting how many degrees N(+) or S(-).
-    timezone: Simple text identifier for the timezone of the location.
+    timezone: Simple text identifier for the timezone of the location (no longer
+              needed, as the timetable is worked out in UTC).
     buffer: How many hours of buffer to use at the start/end of the day.
 
     Returns
@@ -198,34 +296,15 @@ def is_it_daytime(
 
     """
 
-    naive_utc_dt = datetime.utcnow()
-    utc_dt = naive_utc_dt.replace(tzinfo=ZoneInfo("UTC"))
-    local_dt = utc_dt.astimezone(ZoneInfo(timezone))
+    utc_dt = datetime.now(ZoneInfo("UTC"))
+    now = utc_dt.timestamp()
 
-    timezone_offset = (
-        local_dt.utcoffset().days * 24.0 + local_dt.utcoffset().seconds / 3600
-    )
-
-    if utc_dt.hour < abs(timezone_offset):
-        date_correction = timedelta(days=1)
-    else:
-        date_correction = timedelta(days=0)
+    # The day either side is checked too, as (in UTC) a day's sunset may come after
+    # midnight, or its sunrise before
+    day = utc_dt.timetuple().tm_yday
+    timetable = solar_timetable(longitude, latitude, utc_dt.year)
+    sunrise, _, sunset = timetable[day - 1 : day + 2].T
 
-    sunrise, solar_noon, sunset = calculate_solar_timetable(
-        longitude, latitude, naive_utc_dt - date_correction, timezone_offset
+    return bool(
+        np.any((sunrise - buffer * 3600 < now) & (now < sunset + buffer * 3600))
     )
-
-    sunrise_local, sunrise_utc = timezone_aware_time(
-        datetime.combine(utc_dt.date(), day_fraction2time(sunrise)), timezone
-    )
-    solar_noon_local, solar_noon_utc = timezone_aware_time(
-        datetime.combine(utc_dt.date(), day_fraction2time(solar_noon)), timezone
-    )
-    sunset_local, sunset_utc = timezone_aware_time(
-        datetime.combine(utc_dt.date(), day_fraction2time(sunset)), timezone
-    )
-
-    after_sunrise = utc_dt > sunrise_utc - timedelta(hours=buffer)
-    before_sunset = utc_dt < sunset_utc + timedelta(hours=buffer)
-
-    return after_sunrise and before_sunset
@@ -0,0 +1,113 @@
+"""
+Benchmark the per-frame cost of near-duplicate detection, visibility scoring, and frame
+stacking on the imagery path, to check they keep up with the burst cadence on the
+node's single-board computer.
+
+Usage:
+    python benchmarks/bench_imagery.py [-n FRAMES]
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import argparse
+import pathlib
+import tempfile
+import time
+
+import imageio.v3 as iio
+import numpy as np
+
+from avert_firmware.drivers.imagery.analysis import (
+    DuplicateFilter,
+    jpeg_signature,
+    signature,
+    visibility,
+)
+from avert_firmware.drivers.imagery.stacking import FrameStack
+
+
+FRAMES = {
+    "thermal 640x512 (14-bit)": ((512, 640), np.uint16, 14),
+    "visible 1920x1080 (mono)": ((1080, 1920), np.uint8, 8),
+    "visible 1920x1080 (RGB)": ((1080, 1920, 3), np.uint8, 8),
+    "visible 4056x3040 (RGB)": ((3040, 4056, 3), np.uint8, 8),
+}
+
+
+STACK_SIZE = 8
+
+
+def _report(label: str, elapsed: float, n_frames: int) -> None:
+    per_frame = elapsed / n_frames
+    print(f"{label:<40} {per_frame * 1e3:8.2f} ms/frame {1 / per_frame:9.1f} frames/s")
+
+
+def bench(n_frames: int) -> None:
+    rng = np.random.default_rng(42)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = pathlib.Path(tmp_dir)
+        duplicates = DuplicateFilter(tmp_dir / "state.npy", threshold=0.02)
+
+        for label, (shape, dtype, bit_depth) in FRAMES.items():
+            image = rng.integers(0, 2**bit_depth, shape, dtype=dtype)
+
+            start = time.perf_counter()
+            for _ in range(n_frames):
+                frame_signature = signature(image, bit_depth)
+                if not duplicates.is_duplicate(frame_signature):
+                    duplicates.accept(frame_signature)
+            _report(f"signature: {label}", time.perf_counter() - start, n_frames)
+
+            start = time.perf_counter()
+            for _ in range(n_frames):
+                visibility(image, bit_depth)
+            _report(f"visibility: {label}", time.perf_counter() - start, n_frames)
+
+            if dtype != np.uint8:
+                continue
+
+            # Stacks of STACK_SIZE slightly shifted frames
+            frames = [np.roll(image, (i, -i), axis=(0, 1)) for i in range(STACK_SIZE)]
+            for method in ("mean", "median"):
+                stack = FrameStack(STACK_SIZE, method)
+                n_stacks = max(1, n_frames // STACK_SIZE)
+                start = time.perf_counter()
+                for _ in range(n_stacks):
+                    stack.capture(iter(frames).__next__)
+                _report(
+                    f"stack ({method}): {label}",
+                    time.perf_counter() - start,
+                    n_stacks * STACK_SIZE,
+                )
+
+            jpeg = tmp_dir / "frame.jpg"
+            iio.imwrite(jpeg, image, quality=75)
+            start = time.perf_counter()
+            for _ in range(n_frames):
+                frame_signature = jpeg_signature(jpeg)
+                if not duplicates.is_duplicate(frame_signature):
+                    duplicates.accept(frame_signature)
+            _report(f"JPEG proxy: {label}", time.perf_counter() - start, n_frames)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-n",
+        "--frames",
+        help="Specify the number of frames to time for each case.",
+        type=int,
+        default=50,
+    )
+
+    args = parser.parse_args()
+
+    bench(args.frames)
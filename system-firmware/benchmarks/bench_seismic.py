@@ -0,0 +1,226 @@
+"""
+Benchmark the decoding of Steim1 and Steim2 compressed miniSEED on the node's
+single-board computer, to check that waveforms can be processed on the node as they are
+retrieved from the datalogger - and of computing RSAM/SSAM from them.
+
+The records are synthesised here, from a random walk, by a simple (slow) greedy Steim
+encoder, so no ObsPy is needed. Both stages are also checked: decoding must round-trip,
+and RSAM computed over a stream of retrievals - starting part-way through a second, and
+overlapping one another - must match RSAM computed in one go.
+
+Usage:
+    python benchmarks/bench_seismic.py [-m MINUTES] [-r RATE] [-n REPEATS]
+
+:copyright:
+    2024, The AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import argparse
+from datetime import datetime as dt, timedelta as td
+import pathlib
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from avert_firmware.drivers.seismic.miniseed import (
+    FIXED_HEADER,
+    FRAME_WORDS,
+    STEIM1,
+    STEIM2,
+    read_channel,
+)
+from avert_firmware.drivers.seismic.rsam import RSAMStream
+
+
+# Number of differences, their width, and the nibble and dnib that flag them, densest
+# first
+PACKINGS = {
+    STEIM1: [(4, 8, 1, None), (2, 16, 2, None), (1, 32, 3, None)],
+    STEIM2: [
+        (7, 4, 3, 2),
+        (6, 5, 3, 1),
+        (5, 6, 3, 0),
+        (4, 8, 1, None),
+        (3, 10, 2, 3),
+        (2, 15, 2, 2),
+        (1, 30, 2, 1),
+    ],
+}
+DATA_OFFSET = 64
+RSAM_CONFIG = {"window": 60, "ssam_bands": [[0.5, 1.0], [1.0, 2.0], [2.0, 5.0]]}
+
+
+def _pack_word(diffs: np.ndarray, encoding: int) -> tuple[int, int, int]:
+    """
+    Pack as many differences as fit into a word, returning the word, its nibble, and
+    the number of differences packed. Where too few differences are left to fill a
+    word, it is padded with zeros.
+
+    """
+
+    for count, width, nibble, dnib in PACKINGS[encoding]:
+        chunk = np.pad(diffs[:count], (0, max(0, count - len(diffs))))
+        limit = 1 << (width - 1)
+        if np.all((chunk >= -limit) & (chunk < limit)):
+            word = 0 if dnib is None else dnib
+            for diff in chunk:
+                word = (word << width) | (int(diff) & ((1 << width) - 1))
+            return word & 0xFFFFFFFF, nibble, min(count, len(diffs))
+
+
+def _encode(
+    samples: np.ndarray, rate: int, starttime: dt, encoding: int, record_length: int
+) -> bytes:
+    n_frames = (record_length - DATA_OFFSET) // (4 * FRAME_WORDS)
+    diffs = np.diff(samples, prepend=0).astype(np.int64)
+
+    records, position = [], 0
+    while position < len(samples):
+        words, nibbles, end = [], [], position
+        for frame in range(n_frames):
+            # The first frame also holds the forward and reverse integration constants
+            n_reserved = 3 if frame == 0 else 1
+            words += [0] * n_reserved
+            nibbles += [0] * n_reserved
+            for _ in range(FRAME_WORDS - n_reserved):
+                if end == len(samples):
+                    words.append(0)
+                    nibbles.append(0)
+                    continue
+                word, nibble, count = _pack_word(diffs[end : end + 7], encoding)
+                words.append(word)
+                nibbles.append(nibble)
+                end += count
+        for frame in range(n_frames):
+            frame_nibbles = nibbles[frame * FRAME_WORDS : (frame + 1) * FRAME_WORDS]
+            words[frame * FRAME_WORDS] = sum(
+                nibble << (30 - 2 * i) for i, nibble in enumerate(frame_nibbles)
+            )
+        words[1] = int(samples[position]) & 0xFFFFFFFF
+        words[2] = int(samples[end - 1]) & 0xFFFFFFFF
+
+        record_time = starttime + td(seconds=position / rate)
+        header = struct.pack(
+            f">{FIXED_HEADER}",
+            f"{len(records) + 1:06d}".encode(), b"D", b" ", b"NODE1", b"  ", b"BHZ",
+            b"LD", record_time.year, record_time.timetuple().tm_yday,
+            record_time.hour, record_time.minute, record_time.second,
+            record_time.microsecond // 100, end - position, rate, 1,
+            0, 0, 0, 2, 0, DATA_OFFSET, 48,
+        )
+        blockettes = struct.pack(
+            ">HHBBBx", 1000, 56, encoding, 1, record_length.bit_length() - 1
+        ) + struct.pack(">HHBbxB", 1001, 0, 0, 0, n_frames)
+        record = header + blockettes + struct.pack(f">{len(words)}I", *words)
+        records.append(record)
+        position = end
+
+    return b"".join(records)
+
+
+def _check_rsam_streaming(samples: np.ndarray, rate: int, starttime: dt) -> None:
+    """Check RSAM over overlapping retrievals matches RSAM over the whole waveform."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = pathlib.Path(tmp_dir)
+        whole = RSAMStream(RSAM_CONFIG, tmp_dir / "whole.npz").update(
+            [(starttime, rate, samples)]
+        )
+
+        streamed, chunk = [], len(samples) // 3
+        for i in range(3):
+            # Each retrieval overlaps the previous one by a second
+            first = max(0, i * chunk - rate)
+            stream = RSAMStream(RSAM_CONFIG, tmp_dir / "stream.npz")
+            streamed += stream.update(
+                [
+                    (
+                        starttime + td(seconds=first / rate),
+                        rate,
+                        samples[first : (i + 1) * chunk],
+                    )
+                ]
+            )
+            stream.save()
+
+    if [time for time, _ in streamed] != [time for time, _ in whole]:
+        raise RuntimeError("Streamed RSAM windows do not match those computed at once.")
+    difference = max(
+        np.abs(np.subtract(a, b)).max() for (_, a), (_, b) in zip(streamed, whole)
+    )
+    if difference > 1e-6:
+        raise RuntimeError("Streamed RSAM differs from RSAM computed at once.")
+
+
+def bench(minutes: int, rate: int, repeats: int) -> None:
+    rng = np.random.default_rng(42)
+    n_samples = minutes * 60 * rate
+    samples = np.cumsum(rng.normal(0, 40, n_samples)).astype(np.int32)
+    starttime = dt(2024, 5, 2, 12, 0)
+
+    for encoding, label in ((STEIM1, "Steim1"), (STEIM2, "Steim2")):
+        for record_length in (512, 4096):
+            data = _encode(samples, rate, starttime, encoding, record_length)
+            ((_, _, decoded),) = read_channel(data, "BHZ")
+            if not np.array_equal(decoded, samples):
+                raise RuntimeError(f"{label} decoding does not round-trip.")
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                read_channel(data, "BHZ")
+            elapsed = (time.perf_counter() - start) / repeats
+            print(
+                f"{label}, {record_length}-byte records: {elapsed * 1e3:8.2f} ms "
+                f"for {n_samples} samples {n_samples / elapsed / 1e6:7.2f} Msamples/s"
+            )
+
+    # Sample times part-way through a second, as from a real datalogger
+    _check_rsam_streaming(samples, rate, starttime + td(seconds=0.37))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        for i in range(repeats):
+            RSAMStream(RSAM_CONFIG, pathlib.Path(tmp_dir) / f"{i}.npz").update(
+                [(starttime, rate, samples)]
+            )
+        elapsed = (time.perf_counter() - start) / repeats
+    print(
+        f"RSAM/SSAM: {elapsed * 1e3:8.2f} ms "
+        f"for {n_samples} samples {n_samples / elapsed / 1e6:7.2f} Msamples/s"
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-m",
+        "--minutes",
+        help="Specify the length of the waveform to decode, in minutes.",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        help="Specify the sampling rate, in Hz.",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "-n",
+        "--repeats",
+        help="Specify the number of times to decode each case.",
+        type=int,
+        default=10,
+    )
+
+    args = parser.parse_args()
+
+    bench(args.minutes, args.rate, args.repeats)
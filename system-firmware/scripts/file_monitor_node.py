@@ -10,13 +10,212 @@ relevant file archive.
 
 """
 
+import collections
 import pathlib
+import queue
+import threading
+import time
 
-from avert_firmware.cli.telemeter import TELEMETRY_FN_LOOKUP
-from avert_firmware.drivers.network_relay import set_relay_state
-from avert_firmware.utilities import ping, read_config, rsync
+from avert_firmware.cli.telemeter import TELEMETRY_FN_LOOKUP, bring_up_transceiver
+from avert_firmware.utilities import read_config, rsync
+from avert_firmware.utilities.monitoring import (
+    InFlight,
+    next_reconcile_time,
+    scan_directories,
+    watch_directories,
+    watch_events,
+)
+from avert_firmware.utilities.policy import (
+    DEFAULT_POLICY,
+    clear_policy,
+    read_policy,
+    write_policy,
+)
 from avert_firmware.data_archival import id_file_format
-import inotify.adapters
+
+
+def _migrate_file(filepath: pathlib.Path) -> pathlib.Path | None:
+    """
+    Migrate a file from a receive directory into the archive and stage it for
+    telemetry, returning its path in the transmit directory on success.
+
+    """
+
+    print(f"File found in receive directory:\n\t{filepath.name}\n   ...migrating...")
+    migration_fn = id_file_format(filepath)
+    if migration_fn is None:
+        return
+
+    policy = read_policy(filepath)
+    if policy["archive"]:
+        archive_path = filepath.parents[1] / "ARCHIVE"
+        _ = migration_fn(filepath, archive_path)
+
+    if not policy["transmit"]:
+        filepath.unlink()
+        clear_policy(filepath)
+        print("   ...archived only, not for telemetry.\n")
+        return
+
+    # Sync retrieved data to transmit dir and remove from receive dir
+    transmit_dir = filepath.parents[1] / "transmit"
+    transmit_dir.mkdir(exist_ok=True, parents=True)
+
+    # The policy travels ahead of the file, so telemetry never sees it without one
+    if policy != DEFAULT_POLICY:
+        write_policy(transmit_dir / filepath.name, **policy)
+    return_code = rsync(
+        source=str(filepath),
+        destination=str(transmit_dir / filepath.name),
+        mkpath=True,
+    )
+    if return_code != 0:
+        return
+
+    filepath.unlink()
+    clear_policy(filepath)
+    print("   ...migration complete.\n")
+
+    return transmit_dir / filepath.name
+
+
+def _migration_worker(
+    migration_queue: queue.Queue, enqueue_transmit, in_flight: InFlight
+) -> None:
+    """Archive new acquisitions as they arrive, independent of telemetry."""
+
+    while True:
+        filepath = migration_queue.get()
+        try:
+            if filepath.is_file():
+                transmit_file = _migrate_file(filepath)
+                if transmit_file is not None:
+                    enqueue_transmit(transmit_file)
+        except Exception as e:
+            print(f"   ...migration of {filepath.name} failed: {e}")
+        in_flight.release(filepath)
+
+
+def _next_batch(
+    telemetry_queue: queue.Queue, backlog: list, window: float, max_size: int
+) -> list:
+    """
+    Wait for a file to telemeter, then gather any others that arrive in quick
+    succession, so a burst of files shares a single link bring-up.
+
+    """
+
+    batch = list(backlog)
+    if not batch:
+        batch.append(telemetry_queue.get())
+    while len(batch) < max_size:
+        try:
+            batch.append(telemetry_queue.get(timeout=window))
+        except queue.Empty:
+            break
+
+    return batch
+
+
+def _budget_remaining(sent: collections.deque, budget: int, period: float) -> int:
+    """Bytes that may still be sent, given those sent within the budget period."""
+
+    cutoff = time.time() - period
+    while sent and sent[0][0] < cutoff:
+        sent.popleft()
+
+    return budget - sum(size for _, size in sent)
+
+
+def _telemetry_worker(
+    telemetry_queue: queue.Queue, in_flight: InFlight, config: dict
+) -> None:
+    """
+    Telemeter files in batches, bringing the link up once per batch.
+
+    Within each batch, files are sent in order of priority. If a byte budget is
+    configured, files of priority above 0 are only sent while the budget for the
+    current period allows; the rest wait for a later batch, where they may be overtaken
+    by newer, more urgent files.
+
+    """
+
+    mode = config["telemetry"]["telemeter_by"]
+    target_ip = config["telemetry"]["target_ip"]
+    window = config["telemetry"].get("batch_window", 5.0)
+    max_size = config["telemetry"].get("batch_size", 100)
+    retry_interval = config["telemetry"].get("retry_interval", 60.0)
+    budget = config["telemetry"].get("byte_budget")
+    budget_period = config["telemetry"].get("budget_period", 3600.0)
+
+    def priority(filepath: pathlib.Path) -> tuple[int, str]:
+        return read_policy(filepath)["priority"], filepath.name
+
+    sent = collections.deque()
+    backlog = []
+    while True:
+        batch = _next_batch(telemetry_queue, backlog, window, max_size)
+        backlog = []
+
+        for filepath in batch:
+            if not filepath.is_file():
+                clear_policy(filepath)
+                in_flight.release(filepath)
+        batch = sorted(
+            (filepath for filepath in batch if filepath.is_file()), key=priority
+        )
+
+        if budget is not None:
+            remaining = _budget_remaining(sent, budget, budget_period)
+            to_send = []
+            for filepath in batch:
+                size = filepath.stat().st_size
+                if read_policy(filepath)["priority"] <= 0 or size <= remaining:
+                    to_send.append(filepath)
+                    remaining -= size
+                else:
+                    backlog.append(filepath)
+            batch = to_send
+
+        if not batch:
+            if backlog:
+                print(f"{len(backlog)} file(s) held back by the telemetry budget.")
+                time.sleep(retry_interval)
+            continue
+
+        print(f"Telemetering a batch of {len(batch)} file(s)...")
+        if bring_up_transceiver(config, mode) != 0:
+            print(f"   ...link unavailable, retrying in {retry_interval}s.\n")
+            backlog += batch
+            time.sleep(retry_interval)
+            continue
+
+        n_failed = 0
+        for filepath in batch:
+            print(f"   ...telemetering {filepath.name}...")
+            size = filepath.stat().st_size
+            try:
+                return_code = TELEMETRY_FN_LOOKUP[mode](
+                    filepath, target_ip, config["telemetry"]
+                )
+            except Exception as e:
+                print(f"   ...telemetry of {filepath.name} failed: {e}")
+                return_code = 1
+
+            if return_code == 0:
+                filepath.unlink()
+                clear_policy(filepath)
+                sent.append((time.time(), size))
+                print("   ...success.")
+                in_flight.release(filepath)
+            else:
+                backlog.append(filepath)
+                n_failed += 1
+
+        if n_failed:
+            print(f"   ...{n_failed} file(s) failed, retrying later.")
+            time.sleep(retry_interval)
+        print("")
 
 
 def monitor_for_files():
@@ -28,84 +227,76 @@ def monitor_for_files():
     `inotify` utility. The data file type (e.g. miniSEED, JPG, etc) is subsequently
     identified before the file is migrated into the appropriate archive.
 
+    Migration and telemetry run as separate stages, each with its own queue, so a slow
+    telemetry link never holds up archival of new acquisitions. Migrated files are
+    passed straight to the telemetry stage, which sends them in batches.
+
+    Files that arrived while the monitor was not running, or whose events were lost to
+    an inotify queue overflow, are found by scanning the watched directories at
+    start-up and on overflow.
+
     """
 
     config = read_config()
-    mode = config["telemetry"]["telemeter_by"]
-    target_ip = config["telemetry"]["target_ip"]
     data_dir = pathlib.Path(config["data_archive"])
 
-    i = inotify.adapters.Inotify()
-    for receive_dir in data_dir.glob("*/receive/"):
-        i.add_watch(str(receive_dir))
-    for transmit_dir in data_dir.glob("*/transmit/"):
-        i.add_watch(str(transmit_dir))
+    # Imagery streams are split by spectrum, e.g. imagery/visible/receive
+    receive_dirs = list(data_dir.glob("*/receive/"))
+    receive_dirs += list(data_dir.glob("imagery/*/receive/"))
+    transmit_dirs = list(data_dir.glob("*/transmit/"))
+    transmit_dirs += list(data_dir.glob("imagery/*/transmit/"))
+    i = watch_directories(receive_dirs + transmit_dirs)
 
-    for event in i.event_gen(yield_nones=False):
-        (_, type_names, path, filename) = event
-        if "IN_CLOSE_WRITE" not in type_names and "IN_MOVED_TO" not in type_names:
-            continue
-        
-        filepath = pathlib.Path(path) / filename
-        if filepath.name[0] == ".":  # temporary file for rsync pre-hash checks
+    migration_queue, telemetry_queue = queue.Queue(), queue.Queue()
+    in_flight = InFlight()
+
+    def enqueue(filepath: pathlib.Path) -> None:
+        if filepath.parent.name not in ["receive", "transmit"]:
+            return
+        if in_flight.claim(filepath):
+            match filepath.parent.name:
+                case "receive":
+                    migration_queue.put(filepath)
+                case "transmit":
+                    telemetry_queue.put(filepath)
+
+    threading.Thread(
+        target=_migration_worker,
+        args=(migration_queue, enqueue, in_flight),
+        daemon=True,
+    ).start()
+    threading.Thread(
+        target=_telemetry_worker,
+        args=(telemetry_queue, in_flight, config),
+        daemon=True,
+    ).start()
+
+    def reconcile() -> float:
+        """Queue any files already waiting, returning when to look again."""
+
+        files, deferred = scan_directories(receive_dirs + transmit_dirs)
+        print(f"Reconciliation scan found {len(files)} file(s) awaiting processing.")
+        for filepath in files:
+            enqueue(filepath)
+
+        return next_reconcile_time(deferred)
+
+    next_reconcile = reconcile()
+    for event in watch_events(i):
+        if event is None:
+            if time.time() >= next_reconcile:
+                next_reconcile = reconcile()
             continue
 
-        print(f"File found in {filepath.parent.name} directory:\n\t{filepath.name}")
-        match filepath.parent.name:
-            case "receive":
-                print("   ...migrating...")
-                migration_fn = id_file_format(filepath)
-                if migration_fn is None:
-                    continue
-
-                archive_path = filepath.parents[1] / "ARCHIVE"
-
-                _ = migration_fn(filepath, archive_path)
-
-                # Sync retrieved data to transmit dir and remove from receive dir
-                transmit_dir = filepath.parents[1] / "transmit"
-                transmit_dir.mkdir(exist_ok=True, parents=True)
-                return_code = rsync(
-                    source=str(filepath),
-                    destination=str(transmit_dir / filepath.name),
-                    mkpath=True,
-                )
+        (_, type_names, path, filename) = event
+        if "IN_Q_OVERFLOW" in type_names:
+            print("inotify event queue overflowed - rescanning...")
+            next_reconcile = reconcile()
+        elif "IN_CLOSE_WRITE" in type_names or "IN_MOVED_TO" in type_names:
+            # Skip temporary files, e.g. for rsync pre-hash checks
+            if filename[0] != ".":
+                enqueue(pathlib.Path(path) / filename)
 
-                print("   ...migration complete...")
-            case "transmit":
-                # Check relevant telemetry equipment is present (satellite/radio transceiver)
-                transceiver_ip = config["telemetry"]["transceiver_ip"]
-                print(f"   ...searching for telemetry equipment at {transceiver_ip}...")
-                return_code = ping(transceiver_ip)
-                if return_code != 0:
-                    print(
-                        "      ...telemetry equipment not found, attempting to power on..."
-                    )
-                    return_code = set_relay_state(
-                        config["relay"]["ip"],
-                        config["relay"][mode],
-                        1,
-                    )
-                    if return_code != 0:
-                        print("   ...power on failed.")
-                        continue
-
-                    return_code = ping(transceiver_ip)
-                    if return_code != 0:
-                        print("      ...could not power telemetry equipment.")
-                        continue
-                print("   ...found...")
-                
-                filepath = pathlib.Path(path) / filename
-                print("   ...telemetering...")
-                return_code = TELEMETRY_FN_LOOKUP[mode](
-                    filepath, target_ip, config["telemetry"]
-                )
-        
-        print("   ...cleaning up...")
-        if return_code == 0:
-            filepath.unlink()
-            print("   ...success.\n")
 
 if __name__ == "__main__":
     monitor_for_files()
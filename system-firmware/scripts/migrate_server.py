@@ -2,6 +2,12 @@
 Monitor for new files being uploaded to the upload server and shuffle them into the
 relevant file archive.
 
+Files can arrive by two routes: uploads received directly by the built-in upload
+receiver, which are handed straight to the migration queue, and files written into the
+monitored directories by any other means, which are picked up via `inotify`. Files that
+arrived while the service was down (or whose events were lost to an inotify queue
+overflow) are picked up by scanning the directories at start-up and on overflow.
+
 :copyright:
     2024, the AVERT System Team.
 :license:
@@ -12,10 +18,52 @@ relevant file archive.
 
 import argparse
 import pathlib
+import queue
 import sys
+import threading
+import time
 
 from avert_firmware.data_archival import id_file_format
-import inotify.adapters
+from avert_firmware.data_archival.receiver import run_upload_receiver
+from avert_firmware.utilities.monitoring import (
+    InFlight,
+    next_reconcile_time,
+    scan_directories,
+    watch_directories,
+    watch_events,
+)
+
+
+def _migrate(filepath: pathlib.Path, archive: pathlib.Path) -> None:
+    """Identify a file and migrate it into the archive."""
+
+    print(f"File found in receive directory:\n\t{filepath.name}\n   Migrating...")
+    migration_fn = id_file_format(filepath)
+    if migration_fn is None:
+        return
+
+    return_code = migration_fn(filepath, archive, append_datatype=True)
+    print("   ...cleaning up...")
+    if return_code == 0:
+        filepath.unlink()
+
+    print("   ...migration complete.\n")
+
+
+def _migration_worker(
+    migration_queue: queue.Queue, archive: pathlib.Path, in_flight: InFlight
+) -> None:
+    """Migrate files from the queue, one at a time, in order of arrival."""
+
+    while True:
+        filepath = migration_queue.get()
+        try:
+            if filepath.is_file():
+                _migrate(filepath, archive)
+        except Exception as e:
+            print(f"   ...migration of {filepath.name} failed: {e}")
+        in_flight.release(filepath)
+        migration_queue.task_done()
 
 
 def migrate_files(args=None):
@@ -27,6 +75,9 @@ def migrate_files(args=None):
     `inotify` utility. The data file type (e.g. miniSEED, JPG, etc) is subsequently
     identified before the file is migrated into the appropriate archive.
 
+    If an upload directory is specified, an upload receiver is also run, which places
+    completed uploads directly onto the migration queue.
+
     """
 
     archive = pathlib.Path(args.archive)
@@ -34,30 +85,64 @@ def migrate_files(args=None):
         print("Please provide a valid archive path.")
         sys.exit(2)
 
-    i = inotify.adapters.Inotify()
-    for monitor_dir in args.monitor:
-        i.add_watch(monitor_dir)
+    if args.monitor is None and args.upload_dir is None:
+        print("Please provide a directory to monitor and/or an upload directory.")
+        sys.exit(2)
 
+    migration_queue, in_flight = queue.Queue(), InFlight()
+    threading.Thread(
+        target=_migration_worker,
+        args=(migration_queue, archive, in_flight),
+        daemon=True,
+    ).start()
+
+    def enqueue(filepath: pathlib.Path) -> None:
+        if in_flight.claim(filepath):
+            migration_queue.put(filepath)
+
+    watched_dirs = [pathlib.Path(monitor_dir) for monitor_dir in args.monitor or []]
+    i = watch_directories(watched_dirs)
+
+    if args.upload_dir is not None:
+        if args.token is None:
+            print("An upload token must be provided to receive uploads.")
+            sys.exit(2)
+        upload_dir = pathlib.Path(args.upload_dir)
+        print(f"Receiving uploads into {upload_dir} on port {args.port}...")
+        threading.Thread(
+            target=run_upload_receiver,
+            args=(upload_dir, args.token, enqueue, args.port),
+            daemon=True,
+        ).start()
+        watched_dirs.append(upload_dir)
+
+    def reconcile() -> float:
+        """Queue any files already waiting, returning when to look again."""
+
+        files, deferred = scan_directories(watched_dirs)
+        print(f"Reconciliation scan found {len(files)} file(s) awaiting migration.")
+        for filepath in files:
+            enqueue(filepath)
+
+        return next_reconcile_time(deferred)
+
+    next_reconcile = reconcile()
     try:
-        for event in i.event_gen(yield_nones=False):
+        for event in watch_events(i):
+            if event is None:
+                if time.time() >= next_reconcile:
+                    next_reconcile = reconcile()
+                continue
+
             (_, type_names, path, filename) = event
-            if "IN_CLOSE_WRITE" not in type_names:
+            if "IN_Q_OVERFLOW" in type_names:
+                print("inotify event queue overflowed - rescanning...")
+                next_reconcile = reconcile()
                 continue
-            
-            filepath = pathlib.Path(path) / filename
-            print(
-                f"File found in receive directory:\n\t{filepath.name}\n   Migrating..."
-            )
-            migration_fn = id_file_format(filepath)
-            if migration_fn is None:
+            if "IN_CLOSE_WRITE" not in type_names:
                 continue
 
-            return_code = migration_fn(filepath, archive, append_datatype=True)
-            print("   ...cleaning up...")
-            if return_code == 0:
-                filepath.unlink()
-
-            print("   ...migration complete.\n")
+            enqueue(pathlib.Path(path) / filename)
     except KeyboardInterrupt:
         print("...shutting down gracefully.")
         sys.exit(0)
@@ -77,9 +162,25 @@ if __name__ == "__main__":
         "-m",
         "--monitor",
         help="Specify a path to a directory to monitor",
-        required=True,
         action="append",
     )
+    parser.add_argument(
+        "-u",
+        "--upload-dir",
+        help="Receive uploads into this directory, passing them straight to migration.",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help="Specify the port on which to receive uploads.",
+        type=int,
+        default=8000,
+    )
+    parser.add_argument(
+        "-t",
+        "--token",
+        help="Specify the token that clients must provide to upload files.",
+    )
 
     args = parser.parse_args()
 
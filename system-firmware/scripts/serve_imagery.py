@@ -0,0 +1,252 @@
+"""
+Serve images from the imagery archive, along with reduced-resolution derivatives
+(thumbnails, previews) that are generated once and cached next to the archive.
+
+Responses carry a content-derived ETag, so clients can revalidate cheaply, and
+byte-range requests are honoured, so large frames can be fetched in pieces. A derivative
+evicted from the cache while being served is regenerated, as on a first request.
+
+:copyright:
+    2024, the AVERT System Team.
+:license:
+    GNU General Public License, Version 3
+    (https://www.gnu.org/licenses/gpl-3.0.html)
+
+"""
+
+import argparse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import mimetypes
+import os
+import pathlib
+import re
+import sys
+import threading
+import time
+from typing import BinaryIO
+import urllib.parse
+
+from avert_firmware.data_archival.derivatives import (
+    CACHE_DIRNAME,
+    DERIVATIVE_SIZES,
+    evict_derivatives,
+    get_derivative,
+    lookup_digest,
+)
+
+
+# Times to resolve a request, should its file be evicted before it can be sent
+SERVE_ATTEMPTS = 3
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, file_size: int) -> tuple[int, int] | None:
+    """
+    Parse a single-part HTTP Range header into an inclusive (start, end) byte range.
+
+    Returns None if the range cannot be satisfied.
+
+    """
+
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if start == "" and end == "":
+        return None
+    if start == "":
+        # Suffix range, e.g. "bytes=-500" - the final 500 bytes
+        start, end = max(file_size - int(end), 0), file_size - 1
+    else:
+        start = int(start)
+        end = file_size - 1 if end == "" else min(int(end), file_size - 1)
+
+    if start > end or start >= file_size:
+        return None
+
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches an ETag, by weak comparison - any of its
+    comma-separated tags, less any W/ prefix, equals it exactly, or it is "*".
+
+    """
+
+    tags = [tag.strip() for tag in header.split(",")]
+
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+def make_handler(archive_root: pathlib.Path) -> type:
+    """Build a request handler class bound to a particular imagery archive."""
+
+    cache_root = archive_root / CACHE_DIRNAME
+
+    class ImageRequestHandler(BaseHTTPRequestHandler):
+        """Handles GET/HEAD requests for archived images and their derivatives."""
+
+        def do_HEAD(self):
+            self._serve(send_body=False)
+
+        def do_GET(self):
+            self._serve(send_body=True)
+
+        def _resolve(self) -> tuple[pathlib.Path, str] | None:
+            """Map the request onto a file on disk and its ETag."""
+
+            url = urllib.parse.urlsplit(self.path)
+            size_name = urllib.parse.parse_qs(url.query).get("size", ["full"])[0]
+            if size_name != "full" and size_name not in DERIVATIVE_SIZES:
+                self.send_error(HTTPStatus.BAD_REQUEST, f"Unknown size: {size_name}")
+                return
+
+            relative_path = urllib.parse.unquote(url.path).lstrip("/")
+            image = (archive_root / relative_path).resolve()
+            if (
+                not image.is_relative_to(archive_root)
+                or image.is_relative_to(cache_root)
+                or not image.is_file()
+            ):
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+
+            if size_name == "full":
+                return image, f'"{lookup_digest(image, cache_root)}"'
+
+            derivative = get_derivative(image, size_name, cache_root)
+            return derivative, f'"{derivative.stem}"'
+
+        def _serve(self, send_body: bool) -> None:
+            for _ in range(SERVE_ATTEMPTS):
+                resolved = self._resolve()
+                if resolved is None:
+                    return
+                file_, etag = resolved
+
+                if _etag_matches(self.headers.get("If-None-Match", ""), etag):
+                    self.send_response(HTTPStatus.NOT_MODIFIED)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                # Opened before anything is sent, so a derivative evicted since it was
+                # resolved is just a cache miss, and is regenerated
+                try:
+                    f = file_.open("rb")
+                except FileNotFoundError:
+                    continue
+                with f:
+                    self._send(f, file_, etag, send_body)
+                return
+
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+        def _send(
+            self, f: BinaryIO, file_: pathlib.Path, etag: str, send_body: bool
+        ) -> None:
+            file_size = os.fstat(f.fileno()).st_size
+            start, end = 0, file_size - 1
+            status = HTTPStatus.OK
+            if (range_header := self.headers.get("Range")) is not None:
+                byte_range = _parse_range(range_header, file_size)
+                if byte_range is None:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{file_size}")
+                    self.end_headers()
+                    return
+                start, end = byte_range
+                status = HTTPStatus.PARTIAL_CONTENT
+
+            self.send_response(status)
+            content_type, _ = mimetypes.guess_type(file_.name)
+            self.send_header("Content-Type", content_type or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+            self.end_headers()
+
+            if send_body:
+                self.wfile.flush()
+                self.connection.sendfile(f, offset=start, count=end - start + 1)
+
+    return ImageRequestHandler
+
+
+def _evict_periodically(cache_root: pathlib.Path, max_bytes: int, interval: int):
+    """Keep the derivative cache within its size bound."""
+
+    while True:
+        n_evicted = evict_derivatives(cache_root, max_bytes)
+        if n_evicted > 0:
+            print(f"Evicted {n_evicted} derivatives from the cache.")
+        time.sleep(interval)
+
+
+def serve_imagery(args=None):
+    """Serve the imagery archive over HTTP until interrupted."""
+
+    archive_root = pathlib.Path(args.archive).resolve()
+    if not archive_root.is_dir():
+        print("Please provide a valid archive path.")
+        sys.exit(2)
+
+    threading.Thread(
+        target=_evict_periodically,
+        args=(
+            archive_root / CACHE_DIRNAME,
+            args.cache_size * 1024**2,
+            args.evict_interval,
+        ),
+        daemon=True,
+    ).start()
+
+    server = ThreadingHTTPServer(("", args.port), make_handler(archive_root))
+    print(f"Serving {archive_root} on port {args.port}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("...shutting down gracefully.")
+        server.server_close()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "-a",
+        "--archive",
+        help="Specify the path to the imagery archive.",
+        required=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help="Specify the port on which to serve images.",
+        type=int,
+        default=8080,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Specify the maximum size of the derivative cache, in MB.",
+        type=int,
+        default=2048,
+    )
+    parser.add_argument(
+        "--evict-interval",
+        help="Specify how often to enforce the cache size limit, in seconds.",
+        type=int,
+        default=600,
+    )
+
+    args = parser.parse_args()
+
+    serve_imagery(args)